@@ -0,0 +1,99 @@
+'''
+
+Benchmarks the gcode tokenizer against the original chain of re.sub and str.replace calls which
+GcodeCanvas.reloadGcode used, and checks that both produce exactly the same lines.
+
+Run from the top level GroundControl directory:
+
+    python -m Benchmarks.gcodeTokenizerBenchmark [numberOfLines]
+
+Each file in gcodeForTesting/ is benchmarked as is, and then repeated until it is at least
+numberOfLines long (200000 by default) to approximate a large nesting job.
+
+'''
+
+from DataStructures.gcodeTokenizer           import normalizeGcode
+
+import glob
+import os
+import re
+import sys
+import time
+
+REPEATS = 5
+
+def legacyNormalizeGcode(rawfilters):
+    '''
+    
+    The normalization GcodeCanvas.reloadGcode performed before the tokenizer was introduced.
+    
+    '''
+    filtersparsed = re.sub(r'\(([^)]*)\)','',rawfilters) #removes mach3 style gcode comments
+    filtersparsed = re.sub(r';([^\n]*)\n','',filtersparsed) #removes standard ; initiated gcode comments
+    filtersparsed = re.split('\n', filtersparsed) #splits the gcode into elements to be added to the list
+    filtersparsed = [x + ' ' for x in filtersparsed] #adds a space to the end of each line
+    filtersparsed = [x.lstrip() for x in filtersparsed]
+    filtersparsed = [x.replace('X ','X') for x in filtersparsed]
+    filtersparsed = [x.replace('Y ','Y') for x in filtersparsed]
+    filtersparsed = [x.replace('Z ','Z') for x in filtersparsed]
+    filtersparsed = [x.replace('I ','I') for x in filtersparsed]
+    filtersparsed = [x.replace('J ','J') for x in filtersparsed]
+    filtersparsed = [x.replace('F ','F') for x in filtersparsed]
+    return filtersparsed
+
+def bestTime(function, rawText):
+    '''
+    
+    Returns the fastest of several runs of function(rawText) in seconds.
+    
+    '''
+    best = None
+    for _ in range(REPEATS):
+        start = time.time()
+        function(rawText)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchmark(name, rawText):
+    '''
+    
+    Times both implementations on rawText and prints the result.
+    
+    '''
+    if normalizeGcode(rawText) != legacyNormalizeGcode(rawText):
+        print("%-40s OUTPUT MISMATCH" % name)
+        return False
+    
+    lineCount   = rawText.count('\n') + 1
+    legacyTime  = bestTime(legacyNormalizeGcode, rawText)
+    newTime     = bestTime(normalizeGcode, rawText)
+    
+    print("%-40s %8d lines   legacy %8.1f ms   tokenizer %8.1f ms   speedup %5.1fx" % (name, lineCount, legacyTime*1000, newTime*1000, legacyTime/max(newTime, 1e-9)))
+    return True
+
+def main():
+    numberOfLines = 200000
+    if len(sys.argv) > 1:
+        numberOfLines = int(sys.argv[1])
+    
+    testDirectory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gcodeForTesting')
+    
+    allMatch = True
+    for filename in sorted(glob.glob(os.path.join(testDirectory, '*.nc'))):
+        gcodeFile = open(filename, 'r')
+        rawText = gcodeFile.read()
+        gcodeFile.close()
+        
+        name = os.path.basename(filename)
+        allMatch = benchmark(name, rawText) and allMatch
+        
+        copies = numberOfLines // (rawText.count('\n') + 1) + 1
+        allMatch = benchmark(name + " x" + str(copies), rawText * copies) and allMatch
+    
+    if not allMatch:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+
+Benchmarks the vectorized kinematics on random points across the work area and checks that the
+forward and inverse transforms agree.
+
+Run from the top level GroundControl directory:
+
+    python -m Benchmarks.kinematicsBenchmark [numberOfPoints]
+
+For numberOfPoints points (1000000 by default) the time for the inverse and forward transforms over
+whole arrays is printed, along with the time the inverse takes one point at a time over a sample of
+the points and the largest distance between a point and the result of the round trip.
+
+'''
+
+from Simulation.kinematics                   import Kinematics
+
+import numpy
+import sys
+import time
+
+SCALARPOINTS = 2000     #the number of points converted one at a time
+
+def main():
+    numberOfPoints = 1000000
+    if len(sys.argv) > 1:
+        numberOfPoints = int(sys.argv[1])
+
+    kinematics = Kinematics()
+    random = numpy.random.RandomState(0)
+    x = random.uniform(-kinematics.bedWidth/2, kinematics.bedWidth/2, numberOfPoints)
+    y = random.uniform(-kinematics.bedHeight/2, kinematics.bedHeight/2, numberOfPoints)
+
+    start = time.time()
+    leftLength, rightLength = kinematics.inverse(x, y)
+    inverseTime = time.time() - start
+
+    start = time.time()
+    forwardX, forwardY = kinematics.forward(leftLength, rightLength)
+    forwardTime = time.time() - start
+
+    start = time.time()
+    for index in range(min(SCALARPOINTS, numberOfPoints)):
+        kinematics.inverse(x[index], y[index])
+    scalarTime = (time.time() - start)/min(SCALARPOINTS, numberOfPoints)
+
+    roundTrip = numpy.hypot(forwardX - x, forwardY - y)
+
+    print("%d points" % numberOfPoints)
+    print("inverse      %8.1f ms   %6.2f us per point" % (inverseTime*1000, inverseTime*1e6/numberOfPoints))
+    print("forward      %8.1f ms   %6.2f us per point" % (forwardTime*1000, forwardTime*1e6/numberOfPoints))
+    print("one at a time              %6.2f us per point" % (scalarTime*1e6))
+    print("unreachable  %8d" % numpy.isnan(leftLength).sum())
+    print("round trip   %8.2g mm largest error" % numpy.nanmax(roundTrip))
+
+if __name__ == '__main__':
+    main()
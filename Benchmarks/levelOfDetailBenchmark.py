@@ -0,0 +1,75 @@
+'''
+
+Counts the segments drawn at each level of detail of ToolpathGeometry for a dense 3D relief, where
+nearly every move changes z and so gets a z-axis marker, and the end of every row is a retract, a
+rapid and a plunge.
+
+Run from the top level GroundControl directory:
+
+    python -m Benchmarks.levelOfDetailBenchmark [numberOfLines | gcodeFile]
+
+numberOfLines defaults to 1000000. If a gcode file is given it is measured instead of the relief.
+For each level the tolerance, the size of a pixel at the smallest scale the level is drawn at, and
+the segments in each buffer are printed, with the time taken to build the geometry.
+
+'''
+
+from DataStructures.gcodeProgram             import GcodeProgram
+from DataStructures.gcodeTokenizer           import readGcodeFile
+from DataStructures.toolpathGeometry         import buildToolpathGeometry, BUFFERNAMES, LEVELTOLERANCES, SIMPLIFYERROR, MAXPIXELERROR
+
+import math
+import os
+import sys
+import time
+
+def relief(numberOfLines, width = 2438.4, height = 1219.2):
+    '''
+
+    Returns lines which raster across width and down height cutting a wavy surface, lifting the bit
+    and returning to the left edge at the end of each row.
+
+    '''
+    lines   = ["G21", "G90"]
+    columns = max(2, int(math.sqrt(numberOfLines)))
+    rows    = max(1, numberOfLines//(columns + 3))
+    for row in xrange(rows):
+        y = height/2 - height*row/rows
+        lines.append("G0 Z5.000")
+        lines.append("G0 X%.3f Y%.3f" % (-width/2, y))
+        for column in xrange(columns):
+            x = -width/2 + width*column/(columns - 1)
+            z = -3 + 2*math.sin(x/40.0)*math.cos(y/30.0)
+            if column == 0:
+                lines.append("G1 Z%.3f F1000" % z)
+            else:
+                lines.append("G1 X%.3f Z%.3f" % (x, z))
+    return lines
+
+def main():
+    lines = 1000000
+    name  = "relief"
+    if len(sys.argv) > 1:
+        if os.path.isfile(sys.argv[1]):
+            name  = os.path.basename(sys.argv[1])
+            lines = readGcodeFile(sys.argv[1])
+        else:
+            lines = int(sys.argv[1])
+    if not isinstance(lines, list):
+        lines = relief(lines)
+
+    program = GcodeProgram(lines)
+
+    start = time.time()
+    geometry = buildToolpathGeometry(program)
+    buildTime = time.time() - start
+
+    print("%s: %d lines, geometry built in %.1f s" % (name, len(program), buildTime))
+    print("level  tolerance mm   pixel mm " + "".join("%10s" % bufferName for bufferName in BUFFERNAMES) + "     total")
+    for level, tolerance in enumerate(LEVELTOLERANCES):
+        pixel  = SIMPLIFYERROR*tolerance/MAXPIXELERROR
+        counts = [geometry.segmentCount(bufferName, level) for bufferName in BUFFERNAMES]
+        print("%5d %14.2f %10.2f " % (level, tolerance, pixel) + "".join("%10d" % count for count in counts) + "%10d" % sum(counts))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''
+
+Times the preflight check on a program which zig-zags across the whole work area and a little past
+its edges, where the chain tension in the lower corners is low.
+
+Run from the top level GroundControl directory:
+
+    python -m Benchmarks.preflightBenchmark [numberOfLines]
+
+numberOfLines defaults to 1000000. Parsing the program is not included in the time.
+
+'''
+
+from DataStructures.gcodeProgram             import GcodeProgram
+from DataStructures.preflightCheck           import checkProgram
+from Simulation.kinematics                   import Kinematics
+
+import math
+import sys
+import time
+
+def zigZag(numberOfLines, width, height):
+    '''
+
+    Returns lines which sweep back and forth across width and down height, and a little past both.
+
+    '''
+    lines = ["G21", "G90"]
+    rows  = max(1, int(math.sqrt(numberOfLines)))
+    for index in xrange(numberOfLines):
+        row    = index // rows
+        column = index % rows
+        if row % 2:
+            column = rows - 1 - column
+        x = -.55*width + 1.1*width*column/rows
+        y = .5*height - 1.1*height*row/rows
+        lines.append("G1 X%.3f Y%.3f " % (x, y))
+    return lines
+
+def main():
+    numberOfLines = 1000000
+    if len(sys.argv) > 1:
+        numberOfLines = int(sys.argv[1])
+
+    kinematics = Kinematics()
+    program = GcodeProgram(zigZag(numberOfLines, kinematics.bedWidth, kinematics.bedHeight))
+
+    start = time.time()
+    report = checkProgram(program, kinematics)
+    checkTime = time.time() - start
+
+    print("%d moves checked at %d points in %.1f ms" % (report.checkedMoves, report.checkedPoints, checkTime*1000))
+    print("%d unreachable, %d low tension, least tension %.2f, largest tilt %.1f degrees" % (len(report.unreachable), len(report.lowTension), report.minimumTension, report.largestAngle))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+'''
+
+Compares drawing a gcode file with one Color and Line instruction per move (the way GcodeCanvas used
+to draw) against drawing the batched vertex buffers from toolpathGeometry with a few Mesh instructions.
+
+Run from the top level GroundControl directory:
+
+    python -m Benchmarks.renderBenchmark [gcodeFile] [numberOfFrames]
+
+gcodeFile defaults to gcodeForTesting/Dragon.nc. A window is opened because Kivy needs an OpenGL
+context to draw. For each method the number of canvas instructions, the time taken to create them,
+and the average time to draw one frame into an offscreen buffer are reported.
+
+'''
+
+from kivy.config                             import Config
+Config.set('graphics', 'width', '200')
+Config.set('graphics', 'height', '200')
+from kivy.core.window                        import Window
+from kivy.graphics                           import Canvas, Color, Line, Mesh, Fbo, ClearColor, ClearBuffers
+from kivy.graphics.opengl                    import glFinish
+from DataStructures.gcodeTokenizer           import readGcodeFile
+from DataStructures.gcodeProgram             import GcodeProgram, RAPID, CLOCKWISEARC, COUNTERCLOCKARC, ISMOVE
+from DataStructures.toolpathGeometry         import ToolpathGeometry, FEED, RAPIDS, ARCS, RAISES, PLUNGES
+
+import math
+import os
+import sys
+import time
+
+MAXMESHVERTICES = 65534
+
+def calcAngle(X, Y, centerX, centerY):
+    '''
+
+    The angle used by Line(circle=...) for a point on an arc, in degrees.
+
+    '''
+    return math.degrees(math.atan2(X - centerX, Y - centerY))
+
+def drawPerLine(canvas, program):
+    '''
+
+    Draws program the way GcodeCanvas.drawLine and drawArc used to: a Color and a Line for every move.
+
+    '''
+    with canvas:
+        for index in xrange(len(program)):
+            if not program.mask[index] & ISMOVE:
+                continue
+
+            xPosition, yPosition, zPosition = program.startPositionOf(index)
+            xTarget,   yTarget,   zTarget   = program.positionAt(index)
+            command = program.command[index]
+
+            Color(1, 1, 1)
+            if command == CLOCKWISEARC or command == COUNTERCLOCKARC:
+                centerX, centerY = program.arcCenterOf(index)
+                radius = math.sqrt((centerX - xPosition)**2 + (centerY - yPosition)**2)
+                angle1 = calcAngle(xPosition, yPosition, centerX, centerY)
+                angle2 = calcAngle(xTarget, yTarget, centerX, centerY)
+                if command == CLOCKWISEARC:
+                    angleStart, angleEnd = angle2, angle1
+                else:
+                    angleStart, angleEnd = angle1, angle2
+                if angleStart < angleEnd:
+                    angleEnd = angleEnd - 360
+                Line(circle = (centerX, centerY, radius, angleStart, angleEnd))
+            elif command == RAPID:
+                Line(points = (xPosition, yPosition, xTarget, yTarget), width = 1, dash_length = 4, dash_offset = 2)
+            else:
+                Line(points = (xPosition, yPosition, xTarget, yTarget), width = 1)
+
+            if abs(zTarget - zPosition) >= 0.05:
+                if zTarget - zPosition > 0:
+                    Color(0, 1, 0)
+                    radius = 1
+                else:
+                    Color(1, 0, 0)
+                    radius = 2
+                Line(circle = (xPosition, yPosition, radius), width = 2)
+
+def drawBatched(canvas, program):
+    '''
+
+    Draws program the way GcodeCanvas.drawGeometry does: one Mesh per vertex buffer.
+
+    '''
+    geometry = ToolpathGeometry()
+    geometry.addLines(program)
+
+    colors = [(RAPIDS, (.5, .5, .5)), (FEED, (1, 1, 1)), (ARCS, (1, 1, 1)), (RAISES, (0, 1, 0)), (PLUNGES, (1, 0, 0))]
+
+    with canvas:
+        for name, color in colors:
+            Color(*color)
+            points = geometry.buffers[name]
+            vertexCount = len(points)//2
+            for first in xrange(0, vertexCount, MAXMESHVERTICES):
+                last  = min(vertexCount, first + MAXMESHVERTICES)
+                vertices = [0.0]*(4*(last - first))
+                vertices[0::4] = points[2*first:2*last:2]
+                vertices[1::4] = points[2*first+1:2*last:2]
+                Mesh(vertices = vertices, indices = range(last - first), mode = 'lines')
+
+def benchmark(name, drawFunction, program, numberOfFrames):
+    '''
+
+    Creates the instructions for program with drawFunction, then draws them numberOfFrames times.
+
+    '''
+    fbo = Fbo(size = (1024, 1024))
+    with fbo:
+        ClearColor(0, 0, 0, 1)
+        ClearBuffers()
+
+    canvas = Canvas()
+    start = time.time()
+    drawFunction(canvas, program)
+    buildTime = time.time() - start
+    fbo.add(canvas)
+
+    #the first draw uploads the vertices to the graphics card
+    fbo.draw()
+    glFinish()
+
+    start = time.time()
+    for _ in range(numberOfFrames):
+        fbo.draw()
+    glFinish()
+    frameTime = (time.time() - start)/numberOfFrames
+
+    print("%-10s %8d instructions   build %8.1f ms   frame %8.2f ms" % (name, len(canvas.children), buildTime*1000, frameTime*1000))
+
+def main():
+    filename = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gcodeForTesting', 'Dragon.nc')
+    numberOfFrames = 100
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    if len(sys.argv) > 2:
+        numberOfFrames = int(sys.argv[2])
+
+    program = GcodeProgram(readGcodeFile(filename))
+    print(os.path.basename(filename) + ": " + str(len(program)) + " lines")
+
+    benchmark("per line", drawPerLine, program, numberOfFrames)
+    benchmark("batched", drawBatched, program, numberOfFrames)
+
+    Window.close()
+
+if __name__ == '__main__':
+    main()
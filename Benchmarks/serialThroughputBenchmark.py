@@ -0,0 +1,280 @@
+'''
+
+Measures how quickly SerialPortThread streams gcode to the firmware emulator running on a
+pseudo-terminal.
+
+Run from the top level GroundControl directory (Linux and macOS only):
+
+    python -m Benchmarks.serialThroughputBenchmark [options] [gcodeFile ...]
+
+The files default to everything in gcodeForTesting. Run with --help for the options, which set the
+emulator's per line processing time, ok latency, report rate, buffer size and baud rate, and switch
+the stream to character counting, find the baud rate automatically or record telemetry. For each file
+the following are reported:
+
+    lines/s             the rate the whole file is streamed at
+    latency             percentiles of the time from each line reaching the firmware to its ok
+    ui backlog          the most and the average number of messages waiting in message_queue each
+                        time it is emptied, as runPeriodically does every 10 ms
+    overflows           the number of lines which arrived while the firmware's buffer was full
+    link                the share of the serial line's capacity used sending the file, when a baud
+                        rate is emulated
+
+Then the time from putting a command in data.commands while the machine is idle to the firmware
+receiving it is reported, the number of moves a burst of jogs reaches the firmware as, the time taken
+to reconnect after the port is closed under SerialPortThread, as happens when the USB cable is
+disturbed, and how long the commands of each priority waited to be sent.
+
+'''
+
+from DataStructures.commandScheduler         import CommandScheduler
+from DataStructures.gcodeProgram             import GcodeProgram
+from DataStructures.gcodeTokenizer           import readGcodeFile
+from Connection.serialPortThread             import SerialPortThread, HANDSHAKING, STREAMING
+from DataStructures.telemetryRecorder        import BITSPERBYTE
+from Simulation.firmwareEmulator             import FirmwareEmulator
+
+import argparse
+import glob
+import os
+import Queue
+import sys
+import threading
+import time
+
+UIINTERVAL = .01        #how often runPeriodically empties message_queue
+
+class BenchmarkData(object):
+    '''
+
+    The parts of the Data object which SerialPortThread uses.
+
+    '''
+
+    def __init__(self, comport):
+        self.comport          = comport
+        self.units            = "MM"
+        self.gcode            = GcodeProgram([])
+        self.gcodeIndex       = 0
+        self.uploadFlag       = 0
+        self.connectionStatus = 0
+        self.connectionState  = "disconnected"
+        self.malformedReports = 0
+
+        self.serialWakeup     = threading.Event()
+        self.message_queue    = Queue.Queue()
+        self.commands         = CommandScheduler(self.serialWakeup)
+
+class UserInterface(object):
+    '''
+
+    Empties message_queue every UIINTERVAL seconds and records how many messages were waiting.
+
+    '''
+
+    def __init__(self, data):
+        self.data     = data
+        self.backlogs = []
+        self.running  = True
+
+    def run(self):
+        while self.running:
+            time.sleep(UIINTERVAL)
+            backlog = 0
+            while not self.data.message_queue.empty():
+                self.data.message_queue.get()
+                backlog = backlog + 1
+            self.backlogs.append(backlog)
+
+def waitFor(condition, timeout):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            return False
+        time.sleep(.001)
+    return True
+
+def reconnect(serialPortThread, data, emulator):
+    '''
+
+    Closes the port under SerialPortThread and returns the time in seconds until it is streaming
+    again, or None if it does not reconnect.
+
+    '''
+    start = time.time()
+    serialPortThread.serialInstance.close()
+    if not waitFor(lambda: data.connectionState != STREAMING, 5):
+        return None
+    if not waitFor(lambda: data.connectionState in (HANDSHAKING, STREAMING), 10):
+        return None
+    #the firmware restarts and greets when the port is opened
+    emulator.greet()
+    if not waitFor(lambda: data.connectionState == STREAMING, 5):
+        return None
+    return time.time() - start
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction*len(values)))]
+
+def streamFile(filename, data, emulator, ui, serialPortThread):
+    '''
+
+    Streams one file and returns a line describing the results.
+
+    '''
+    gcode = [line for line in readGcodeFile(filename) if line.strip()]
+    name  = os.path.basename(filename)
+
+    #let anything still in flight finish before starting
+    waitFor(lambda: emulator.lines.empty() and emulator.replies.empty(), 10)
+    time.sleep(.1)
+    del emulator.lineLatencies[:]
+    del ui.backlogs[:]
+    emulator.overflows = 0
+
+    data.gcode      = GcodeProgram(gcode, parse = False)
+    data.gcodeIndex = 0
+    bytesSent = serialPortThread.bytesSent
+    start = time.time()
+    data.uploadFlag = 1
+    data.serialWakeup.set()
+    finished = waitFor(lambda: data.gcodeIndex >= len(gcode) and len(emulator.lineLatencies) >= len(gcode), 3600)
+    streamTime = time.time() - start
+    data.uploadFlag = 0
+
+    if not finished:
+        return "%-24s the emulator did not receive the whole file" % name
+
+    latencies = sorted(emulator.lineLatencies)
+    backlogs  = ui.backlogs or [0]
+    result = "%-24s %7d lines %8.0f lines/s   latency ms p50 %7.2f p90 %7.2f p99 %7.2f max %7.2f   ui backlog max %4d mean %5.2f   overflows %d" % (
+            name, len(gcode), len(gcode)/streamTime,
+            1000*percentile(latencies, .5), 1000*percentile(latencies, .9), 1000*percentile(latencies, .99), 1000*latencies[-1],
+            max(backlogs), float(sum(backlogs))/len(backlogs), emulator.overflows)
+    if emulator.baudRate is not None:
+        link = (serialPortThread.bytesSent - bytesSent)*BITSPERBYTE/(serialPortThread.linkRate*streamTime)
+        result = result + "   link %3.0f%% at %d baud" % (100*link, serialPortThread.linkRate)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = "Stream gcode files to the firmware emulator")
+    parser.add_argument('files', nargs = '*', help = "gcode files to stream, defaults to gcodeForTesting/*.nc")
+    parser.add_argument('--line-delay', type = float, default = 0.0, help = "milliseconds the emulator takes to process each line")
+    parser.add_argument('--latency', type = float, default = 0.0, help = "milliseconds from a line being processed to its ok being sent")
+    parser.add_argument('--report-interval', type = float, default = 250.0, help = "milliseconds between position reports")
+    parser.add_argument('--buffer', type = int, default = 0, help = "stream with character counting against a buffer of this many bytes")
+    parser.add_argument('--baud', type = int, help = "emulate a serial line at this baud rate")
+    parser.add_argument('--auto-baud', action = 'store_true', help = "find the baud rate instead of opening the port at --baud")
+    parser.add_argument('--telemetry', help = "record telemetry to a new file in this directory while streaming")
+    parser.add_argument('--commands', type = int, default = 50, help = "number of single commands to time")
+    parser.add_argument('--jogs', type = int, default = 20, help = "number of jogs to send in one burst")
+    parser.add_argument('--reconnects', type = int, default = 10, help = "number of reconnections to time")
+    options = parser.parse_args()
+
+    files = options.files
+    if not files:
+        files = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gcodeForTesting', '*.nc')))
+
+    emulator = FirmwareEmulator(options.line_delay/1000, options.report_interval/1000, options.latency/1000, options.buffer or None, options.baud)
+    emulator.start()
+
+    data = BenchmarkData(emulator.portName)
+    serialPortThread = SerialPortThread()
+    serialPortThread.setUpData(data)
+    if options.buffer:
+        serialPortThread.characterCounting  = True
+        serialPortThread.firmwareBufferSize = options.buffer
+    if options.baud:
+        serialPortThread.baudRate = options.baud
+    serialPortThread.autoBaud = options.auto_baud
+    serialPortThread.telemetryDirectory = options.telemetry
+    thread = threading.Thread(target = serialPortThread.getmessage)
+    thread.daemon = True
+
+    ui = UserInterface(data)
+    uiThread = threading.Thread(target = ui.run)
+    uiThread.daemon = True
+    uiThread.start()
+
+    results    = []
+    latencies  = []
+    reconnects = []
+    jogMoves   = None
+
+    #keep SerialPortThread's messages about the connection out of the results
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        thread.start()
+        #with --auto-baud the firmware has already answered by the time the port is open
+        connected = waitFor(lambda: data.connectionState in (HANDSHAKING, STREAMING), 10)
+
+        if connected:
+            emulator.greet()
+            connected = waitFor(lambda: data.connectionStatus, 5)
+
+        if connected:
+
+            for filename in files:
+                results.append(streamFile(filename, data, emulator, ui, serialPortThread))
+
+            #send single commands while the machine is idle
+            for number in range(options.commands):
+                time.sleep(.05)
+                count = len(emulator.receivedLines)
+                sent = time.time()
+                data.commands.put('G4 P0 ')
+                if waitFor(lambda: len(emulator.receivedLines) > count, 5):
+                    latencies.append(time.time() - sent)
+
+            #press a jog button repeatedly faster than the machine answers
+            if options.jogs:
+                time.sleep(.05)
+                count = len(emulator.receivedLines)
+                sent = time.time()
+                for number in range(options.jogs):
+                    data.commands.jog(x = number + 1.0)
+                waitFor(lambda: not data.commands.hasQueued(), 5)
+                waitFor(lambda: emulator.receivedLines and emulator.receivedLines[-1].startswith("G00 X%s" % float(options.jogs)), 5)
+                jogMoves = (len(emulator.receivedLines) - count, time.time() - sent)
+
+            for number in range(options.reconnects):
+                time.sleep(.05)
+                reconnects.append(reconnect(serialPortThread, data, emulator))
+    finally:
+        sys.stdout = stdout
+
+    serialPortThread.stop()
+    emulator.stop()
+    thread.join(5)
+    ui.running = False
+    uiThread.join()
+
+    if not connected:
+        print("could not connect to the firmware emulator")
+        return
+
+    for result in results:
+        print(result)
+
+    if latencies:
+        latencies.sort()
+        print("command latency     median %6.1f ms   max %6.1f ms" % (1000*latencies[len(latencies)//2], 1000*latencies[-1]))
+
+    if jogMoves is not None:
+        print("jog burst           %d jogs sent as %d moves in %.1f ms" % (options.jogs, jogMoves[0], 1000*jogMoves[1]))
+
+    if reconnects:
+        times = sorted(reconnect for reconnect in reconnects if reconnect is not None)
+        if times:
+            print("reconnect time      median %6.1f ms   max %6.1f ms   failed %d" % (1000*times[len(times)//2], 1000*times[-1], len(reconnects) - len(times)))
+        else:
+            print("reconnect time      every reconnection failed")
+
+    print("malformed reports   %d" % data.malformedReports)
+
+    for metrics in data.commands.metrics():
+        print("%-10s sent %6d   merged %5d   wait ms mean %7.2f max %7.2f" % (metrics.name, metrics.sent, metrics.merged, 1000*metrics.meanWait, 1000*metrics.maxWait))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+'''
+
+This module provides PortDiscovery which keeps an up to date list of the serial ports on the computer
+without opening any of them.
+
+On Linux the ports are read from /sys/class/tty. Only the devices which are backed by hardware are
+listed, and the USB vendor and product IDs and serial number of each are read from the USB device the
+port belongs to. On other systems pyserial's list_ports is used, which reads the same details from the
+operating system.
+
+The list is scanned in a background thread every scanInterval seconds. When it changes the new list is
+put in the queue as ("ports", ports), so the user interface can show it without waiting on the scan.
+Ports whose USB IDs are in MASLOWUSBIDS are the Arduino Mega boards used by the Maslow. Ports whose
+IDs are in CLONEUSBIDS use the USB serial bridge of the clone boards, which many other devices use
+too, so one of them is only taken to be a Maslow when it is the only such port and no Arduino Mega
+is connected.
+
+'''
+
+from collections                             import namedtuple
+
+import glob
+import os
+import Queue
+import re
+import sys
+import threading
+import time
+
+PortInfo = namedtuple('PortInfo', ['device', 'vid', 'pid', 'serialNumber', 'description', 'isMaslow', 'isClone'])
+
+#the USB vendor and product IDs of the Arduino Mega 2560 boards
+MASLOWUSBIDS = set([(0x2341, 0x0010), (0x2341, 0x0042), (0x2A03, 0x0010), (0x2A03, 0x0042)])
+
+#the USB vendor and product IDs of the CH340 bridge used by clone boards and many unrelated devices
+CLONEUSBIDS  = set([(0x1A86, 0x7523)])
+
+SYSFSTTY     = '/sys/class/tty'
+HWIDPATTERN  = re.compile(r'VID:PID=([0-9A-Fa-f]{4}):([0-9A-Fa-f]{4})(?:\s+SER=(\S+))?')
+
+def _readAttribute(directory, name):
+    '''
+
+    Returns the stripped contents of a sysfs attribute file, or None if it can not be read.
+
+    '''
+    try:
+        attributeFile = open(os.path.join(directory, name))
+        try:
+            return attributeFile.read().strip()
+        finally:
+            attributeFile.close()
+    except (IOError, OSError):
+        return None
+
+def _portInfo(device, vid, pid, serialNumber, description):
+    return PortInfo(device, vid, pid, serialNumber, description, (vid, pid) in MASLOWUSBIDS, (vid, pid) in CLONEUSBIDS)
+
+def _listLinuxPorts(sysfs = SYSFSTTY):
+    '''
+
+    Returns a PortInfo for every hardware serial port listed in sysfs.
+
+    '''
+    ports = []
+    for name in sorted(os.listdir(sysfs)):
+        deviceLink = os.path.join(sysfs, name, 'device')
+        if not os.path.exists(deviceLink):
+            continue            #virtual terminals have no device
+
+        device = os.path.realpath(deviceLink)
+        subsystem = os.path.basename(os.path.realpath(os.path.join(device, 'subsystem')))
+        if subsystem == 'platform':
+            continue            #the placeholders for serial ports the motherboard might have
+
+        #the USB device is the first parent with vendor and product IDs
+        vid = pid = serialNumber = None
+        description = name
+        usbDevice = device
+        while os.path.dirname(usbDevice) != usbDevice:
+            vendor = _readAttribute(usbDevice, 'idVendor')
+            if vendor is not None:
+                try:
+                    vid = int(vendor, 16)
+                    pid = int(_readAttribute(usbDevice, 'idProduct'), 16)
+                except (TypeError, ValueError):
+                    vid = pid = None
+                serialNumber = _readAttribute(usbDevice, 'serial')
+                product      = _readAttribute(usbDevice, 'product')
+                if product is not None:
+                    description = product
+                break
+            usbDevice = os.path.dirname(usbDevice)
+
+        ports.append(_portInfo('/dev/' + name, vid, pid, serialNumber, description))
+    return ports
+
+def _listOtherPorts():
+    '''
+
+    Returns a PortInfo for every serial port pyserial can find.
+
+    '''
+    try:
+        from serial.tools import list_ports
+    except ImportError:
+        return [_portInfo(port, None, None, None, port) for port in glob.glob('/dev/tty.*')]
+
+    ports = []
+    for port in list_ports.comports():
+        device, description, hardwareID = port[0], port[1], port[2]
+        vid = pid = serialNumber = None
+        match = HWIDPATTERN.search(hardwareID or "")
+        if match is not None:
+            vid, pid, serialNumber = int(match.group(1), 16), int(match.group(2), 16), match.group(3)
+        ports.append(_portInfo(device, vid, pid, serialNumber, description))
+    return sorted(ports)
+
+def listPorts():
+    '''
+
+    Returns a PortInfo for every serial port on the computer, with the ports which look like a Maslow
+    first, then the ports which might be a clone board. No port is opened.
+
+    '''
+    if sys.platform.startswith('linux') and os.path.isdir(SYSFSTTY):
+        ports = _listLinuxPorts()
+    else:
+        ports = _listOtherPorts()
+    return ([port for port in ports if port.isMaslow] + [port for port in ports if port.isClone] +
+            [port for port in ports if not port.isMaslow and not port.isClone])
+
+class PortDiscovery(object):
+
+    scanInterval = 2.0      #the time in seconds between scans
+
+    def __init__(self):
+        self.ports   = []   #the ports found by the last scan, replaced as a whole so it can be read from any thread
+        self.queue   = Queue.Queue()
+        self.thread  = None
+        self.running = False
+
+    def start(self):
+        '''
+
+        Starts scanning in a new thread. The first scan is done before returning so that the list is
+        filled straight away.
+
+        '''
+        if self.running:
+            return
+        self.running = True
+        self._scan()
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            time.sleep(self.scanInterval)
+            self._scan()
+
+    def _scan(self):
+        try:
+            ports = listPorts()
+        except (IOError, OSError) as e:
+            print "serial ports could not be listed:"
+            print e
+            return
+        if ports != self.ports:
+            self.ports = ports
+            self.queue.put(("ports", ports))
+
+    def devices(self):
+        '''
+
+        Returns the names of the ports from the last scan.
+
+        '''
+        return [port.device for port in self.ports]
+
+    def maslowPort(self):
+        '''
+
+        Returns the name of the first port which looks like a Maslow, or of the only port which might
+        be a clone board if there is no such port, or None if there is neither.
+
+        '''
+        for port in self.ports:
+            if port.isMaslow:
+                return port.device
+        clones = [port.device for port in self.ports if port.isClone]
+        if len(clones) == 1:
+            return clones[0]
+        return None
@@ -2,9 +2,10 @@ from kivy.properties                           import  ListProperty
 from kivy.clock                                import  Clock
 from DataStructures.makesmithInitFuncs         import  MakesmithInitFuncs
 from Connection.serialPortThread               import  SerialPortThread
+from Connection.portDiscovery                  import  PortDiscovery
 
-import sys
-import serial
+import os
+import Queue
 import threading
 
 class SerialPort(MakesmithInitFuncs):
@@ -19,13 +20,29 @@ class SerialPort(MakesmithInitFuncs):
     
     COMports = ListProperty(("Available Ports:", "None"))
     
+    th         = None       #the thread which runs the connection
+    connection = None       #the SerialPortThread which runs in it
+    
     def __init__(self):
         '''
         
-        Runs on creation, schedules the software to attempt to connect to the machine
+        Runs on creation, schedules the check for changes to the serial ports
+        
+        '''
+        self.discovery = PortDiscovery()
+        Clock.schedule_interval(self.checkPorts, 1)
+    
+    def setUpData(self, data):
+        '''
+        
+        Starts watching the serial ports so the list is ready before it is first asked for.
         
         '''
-        Clock.schedule_interval(self.openConnection, 5)
+        MakesmithInitFuncs.setUpData(self, data)
+        self.discovery.start()
+        self.data.comPorts = self.discovery.devices()
+        self.selectMaslowPort()
+        self.openConnection()
     
     def setPort(self, port):
         '''
@@ -51,7 +68,8 @@ class SerialPort(MakesmithInitFuncs):
     def updatePorts(self, *args):
         '''
         
-        Talks to the OS and determines which devices are available on which ports.
+        Returns the list of ports to show in the connect menu. The list is kept up to date in the
+        background so this returns straight away.
         
         '''
         
@@ -64,6 +82,44 @@ class SerialPort(MakesmithInitFuncs):
             portsList.append("None")
         
         self.COMports = portsList
+        return portsList
+    
+    def checkPorts(self, *args):
+        '''
+        
+        Picks up changes to the serial ports found by the background scan.
+        
+        '''
+        
+        changed = False
+        while True:
+            try:
+                self.discovery.queue.get_nowait()
+            except Queue.Empty:
+                break
+            changed = True
+        
+        if changed:
+            self.data.comPorts = self.discovery.devices()
+            self.selectMaslowPort()
+    
+    def selectMaslowPort(self):
+        '''
+        
+        Switches to the first port which looks like a Maslow if the port in the settings is not
+        connected to the computer.
+        
+        '''
+        
+        if self.data.connectionStatus:
+            return
+        
+        maslowPort = self.discovery.maslowPort()
+        if maslowPort is not None and self.data.comport not in self.data.comPorts:
+            self.data.comport = maslowPort
+            self.data.config.set('Maslow Settings', 'COMport', maslowPort)
+            self.data.config.write()
+            self.data.message_queue.put("Found a Maslow on " + maslowPort + "\n")
     
     '''
     
@@ -72,45 +128,50 @@ class SerialPort(MakesmithInitFuncs):
     '''
     
     def openConnection(self, *args):
-        #This function opens the thread which handles the input from the serial port
-        #It only needs to be run once, it is run by connecting to the machine
+        #This function starts the thread which keeps the connection to the machine open
+        #It only needs to be run once, the thread opens the port again whenever the connection is lost
         
-        
-        if not self.data.connectionStatus:
+        if self.th is None:
             #self.data.message_queue is the queue which handles passing CAN messages between threads
-            x = SerialPortThread()
-            x.setUpData(self.data)
-            self.th=threading.Thread(target=x.getmessage)
+            self.connection = SerialPortThread()
+            self.connection.setUpData(self.data)
+            self.connection.configure = self.configureConnection
+            self.th=threading.Thread(target=self.connection.getmessage)
             self.th.daemon = True
             self.th.start()
     
-    def listSerialPorts(self):
-        #Detects all the devices connected to the computer. Returns them as an array.
-        import glob
-        if sys.platform.startswith('win'):
-            ports = ['COM' + str(i + 1) for i in range(256)]
-
-        elif sys.platform.startswith('linux'):
-            # this is to exclude your current terminal "/dev/tty"
-            ports = glob.glob('/dev/tty[A-Za-z]*')
-
-        elif sys.platform.startswith('darwin'):
-            ports = glob.glob('/dev/tty.*')
-
+    def reopen(self, *args):
+        '''
+        
+        Opens the port again so that changes to the connection settings take effect.
+        
+        '''
+        
+        if self.connection is not None:
+            self.connection.reopen()
+    
+    def configureConnection(self, connection):
+        '''
+        
+        Applies the settings to the connection before each attempt to open the port. Runs in the
+        connection's thread.
+        
+        '''
+        
+        connection.characterCounting  = self.data.config.get('Advanced Settings', 'characterCounting') == '1'
+        connection.firmwareBufferSize = int(self.data.config.get('Advanced Settings', 'firmwareBufferSize'))
+        connection.firstRetryDelay    = float(self.data.config.get('Advanced Settings', 'reconnectDelay'))
+        connection.baudRate           = int(self.data.config.get('Maslow Settings', 'baudRate'))
+        connection.autoBaud           = self.data.config.get('Maslow Settings', 'autoBaud') == '1'
+        connection.traceWrites        = self.data.config.get('Advanced Settings', 'traceSerial') == '1'
+        if self.data.config.get('Ground Control Settings', 'recordTelemetry') == '1':
+            connection.telemetryDirectory = os.path.join(os.path.dirname(os.path.abspath(self.data.config.filename)), 'telemetry')
         else:
-            raise EnvironmentError('Unsupported platform')
-
-        result = []
-        for port in ports:
-            try:
-                s = serial.Serial(port)
-                s.close()
-                result.append(port)
-            except (OSError, serial.SerialException):
-                pass
-            except (ValueError):
-                print("Port find error")
-        return result
+            connection.telemetryDirectory = None
+    
+    def listSerialPorts(self):
+        #Returns the devices connected to the computer from the last scan, Maslows first. No port is opened.
+        return self.discovery.devices()
     
     def detectCOMports(self, *args):
         x = []
@@ -1,7 +1,22 @@
 from DataStructures.makesmithInitFuncs         import   MakesmithInitFuncs
+from DataStructures.commandScheduler           import   SETTINGS, EMERGENCY
+from DataStructures.statusReports              import   parseStatusReport
+from DataStructures.telemetryRecorder          import   TelemetryRecorder, newTelemetryFilename
+from DataStructures.transmitBuffer             import   TransmitBuffer
+from collections                               import   deque
 import serial
+import threading
 import time
 
+#The states of the connection
+DISCONNECTED = "disconnected"   #no port is open and the next attempt is waiting for its delay
+OPENING      = "opening"        #the port is being opened
+HANDSHAKING  = "handshaking"    #the port is open and the firmware has not said anything yet
+STREAMING    = "streaming"      #the firmware is talking and lines are being sent
+LOST         = "lost"           #the connection has just been lost and will be opened again straight away
+
+#The rates tried when the baud rate is found automatically, fastest first
+BAUDRATES    = (115200, 57600, 38400, 19200, 9600)
 
 class SerialPortThread(MakesmithInitFuncs):
     '''
@@ -9,108 +24,551 @@ class SerialPortThread(MakesmithInitFuncs):
     SerialPort is the thread which handles direct communication with the CNC machine. 
     SerialPort initializes the connection and then receives
     and parses messages. These messages are then passed to the main thread via the message_queue 
-    queue where they are added to the GUI
+    queue where they are added to the GUI. Position and error reports are passed as
+    PositionReport and PositionErrorReport records instead of text.
+    
+    The connection is managed by one long lived thread running getmessage, which opens the port,
+    streams until the connection is lost, and opens it again, waiting firstRetryDelay before the first
+    attempt after a loss and twice as long after each attempt which fails, up to maxRetryDelay. A
+    second long lived thread reads from the port while it is open. The state of the connection is
+    kept in data.connectionState.
+    
+    The port is opened at baudRate. With autoBaud on, the rate is found instead by sending B05 at each
+    rate in BAUDRATES, fastest first, until the firmware answers with its version. The rate found is
+    tried first the next time the same port is opened.
+    
+    Lines are normally sent one at a time, waiting for the machine to answer ok before sending the
+    next. With characterCounting on, lines are sent ahead for as long as they fit in the firmware's
+    receive buffer, and each ok frees the space taken by the oldest line still in flight. Commands
+    which data.commands sends straight away are not counted.
+    
+    Lines of the program are written straight from a TransmitBuffer holding them already encoded, and
+    with characterCounting on every line which fits in the buffer is sent with a single write.
     
     '''
     
     machineIsReadyForData = False
     lastMessageTime       = time.time()
+    connectionLost        = False
+    reopenRequested       = False   #set by reopen, and only cleared just before the port is opened with the current settings
+    connectionTimeout     = 2       #seconds without a message from the machine before the connection is considered lost
+    handshakeTimeout      = 5       #seconds the firmware has to start talking after the port is opened
+    firstRetryDelay       = .05     #seconds to wait before opening the port again after the connection is lost
+    maxRetryDelay         = 5.0     #the longest wait between attempts to open the port
+    
+    running               = True    #cleared by stop to end both threads
+    state                 = DISCONNECTED
+    configure             = None    #if set, called with this object before each attempt to open the port to pick up changed settings
+    
+    baudRate              = 19200   #the rate the port is opened at
+    autoBaud              = False   #find the rate the firmware uses instead of using baudRate
+    probeTimeout          = .3      #seconds to wait for the firmware to answer at each rate tried
+    probeSettleTime       = .05     #seconds to let the firmware finish answering once a probe has found the rate
+    linkRate              = 0       #the rate the port is open at now
+    bytesSent             = 0       #the bytes written and read since the port was opened
+    bytesReceived         = 0
+    linkInterval          = 1.0     #seconds between link samples in the telemetry
+    lastLinkSample        = 0
+    
+    characterCounting     = False   #fill the firmware's receive buffer instead of sending one line per ok
+    firmwareBufferSize    = 64      #the size in bytes of the firmware's serial receive buffer
+    lineEnding            = " \n"   #added to every line by _write
+    traceWrites           = False   #print everything sent to the machine
+    transmitBuffer        = None    #the encoded lines of the program being sent
+    
+    telemetryDirectory    = None    #if set, every position and error report is recorded to a new file in this directory
+    telemetry             = None    #the TelemetryRecorder for this connection
     
     def _write (self, message):
-        message = message + " \n"
+        message = message + self.lineEnding
         message = message.encode()
-        print("Sending: " + str(message))
+        self._writeBytes(message)
+    
+    def _writeBytes(self, message):
+        if self.traceWrites:
+            print("Sending: " + str(message))
         try:
             self.serialInstance.write(message)
+            self.bytesSent = self.bytesSent + len(message)
         except:
             print("write issue")
+    
+    def _programBuffer(self):
+        '''
+        
+        Returns the TransmitBuffer for the program in data.gcode, encoding it again if the program has changed.
+        
+        '''
+        
+        if self.transmitBuffer is None or self.transmitBuffer.program is not self.data.gcode:
+            self.transmitBuffer = TransmitBuffer(self.data.gcode, self.lineEnding)
+        return self.transmitBuffer
 
     def _getFirmwareVersion(self):
-        self.data.gcode_queue.put('B05 ')
+        self.data.commands.put('B05 ', SETTINGS)
     
     def _setupMachineUnits(self):
         if self.data.units == "INCHES":
-            self.data.gcode_queue.put('G20 ')
+            self.data.commands.put('G20 ', SETTINGS)
         else:
-            self.data.gcode_queue.put('G21 ')
+            self.data.commands.put('G21 ', SETTINGS)
         
-    def getmessage (self):
-        #print("Waiting for new message")
-        #opens a serial connection called self.serialInstance
+    def _setState(self, state):
+        self.state = state
+        self.data.connectionState = state
+    
+    def _readMessages(self):
+        '''
         
-        try:
-            #print("connecting")
-            self.serialInstance = serial.Serial(self.data.comport, 19200, timeout = .25) #self.data.comport is the com port which is opened
-        except:
-            #print(self.data.comport + " is unavailable or in use")
-            #self.data.message_queue.put("\n" + self.data.comport + " is unavailable or in use")
-            pass
-        else:
-            self.data.message_queue.put("\r\nConnected on port " + self.data.comport + "\r\n")
-            print("\r\nConnected on port " + self.data.comport + "\r\n")
-            gcode = ""
+        Runs in its own thread for as long as the connection manager runs. Waits for the port to be
+        opened, then reads from it until the connection is lost.
+        
+        '''
+        
+        while self.running:
+            self.portOpened.wait()
+            self.portOpened.clear()
+            if self.running:
+                self._readUntilLost()
+            self.readerIdle.set()
+    
+    def _readUntilLost(self):
+        '''
+        
+        Reads each message from the machine as soon as it arrives and wakes the writing thread when
+        the machine is ready for the next line or the connection is lost.
+        
+        '''
+        
+        while not self.connectionLost:
             msg = ""
-            subReadyFlag = True
+            try:
+                msg = self.serialInstance.readline()
+                msg = msg.decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+            except:
+                #the port has gone away
+                self.connectionLost = True
             
-            self.serialInstance.parity = serial.PARITY_ODD #This is something you have to do to get the connection to open properly. I have no idea why.
-            self.serialInstance.close()
-            self.serialInstance.open()
-            self.serialInstance.close()
-            self.serialInstance.parity = serial.PARITY_NONE
-            self.serialInstance.open()
+            if len(msg) > 0:
+                self.bytesReceived   = self.bytesReceived + len(msg)
+                self.lastMessageTime = time.time()
+                if self.state == HANDSHAKING:
+                    self._setState(STREAMING)
+                    self.data.connectionStatus = 1
+                if msg == "ok\r\n":
+                    self.machineIsReadyForData = True
+                    if self.sentLineNumbers:
+                        self.sentLineNumbers.popleft()
+                    if self.characterCounting:
+                        self._lineAcknowledged()
+                    self.data.serialWakeup.set()
+                else:
+                    self._queueMessage(msg)
             
-            #print "port open?:"
-            #print self.serialInstance.isOpen()
-            self.lastMessageTime = time.time()
-            self.data.connectionStatus = 1
+            #check for serial connection loss each time a message arrives or the read times out
+            timeout = self.handshakeTimeout if self.state == HANDSHAKING else self.connectionTimeout
+            if time.time() - self.lastMessageTime > timeout or not self.running:
+                self.connectionLost = True
+        
+        self.data.serialWakeup.set()
+    
+    def _queueMessage(self, msg):
+        '''
+        
+        Passes a message to the main thread, turning position and error reports into records first.
+        Reports which can not be read are counted in data.malformedReports and dropped.
+        
+        '''
+        
+        try:
+            report = parseStatusReport(msg)
+        except ValueError:
+            self.data.malformedReports = self.data.malformedReports + 1
+            return
+        
+        if report is not None:
+            if self.telemetry is not None:
+                self.telemetry.record(report, self.data.gcodeIndex, self._lineInFlight(), self.lastMessageTime)
+                if self.lastMessageTime - self.lastLinkSample >= self.linkInterval:
+                    self.lastLinkSample = self.lastMessageTime
+                    self.telemetry.recordLink(self.bytesSent, self.bytesReceived, self.linkRate, self.data.gcodeIndex, self._lineInFlight(), self.lastMessageTime)
+            self.data.message_queue.put(report)
+        else:
+            self.data.message_queue.put(msg)
+    
+    def _lineInFlight(self):
+        '''
+        
+        Returns the index of the oldest line of the program which the machine has not acknowledged,
+        or -1 if it is running a command or nothing at all.
+        
+        '''
+        
+        try:
+            return self.sentLineNumbers[0]
+        except IndexError:
+            return -1
+    
+    def _lineAcknowledged(self):
+        '''
+        
+        Frees the space in the firmware's buffer taken by the oldest line in flight.
+        
+        '''
+        
+        with self.bufferLock:
+            if self.linesInFlight:
+                self.bytesInFlight = self.bytesInFlight - self.linesInFlight.popleft()
+    
+    def _reserveBufferSpace(self, length):
+        '''
+        
+        Returns True and counts a line of length bytes as in flight if it fits in the firmware's buffer.
+        A line is always allowed when nothing is in flight so that a line longer than the buffer can not
+        stall the stream.
+        
+        '''
+        
+        with self.bufferLock:
+            if self.linesInFlight and self.bytesInFlight + length > self.firmwareBufferSize:
+                return False
+            self.linesInFlight.append(length)
+            self.bytesInFlight = self.bytesInFlight + length
+            return True
+    
+    def _forgetLinesInFlight(self):
+        '''
+        
+        Forgets the lines and the command sent but not yet acknowledged, and the command waiting for
+        space in the buffer, for when the machine has been told to stop and throws away what it was
+        given. Used whether or not characters are being counted.
+        
+        '''
+        
+        with self.bufferLock:
+            self.linesInFlight.clear()
+            self.bytesInFlight = 0
+        self.sentLineNumbers.clear()
+        self.waitingCommand = None
+    
+    def _fillBuffer(self):
+        '''
+        
+        Sends queued commands, then lines of the program, for as long as they fit in the firmware's buffer.
+        
+        '''
+        
+        #nothing is sent until the firmware has started up and said it is ready
+        if not self.machineIsReadyForData:
+            return
+        
+        while True:
+            if self.waitingCommand is None:
+                command = self.data.commands.get()
+                if command is not None:
+                    self.waitingCommand = command + " "
             
-            self._getFirmwareVersion()
-            self._setupMachineUnits()
+            if self.waitingCommand is not None:
+                if not self._reserveBufferSpace(len(self.waitingCommand) + len(self.lineEnding)):
+                    return
+                gcode = self.waitingCommand
+                self.waitingCommand = None
+                self.sentLineNumbers.append(-1)
+                self._write(gcode)
             
-            while True:
+            elif self.data.uploadFlag:
+                program = self._programBuffer()
+                start   = self.data.gcodeIndex
+                if start >= len(program):
+                    self.data.uploadFlag = 0
+                    print "Gcode Ended"
+                    return
                 
-                #get any messages from the machine
+                #reserve space for as many lines as fit and send them with one write, stopping early
+                #if a command is queued so that it is not held up behind the program
+                end      = start
+                blockEnd = program.blockEnd(start)
+                while end < blockEnd and self._reserveBufferSpace(program.lineLength(end)):
+                    self.sentLineNumbers.append(end)
+                    end = end + 1
+                    if self.data.commands.hasQueued():
+                        break
+                if end == start:
+                    return
+                self._writeBytes(program.lines(start, end))
+                self.data.gcodeIndex = end
+            
+            else:
+                return
+    
+    def _sendNextLine(self):
+        '''
+        
+        Sends the next queued command or line of the program if the machine is ready for it.
+        
+        '''
+        
+        if self.characterCounting:
+            self._fillBuffer()
+            return
+        
+        if not self.machineIsReadyForData:
+            return
+        
+        command = self.data.commands.get()
+        if command is not None:
+            gcode = command + " "
+            #mark the machine busy before writing so an ok which arrives straight away is not lost
+            self.machineIsReadyForData = False
+            self.sentLineNumbers.append(-1)
+            self._write(gcode)
+            
+        elif self.data.uploadFlag:
+            program = self._programBuffer()
+            index   = self.data.gcodeIndex
+            if index >= len(program):
+                self.data.uploadFlag = 0
+                print "Gcode Ended"
+            else:
+                self.machineIsReadyForData = False
+                self.sentLineNumbers.append(index)
+                self._writeBytes(program.lines(index, index + 1))
+                self.data.gcodeIndex = self.data.gcodeIndex + 1
+    
+    def _openPort(self):
+        '''
+        
+        Opens the port in data.comport. Returns False if it can not be opened.
+        
+        '''
+        
+        self._setState(OPENING)
+        if self.configure is not None:
+            self.configure(self)
+        port = self.data.comport
+        rate = self.baudRate
+        if self.autoBaud:
+            rate = self.negotiatedRates.get(port, rate)
+        try:
+            self.serialInstance = serial.Serial(port, rate, timeout = .25) #self.data.comport is the com port which is opened
+        except:
+            return False
+        
+        #The first time a port is used it has to be opened with odd parity before it works properly. I
+        #have no idea why. It does not need doing again when the same port is reopened after a loss.
+        try:
+            if port not in self.preparedPorts:
+                self.serialInstance.parity = serial.PARITY_ODD
+                self.serialInstance.close()
+                self.serialInstance.open()
+                self.serialInstance.close()
+                self.serialInstance.parity = serial.PARITY_NONE
+                self.serialInstance.open()
+                self.preparedPorts.add(port)
+        except:
+            #ports which do not support odd parity, like pseudo-terminals, can be opened directly
+            try:
+                self.serialInstance.close()
+                self.serialInstance.parity = serial.PARITY_NONE
+                self.serialInstance.open()
+            except:
+                return False
+        
+        self.firmwareVersion = None
+        if self.autoBaud:
+            try:
+                rate = self._negotiateBaudRate(port)
+            except:
+                rate = None
+            if rate is None:
                 try:
-                    msg = self.serialInstance.readline()
-                    msg = msg.decode('utf-8')
+                    self.serialInstance.close()
                 except:
                     pass
-                if len(msg) > 0:
-                    self.lastMessageTime = time.time()
-                    if msg == "ok\r\n":
-                        self.machineIsReadyForData = True
-                    else:
-                        self.data.message_queue.put(msg)
-                    
-                #send any emergency instructions to the machine if there are any
-                if self.data.quick_queue.empty() != True:
-                    command = self.data.quick_queue.get_nowait() + " "
-                    self._write(command)
-                    
-                #send gcode to machine if it is ready
-                if self.machineIsReadyForData:
-                    if self.data.gcode_queue.empty() != True:
-                        gcode = self.data.gcode_queue.get_nowait() + " "
-                        self._write(gcode)
-                        self.machineIsReadyForData = False
-                        
-                    elif self.data.uploadFlag:
-                        try:
-                            self._write(self.data.gcode[self.data.gcodeIndex])
-                            self.data.gcodeIndex = self.data.gcodeIndex + 1
-                            self.machineIsReadyForData = False
-                        except:
-                            self.data.uploadFlag = 0
-                            print "Gcode Ended"
-                
-                #check for serial connection loss
-                if time.time() - self.lastMessageTime > 2:
-                    print "connection lost"
-                    self.data.message_queue.put("Connection Lost")
-                    if self.data.uploadFlag:
-                        self.data.message_queue.put("Message: USB connection lost. Proceed?")
-                    self.data.connectionStatus = 0
+                return False
+        self.linkRate = rate
+        
+        self.data.message_queue.put("\r\nConnected on port " + port + " at " + str(rate) + " baud\r\n")
+        print("\r\nConnected on port " + port + " at " + str(rate) + " baud\r\n")
+        return True
+    
+    def _negotiateBaudRate(self, port):
+        '''
+        
+        Sends B05 at each rate in BAUDRATES until the firmware answers with its version, starting with
+        the rate which worked last time. The rates are tried again until handshakeTimeout has passed,
+        since the firmware does not answer while it starts up after the port is opened. Returns the
+        rate, with the port left at it, or None if the firmware does not answer.
+        
+        '''
+        
+        rates = list(BAUDRATES)
+        if port in self.negotiatedRates:
+            rates.remove(self.negotiatedRates[port])
+            rates.insert(0, self.negotiatedRates[port])
+        
+        deadline = time.time() + self.handshakeTimeout
+        while time.time() < deadline and self.running and not self.reopenRequested:
+            for rate in rates:
+                self.serialInstance.baudrate = rate
+                self.serialInstance.reset_input_buffer()
+                self.serialInstance.write(('B05' + self.lineEnding).encode())
+                answerBy = time.time() + self.probeTimeout
+                while time.time() < answerBy:
+                    line = self.serialInstance.readline()
+                    if line.startswith("Firmware Version"):
+                        self.negotiatedRates[port] = rate
+                        self.firmwareVersion = line.decode('utf-8', 'replace')
+                        self._discardProbeAnswers()
+                        return rate
+        return None
+    
+    def _discardProbeAnswers(self):
+        '''
+        
+        Ends the line the firmware is reading, which may still hold what it made of the probes sent at
+        the wrong rates, then throws away everything it sends within probeSettleTime, which includes
+        the ok for the probe, so that streaming starts with the firmware idle and nothing left to read.
+        
+        '''
+        
+        self.serialInstance.write(self.lineEnding.encode())
+        self.serialInstance.flush()
+        time.sleep(self.probeSettleTime)
+        self.serialInstance.reset_input_buffer()
+    
+    def _stream(self):
+        '''
+        
+        Sends to the machine over the open port until the connection is lost.
+        
+        '''
+        
+        self.lastMessageTime = time.time()
+        self.connectionLost  = False
+        #a firmware which answered while the baud rate was found has nothing left to acknowledge
+        self.machineIsReadyForData = self.firmwareVersion is not None
+        
+        self.linesInFlight   = deque()            #the length of each line sent but not yet acknowledged, oldest first
+        self.bytesInFlight   = 0
+        self.waitingCommand  = None               #a command taken from data.commands which did not fit in the buffer yet
+        self.sentLineNumbers = deque()            #the index of each program line sent but not yet acknowledged, -1 for commands
+        self.bytesSent       = 0
+        self.bytesReceived   = 0
+        self.lastLinkSample  = 0
+        self._setState(HANDSHAKING)
+        
+        if self.telemetryDirectory is not None:
+            try:
+                self.telemetry = TelemetryRecorder(newTelemetryFilename(self.telemetryDirectory))
+            except (IOError, OSError) as e:
+                print "telemetry can not be recorded:"
+                print e
+        
+        #incoming messages are read by the second thread so that this one can sleep until there is something to send
+        self.readerIdle.clear()
+        self.portOpened.set()
+        
+        if self.firmwareVersion is None:
+            self._getFirmwareVersion()
+        else:
+            #the version was read while finding the baud rate
+            self.data.message_queue.put(self.firmwareVersion)
+        self._setupMachineUnits()
+        
+        while True:
+            
+            #sleep until a command is queued, an ok arrives, the upload is started, or the read times out
+            self.data.serialWakeup.wait()
+            self.data.serialWakeup.clear()
+            
+            #a reopen asked for while the port was being opened is seen here, as connectionLost was
+            #cleared when streaming started
+            if self.reopenRequested:
+                self.connectionLost = True
+            
+            if self.connectionLost:
+                print "connection lost"
+                self.data.message_queue.put("Connection Lost")
+                if self.data.uploadFlag:
+                    self.data.message_queue.put("Message: USB connection lost. Proceed?")
+                self._setState(LOST)
+                self.data.connectionStatus = 0
+                self.readerIdle.wait()
+                try:
                     self.serialInstance.close()
-                    return
-                msg = ""
-                    
\ No newline at end of file
+                except:
+                    pass
+                if self.telemetry is not None:
+                    self.telemetry.close()
+                    self.telemetry = None
+                return
+            
+            #send any emergency and realtime instructions to the machine if there are any
+            for command, priority in self.data.commands.takeUrgent():
+                self._write(command + " ")
+                if priority == EMERGENCY:
+                    self._forgetLinesInFlight()
+            
+            #send gcode to machine if it is ready
+            self._sendNextLine()
+    
+    def getmessage (self):
+        '''
+        
+        Runs the connection until stop is called: opens the port, streams until the connection is lost,
+        and opens it again. A connection which has just been lost is retried after firstRetryDelay, and
+        each attempt which fails doubles the wait, up to maxRetryDelay.
+        
+        '''
+        
+        self.bufferLock    = threading.Lock()
+        self.preparedPorts = set()                #the ports which have been opened with odd parity once, see _openPort
+        self.negotiatedRates = {}                 #the rate found for each port by _negotiateBaudRate
+        self.portOpened = threading.Event()       #set to start the reading thread on a newly opened port
+        self.readerIdle = threading.Event()       #set when the reading thread has stopped reading the port
+        self.readThread = threading.Thread(target = self._readMessages)
+        self.readThread.daemon = True
+        self.readThread.start()
+        
+        delay = 0
+        while self.running:
+            #_openPort reads the settings after this, so any reopen asked for until now is carried out
+            self.reopenRequested = False
+            if self._openPort():
+                self._stream()
+                delay = self.firstRetryDelay
+            else:
+                self._setState(DISCONNECTED)
+                delay = min(max(2*delay, self.firstRetryDelay), self.maxRetryDelay)
+            
+            if self.running and not self.reopenRequested:
+                time.sleep(delay)
+        
+        self._setState(DISCONNECTED)
+        self.portOpened.set()
+    
+    def reopen(self):
+        '''
+        
+        Closes the port so that it is opened again with the current settings. Safe to call from any thread,
+        including while the port is being opened or the handshake is running, in which case the port is
+        opened again as soon as that finishes.
+        
+        '''
+        
+        self.reopenRequested = True
+        self.connectionLost  = True
+        self.data.serialWakeup.set()
+    
+    def stop(self):
+        '''
+        
+        Closes the connection and ends both threads. Safe to call from any thread.
+        
+        '''
+        
+        self.running = False
+        self.data.serialWakeup.set()
@@ -0,0 +1,80 @@
+'''
+
+This module provides the file handling shared by the caches which save work to a directory, GcodeCache
+and ErrorFieldCache.
+
+An entry is written to a temporary file next to it and only renamed into place once it is complete,
+so a crash or a full disk part way through never leaves a truncated entry to be read later. Reading
+an entry touches its modification time, and when the entries take up more than a cache's maxSize
+bytes the ones with the oldest modification times, the least recently used, are deleted.
+
+'''
+
+import os
+
+def writeEntry(path, write):
+    '''
+
+    Creates the file at path by calling write with a file object open on a temporary file, then
+    renaming the temporary file to path, replacing any file already there. The directory is created
+    if it does not exist. IOError and OSError are passed on to the caller, and the temporary file is
+    always deleted.
+
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    temporaryPath = path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        entryFile = open(temporaryPath, 'wb')
+        try:
+            write(entryFile)
+        finally:
+            entryFile.close()
+
+        #os.rename does not replace an existing file on Windows
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temporaryPath, path)
+    finally:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+
+def markUsed(path):
+    '''
+
+    Sets the modification time of the entry at path to now so that it is evicted last.
+
+    '''
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+def evictLeastRecentlyUsed(directory, extension, maxSize):
+    '''
+
+    Deletes the files in directory whose names end with extension, least recently used first, until
+    they take up no more than maxSize bytes. A file which is deleted by someone else while this runs
+    is skipped.
+
+    '''
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(extension):
+            try:
+                status = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, name))
+
+    totalSize = sum(size for lastUsed, size, name in entries)
+    for lastUsed, size, name in sorted(entries):
+        if totalSize <= maxSize:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+        totalSize = totalSize - size
@@ -0,0 +1,260 @@
+'''
+
+This module provides CommandScheduler which holds the commands waiting to be sent to the machine, in
+place of separate queues for urgent and ordinary commands.
+
+Every command is put in one of five priority classes:
+
+    EMERGENCY       sent straight away without waiting for the machine, and everything else
+                    waiting is thrown away (the stop command)
+    REALTIME        sent straight away without waiting for the machine
+    JOG             moves asked for from the front page
+    SETTINGS        settings and other machine commands
+    PROGRAM         lines which belong to the program, like the commands which resume it
+
+The serial port thread sends the commands of the first class which has any waiting, oldest first,
+and the lines of the open program only once no commands are waiting. A command which changes how the
+moves after it are read (units, distance mode or the machine's position) is never overtaken, and
+never overtakes commands which were queued before it, whatever their class.
+
+A jog which is added while the jog before it has not been sent yet is merged into it, so a run of
+presses of the jog buttons becomes a single move to the last target. Jogs in the XY plane are only
+merged with jogs in the XY plane and jogs of the z-axis only with jogs of the z-axis, so that lifting
+the bit before a move is never merged away.
+
+All the methods are safe to call from any thread. The event given to the scheduler is set whenever a
+command is added, so the serial port thread can sleep until there is something to send.
+
+'''
+
+from DataStructures.gcodeProgram             import WORDPATTERN
+from collections                             import deque, namedtuple
+
+import threading
+import time
+
+#Priority classes, most urgent first
+EMERGENCY = 0
+REALTIME  = 1
+JOG       = 2
+SETTINGS  = 3
+PROGRAM   = 4
+
+PRIORITYNAMES = ['emergency', 'realtime', 'jog', 'settings', 'program']
+
+#The classes which are sent straight away and the classes which wait for the machine
+URGENTCLASSES = (EMERGENCY, REALTIME)
+QUEUEDCLASSES = (JOG, SETTINGS, PROGRAM)
+
+#G codes which change how the moves after them are read
+BARRIERCODES  = (10, 20, 21, 90, 91)
+
+#The axes a jog moves, by the plane it is merged within
+JOGPLANES = {frozenset('X'): 'XY', frozenset('Y'): 'XY', frozenset('XY'): 'XY', frozenset('Z'): 'Z'}
+
+#What has happened to one priority class. depth is the number of commands waiting, sent, merged and
+#dropped the numbers sent, merged into a command already waiting and thrown away by a flush, and
+#meanWait and maxWait the time in seconds the sent commands waited.
+PriorityMetrics = namedtuple('PriorityMetrics', ['name', 'depth', 'sent', 'merged', 'dropped', 'meanWait', 'maxWait'])
+
+def isBarrier(command):
+    '''
+
+    Returns True if command changes how the moves after it are read.
+
+    '''
+    for letter, value in WORDPATTERN.findall(command.upper()):
+        if letter == 'G' and float(value) in BARRIERCODES:
+            return True
+    return False
+
+def _jogCommand(targets):
+    command = "G00"
+    for axis in 'XYZ':
+        if axis in targets:
+            command = command + " " + axis + str(targets[axis])
+    return command + " "
+
+class CommandScheduler(object):
+
+    def __init__(self, event):
+        self.event    = event
+        self.lock     = threading.Lock()
+
+        #each waiting command is [command, the time it was added, the jog targets or None], or for
+        #urgent commands [command, the time it was added, the class]
+        self.urgent   = deque()
+        #the queued commands are split into segments at each barrier so that nothing is reordered
+        #across one. Each segment holds a deque for each class in QUEUEDCLASSES.
+        self.segments = deque([self._newSegment()])
+
+        self.sent     = [0]*len(PRIORITYNAMES)
+        self.merged   = [0]*len(PRIORITYNAMES)
+        self.dropped  = [0]*len(PRIORITYNAMES)
+        self.waited   = [0.0]*len(PRIORITYNAMES)
+        self.maxWait  = [0.0]*len(PRIORITYNAMES)
+
+    def _newSegment(self):
+        return [deque() for priority in QUEUEDCLASSES]
+
+    def _queue(self, priority):
+        '''
+
+        Returns the deque new commands of a queued class are added to.
+
+        '''
+        return self.segments[-1][priority - JOG]
+
+    def put(self, command, priority = SETTINGS):
+        '''
+
+        Adds command to the end of its class.
+
+        '''
+        with self.lock:
+            if priority in URGENTCLASSES:
+                self.urgent.append([command, time.time(), priority])
+            elif isBarrier(command):
+                if any(self.segments[-1]):
+                    self.segments.append(self._newSegment())
+                self._queue(priority).append([command, time.time(), None])
+                self.segments.append(self._newSegment())
+            else:
+                self._queue(priority).append([command, time.time(), None])
+        self.event.set()
+
+    def jog(self, x = None, y = None, z = None):
+        '''
+
+        Adds a rapid move to the given absolute targets, merging it into the last jog if that has not
+        been sent yet and moves in the same plane.
+
+        '''
+        targets = {}
+        for axis, value in (('X', x), ('Y', y), ('Z', z)):
+            if value is not None:
+                targets[axis] = value
+        plane = JOGPLANES.get(frozenset(targets))
+
+        with self.lock:
+            jogs = self._queue(JOG)
+            if plane is not None and jogs and JOGPLANES.get(frozenset(jogs[-1][2])) == plane:
+                jogs[-1][2].update(targets)
+                jogs[-1][0] = _jogCommand(jogs[-1][2])
+                self.merged[JOG] = self.merged[JOG] + 1
+            else:
+                jogs.append([_jogCommand(targets), time.time(), targets])
+        self.event.set()
+
+    def _taken(self, priority, entry):
+        wait = time.time() - entry[1]
+        self.sent[priority]   = self.sent[priority] + 1
+        self.waited[priority] = self.waited[priority] + wait
+        if wait > self.maxWait[priority]:
+            self.maxWait[priority] = wait
+
+    def takeUrgent(self):
+        '''
+
+        Returns a list of (command, priority) for every emergency and realtime command waiting, in the
+        order they were added.
+
+        '''
+        with self.lock:
+            taken = []
+            while self.urgent:
+                entry = self.urgent.popleft()
+                self._taken(entry[2], entry)
+                taken.append((entry[0], entry[2]))
+            return taken
+
+    def get(self):
+        '''
+
+        Returns the next command to send which waits for the machine, or None if there is none.
+
+        '''
+        with self.lock:
+            while len(self.segments) > 1 and not any(self.segments[0]):
+                self.segments.popleft()
+            for priority, commands in zip(QUEUEDCLASSES, self.segments[0]):
+                if commands:
+                    entry = commands.popleft()
+                    self._taken(priority, entry)
+                    return entry[0]
+            return None
+
+    def hasQueued(self):
+        '''
+
+        Returns True if a command which waits for the machine is waiting.
+
+        '''
+        with self.lock:
+            return any(any(segment) for segment in self.segments)
+
+    def flush(self, priorities = QUEUEDCLASSES):
+        '''
+
+        Throws away every waiting command of the given classes in one step, and returns how many there were.
+
+        '''
+        with self.lock:
+            return self._flush(priorities)
+
+    def _flush(self, priorities):
+        count = 0
+        if any(priority in URGENTCLASSES for priority in priorities):
+            kept = deque()
+            for entry in self.urgent:
+                if entry[2] in priorities:
+                    self.dropped[entry[2]] = self.dropped[entry[2]] + 1
+                    count = count + 1
+                else:
+                    kept.append(entry)
+            self.urgent = kept
+        for segment in self.segments:
+            for priority, commands in zip(QUEUEDCLASSES, segment):
+                if priority in priorities:
+                    self.dropped[priority] = self.dropped[priority] + len(commands)
+                    count = count + len(commands)
+                    commands.clear()
+        return count
+
+    def emergencyStop(self, command = "!"):
+        '''
+
+        Throws away every waiting command and queues command to be sent straight away, in one step so
+        that nothing queued before the stop can be sent after it.
+
+        '''
+        with self.lock:
+            self._flush(URGENTCLASSES + QUEUEDCLASSES)
+            self.segments = deque([self._newSegment()])
+            self.urgent.append([command, time.time(), EMERGENCY])
+        self.event.set()
+
+    def depth(self, priority):
+        '''
+
+        Returns the number of commands of a class which are waiting.
+
+        '''
+        with self.lock:
+            return self._depth(priority)
+
+    def _depth(self, priority):
+        if priority in URGENTCLASSES:
+            return sum(1 for entry in self.urgent if entry[2] == priority)
+        return sum(len(segment[priority - JOG]) for segment in self.segments)
+
+    def metrics(self):
+        '''
+
+        Returns a PriorityMetrics for each class, most urgent first.
+
+        '''
+        with self.lock:
+            return [PriorityMetrics(name, self._depth(priority), self.sent[priority], self.merged[priority], self.dropped[priority],
+                                    self.waited[priority]/self.sent[priority] if self.sent[priority] else 0.0, self.maxWait[priority])
+                    for priority, name in enumerate(PRIORITYNAMES)]
@@ -0,0 +1,124 @@
+'''
+
+This module provides ConsoleBuffer which holds the history of the text console.
+
+The lines are kept in a ring of fixed capacity, so once it is full each new line replaces the oldest
+one and the memory used stops growing. Writing a line costs the same however long the history is,
+the whole history can be searched and exported, and the console widget is only given the last few
+lines to display.
+
+Lines are numbered from the first line ever written, so a line keeps its number after older lines
+have been dropped.
+
+'''
+
+CAPACITY = 100000   #the number of lines kept
+
+class ConsoleBuffer(object):
+
+    def __init__(self, capacity = CAPACITY):
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        '''
+
+        Removes every line.
+
+        '''
+        self.lines   = [None]*self.capacity
+        self.start   = 0        #the index in self.lines of the oldest line
+        self.count   = 0        #the number of lines held
+        self.written = 0        #the number of lines ever written
+        self.partial = ""       #text written after the last newline
+
+    def write(self, text):
+        '''
+
+        Adds text to the end of the console. The text can hold any number of lines. Text after the
+        last newline is held until the rest of its line is written.
+
+        '''
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self._append(line.rstrip('\r'))
+
+    def _append(self, line):
+        if self.count < self.capacity:
+            self.lines[(self.start + self.count) % self.capacity] = line
+            self.count = self.count + 1
+        else:
+            self.lines[self.start] = line
+            self.start = (self.start + 1) % self.capacity
+        self.written = self.written + 1
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        '''
+
+        Returns a line held in the buffer, where 0 is the oldest line and -1 the newest.
+
+        '''
+        if index < 0:
+            index = index + self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("console line index out of range")
+        return self.lines[(self.start + index) % self.capacity]
+
+    def __iter__(self):
+        for index in xrange(self.count):
+            yield self.lines[(self.start + index) % self.capacity]
+
+    def firstLineNumber(self):
+        '''
+
+        Returns the number of the oldest line held.
+
+        '''
+        return self.written - self.count
+
+    def tail(self, count):
+        '''
+
+        Returns the newest count lines and any unfinished line as a single string for display.
+
+        '''
+        count = min(count, self.count)
+        lines = [self[index] for index in xrange(self.count - count, self.count)]
+        lines.append(self.partial)
+        return '\n'.join(lines)
+
+    def search(self, text, caseSensitive = False):
+        '''
+
+        Returns a list of (lineNumber, line) for each line held which contains text.
+
+        '''
+        if not caseSensitive:
+            text = text.lower()
+
+        matches = []
+        lineNumber = self.firstLineNumber()
+        for line in self:
+            if text in (line if caseSensitive else line.lower()):
+                matches.append((lineNumber, line))
+            lineNumber = lineNumber + 1
+        return matches
+
+    def export(self, filename):
+        '''
+
+        Writes every line held to filename.
+
+        '''
+        exportFile = open(filename, 'w')
+        try:
+            for line in self:
+                exportFile.write(line + '\n')
+            if self.partial:
+                exportFile.write(self.partial)
+        finally:
+            exportFile.close()
@@ -6,7 +6,11 @@ from kivy.properties                                  import OptionProperty
 from kivy.properties                                  import NumericProperty
 from kivy.event                                       import EventDispatcher
 from DataStructures.logger                            import   Logger
+from DataStructures.gcodeProgram                      import   GcodeProgram
+from DataStructures.commandScheduler                  import   CommandScheduler
+from DataStructures.consoleBuffer                     import   ConsoleBuffer
 import Queue
+import threading
 
 class Data(EventDispatcher):
     '''
@@ -23,8 +27,10 @@ class Data(EventDispatcher):
     Data available to all widgets
     '''
     
-    #Gcodes contains all of the lines of gcode in the opened file
-    gcode      = ObjectProperty([])
+    #Gcodes contains all of the lines of gcode in the opened file along with their parsed values
+    gcode      = ObjectProperty(GcodeProgram([]))
+    #the length and time of the path up to each line of gcode, used to show progress
+    progressEstimate = None
     version    = '0.65'
     #all of the available COM ports
     comPorts   = []
@@ -32,6 +38,9 @@ class Data(EventDispatcher):
     comport    = StringProperty("")
     #The index of the next unread line of Gcode
     gcodeIndex = NumericProperty(0)
+    #The line shown as running while telemetry is replayed, -1 when nothing is replayed. Display only,
+    #a replay never changes gcodeIndex
+    replayIndex = NumericProperty(-1)
     #Holds the current value of the feed rate
     feedRate   = 20
     #holds the address of the g-code file so that the gcode can be refreshed
@@ -42,6 +51,7 @@ class Data(EventDispatcher):
     units      = OptionProperty("MM", options=["MM", "INCHES"])
     gcodeShift = ObjectProperty([0.0,0.0])                          #the amount that the gcode has been shifted
     logger     =  Logger()                                          #the module which records the machines behavior to review later
+    console    =  ConsoleBuffer()                                   #the history of the text console
     
     '''
     Flags
@@ -52,6 +62,14 @@ class Data(EventDispatcher):
     firstTimePosFlag = 0
     #report if the serial connection is open
     connectionStatus = BooleanProperty(0)
+    #the state of the connection to the machine, see Connection.serialPortThread
+    connectionState  = OptionProperty("disconnected", options=["disconnected", "opening", "handshaking", "streaming", "lost"])
+    
+    '''
+    Counters
+    '''
+    #the number of position and error reports from the machine which could not be read
+    malformedReports = 0
     
     '''
     Pointers to Objects
@@ -62,9 +80,9 @@ class Data(EventDispatcher):
     '''
     Queues
     '''
+    serialWakeup    =  threading.Event()                                #set when there may be something for the serial port thread to send
     message_queue   =  Queue.Queue()
-    gcode_queue     =  Queue.Queue()
-    quick_queue     =  Queue.Queue()
+    commands        =  CommandScheduler(serialWakeup)                   #the commands waiting to be sent to the machine, by priority
     
     def __init__(self):
         '''
@@ -73,3 +91,6 @@ class Data(EventDispatcher):
         
         '''
         self.logger.data = self
+        
+        #wake the serial port thread when an upload is started
+        self.bind(uploadFlag = lambda *args: self.serialWakeup.set())
@@ -0,0 +1,228 @@
+'''
+
+This module provides ErrorField which holds the error of the simulation's sled model at every point
+of a grid over the work area, so that the error anywhere on the work area can be looked up without
+running the model again.
+
+The grid has a point every step millimeters from the bottom left corner of the work area. Positions
+are in Ground Control's coordinates, with the origin at the center of the work area. Looking up a
+position interpolates between the four grid points around it, which takes the same time wherever the
+position is and however fine the grid.
+
+The grid is held in float32. Fields are saved in the cache directory as compressed NumPy .npz files
+named after the machine settings they were built from, so a field is only built once for each
+machine. When the saved fields take up more than maxSize bytes the least recently used ones are
+deleted, using cacheFiles as GcodeCache does. ErrorFieldBuilder loads or builds a field in a
+background thread and passes it back through its queue as ("done", field) or ("error", message), in
+the same way as GcodeLoader.
+
+'''
+
+from DataStructures.cacheFiles               import writeEntry, markUsed, evictLeastRecentlyUsed
+
+import hashlib
+import numpy
+import os
+import Queue
+import threading
+import zipfile
+
+VERSION   = 2           #changes when the sled model or the saved format change, so old fields are not used
+STEP      = 2.0         #the spacing of the grid in mm
+EXTENSION = '.npz'
+
+#the colors the heatmap goes through from no error to the largest error
+HEATMAPSTOPS  = [0.0, 1.0/3, 2.0/3, 1.0]
+HEATMAPRED    = [0.0, 0.0, 1.0, 1.0]
+HEATMAPGREEN  = [0.0, 1.0, 1.0, 0.0]
+HEATMAPBLUE   = [1.0, 0.0, 0.0, 0.0]
+HEATMAPALPHA  = .4
+
+class ErrorField(object):
+
+    def __init__(self, bedWidth, bedHeight, step, correctionX, correctionY, error):
+        self.bedWidth    = float(bedWidth)
+        self.bedHeight   = float(bedHeight)
+        self.step        = float(step)
+        self.correctionX = correctionX      #arrays of rows from the bottom of the work area up
+        self.correctionY = correctionY
+        self.error       = error
+
+        self.rows, self.columns = error.shape
+        self.largestError = float(numpy.nanmax(error)) if error.size else 0.0
+
+    def _cells(self, x, y):
+        '''
+
+        Returns the row and column of the grid point below and to the left of each position and how far
+        each position is across to the next point up and to the right, as a fraction of the step.
+
+        '''
+        column = (numpy.asarray(x, dtype = numpy.float64) + self.bedWidth/2)/self.step
+        row    = (numpy.asarray(y, dtype = numpy.float64) + self.bedHeight/2)/self.step
+
+        #positions off the work area take the value at its edge
+        column = numpy.clip(column, 0, self.columns - 1)
+        row    = numpy.clip(row, 0, self.rows - 1)
+
+        left   = numpy.minimum(column.astype(numpy.intp), max(self.columns - 2, 0))
+        bottom = numpy.minimum(row.astype(numpy.intp), max(self.rows - 2, 0))
+
+        return bottom, left, row - bottom, column - left
+
+    def _interpolate(self, values, cells):
+        bottom, left, up, across = cells
+        right = numpy.minimum(left + 1, self.columns - 1)
+        top   = numpy.minimum(bottom + 1, self.rows - 1)
+
+        lower = values[bottom, left]*(1 - across) + values[bottom, right]*across
+        upper = values[top, left]*(1 - across) + values[top, right]*across
+        return lower*(1 - up) + upper*up
+
+    def sample(self, x, y):
+        '''
+
+        Returns the error distance at x, y. Takes arrays or plain numbers.
+
+        '''
+        return self._interpolate(self.error, self._cells(x, y))
+
+    def sampleCorrection(self, x, y):
+        '''
+
+        Returns the x and y of the correction at x, y. Takes arrays or plain numbers.
+
+        '''
+        cells = self._cells(x, y)
+        return self._interpolate(self.correctionX, cells), self._interpolate(self.correctionY, cells)
+
+    def heatmap(self):
+        '''
+
+        Returns the error at each grid point as RGBA bytes, bottom row first, colored from blue for no
+        error through green and yellow to red for the largest error.
+
+        '''
+        scale = self.error/self.largestError if self.largestError > 0 else numpy.zeros_like(self.error)
+        scale = numpy.nan_to_num(scale)
+
+        colors = numpy.empty(self.error.shape + (4,), dtype = numpy.uint8)
+        for channel, stops in enumerate((HEATMAPRED, HEATMAPGREEN, HEATMAPBLUE)):
+            colors[..., channel] = 255*numpy.interp(scale, HEATMAPSTOPS, stops)
+        colors[..., 3] = numpy.where(numpy.isnan(self.error), 0, int(255*HEATMAPALPHA))
+        return colors.tostring()
+
+def buildErrorField(model, step = STEP):
+    '''
+
+    Runs model at every point of a grid step millimeters apart over the work area and returns the
+    ErrorField.
+
+    '''
+    x, y   = model.grid(step)
+    result = model.simulate(x, y)
+
+    shape = x.shape
+    return ErrorField(model.bedWidth, model.bedHeight, step, result.correctionX.reshape(shape).astype(numpy.float32),
+                      result.correctionY.reshape(shape).astype(numpy.float32), result.error.reshape(shape).astype(numpy.float32))
+
+class ErrorFieldCache(object):
+
+    maxSize = 64*1024*1024      #the most bytes the saved fields may take up together
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def entryPath(self, model, step):
+        '''
+
+        Returns the path of the field for model with a grid step millimeters apart.
+
+        '''
+        key = "%d|%r|%r|%r|%r|%r|%r|%r" % (VERSION, model.bedWidth, model.bedHeight, model.motorTranslate,
+                                            model.motorLift, model.sledWidth, model.sledHeight, float(step))
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + EXTENSION)
+
+    def load(self, model, step = STEP):
+        '''
+
+        Returns the saved ErrorField for model, or None if there is none.
+
+        '''
+        path = self.entryPath(model, step)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            arrays = numpy.load(path)
+            try:
+                field = ErrorField(model.bedWidth, model.bedHeight, step, arrays['correctionX'], arrays['correctionY'], arrays['error'])
+            finally:
+                arrays.close()
+        except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile) as e:
+            print "error field could not be read:"
+            print e
+            return None
+
+        markUsed(path)
+        return field
+
+    def store(self, model, field):
+        '''
+
+        Saves field as the field for model, then deletes the least recently used fields if the cache
+        has grown too large.
+
+        '''
+        #save through a file object so numpy does not add .npz to the temporary name
+        def write(fieldFile):
+            numpy.savez_compressed(fieldFile, correctionX = field.correctionX.astype(numpy.float32),
+                                   correctionY = field.correctionY.astype(numpy.float32), error = field.error.astype(numpy.float32))
+
+        try:
+            writeEntry(self.entryPath(model, field.step), write)
+            self.evict()
+        except (IOError, OSError) as e:
+            print "error field could not be written:"
+            print e
+
+    def evict(self):
+        '''
+
+        Deletes the least recently used fields until the fields take up no more than maxSize bytes.
+
+        '''
+        evictLeastRecentlyUsed(self.directory, EXTENSION, self.maxSize)
+
+class ErrorFieldBuilder(object):
+
+    def __init__(self, model, cache = None, step = STEP):
+        self.model = model
+        self.cache = cache
+        self.step  = step
+        self.queue = Queue.Queue()
+
+    def start(self):
+        '''
+
+        Starts loading or building the field in a new thread.
+
+        '''
+        thread = threading.Thread(target = self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        try:
+            field = None
+            if self.cache is not None:
+                field = self.cache.load(self.model, self.step)
+
+            if field is None:
+                field = buildErrorField(self.model, self.step)
+                if self.cache is not None:
+                    self.cache.store(self.model, field)
+
+            self.queue.put(("done", field))
+        except Exception as e:
+            self.queue.put(("error", str(e)))
@@ -0,0 +1,193 @@
+'''
+
+This module provides GcodeCache which saves the parsed program and the render geometry of each gcode
+file opened so that opening the same file again does not read and parse it from scratch.
+
+Each entry is one file in the cache directory. Entries are named after the path, size, modification
+time and shift of the gcode file, and hold a hash of its contents which is checked before the entry
+is used. When the entries take up more than maxSize bytes the least recently used ones are deleted.
+
+An entry is a header followed by a series of arrays, each stored as its typecode, item size and
+length followed by the raw array data:
+
+    header          MAGIC, byte order, content hash, line count, line format, units
+    lines           the normalized text joined by newlines, or the line offsets of a MappedGcodeFile
+    columns         each column of the GcodeProgram in COLUMNNAMES order
+    checkpoints     the saved modal states of the GcodeProgram one after another in one array
+    geometry        the buffers of each level of detail in BUFFERNAMES order, level 0 first
+
+'''
+
+from DataStructures.cacheFiles               import writeEntry, markUsed, evictLeastRecentlyUsed
+from DataStructures.gcodeProgram             import GcodeProgram, COLUMNNAMES, CHECKPOINTFIELDS
+from DataStructures.mappedGcodeFile          import MappedGcodeFile
+from DataStructures.toolpathGeometry         import ToolpathGeometry, BUFFERNAMES
+from array                                   import array
+
+import hashlib
+import os
+import struct
+import sys
+
+MAGIC          = 'GCPC0003'
+HEADER         = struct.Struct('<8sc20sQBB')
+ARRAYHEADER    = struct.Struct('<cBQ')
+ENTRYEXTENSION = '.gcache'
+
+#Line formats
+TEXTLINES      = 0
+MAPPEDLINES    = 1
+
+UNITCODES      = {None : 0, "MM" : 1, "INCHES" : 2}
+UNITNAMES      = dict((code, name) for name, code in UNITCODES.items())
+
+HASHBLOCKSIZE  = 1024*1024
+
+def hashFile(filename):
+    '''
+
+    Returns the SHA-1 digest of the contents of a file.
+
+    '''
+    digest = hashlib.sha1()
+    gcodeFile = open(filename, 'rb')
+    try:
+        block = gcodeFile.read(HASHBLOCKSIZE)
+        while block:
+            digest.update(block)
+            block = gcodeFile.read(HASHBLOCKSIZE)
+    finally:
+        gcodeFile.close()
+    return digest.digest()
+
+def _writeArray(cacheFile, values):
+    cacheFile.write(ARRAYHEADER.pack(values.typecode, values.itemsize, len(values)))
+    values.tofile(cacheFile)
+
+def _readArray(cacheFile, into = None):
+    '''
+
+    Reads an array from cacheFile, appending it to into if it is given. Raises ValueError if the
+    stored array does not match this computer's item size.
+
+    '''
+    typecode, itemsize, length = ARRAYHEADER.unpack(cacheFile.read(ARRAYHEADER.size))
+    if into is None:
+        into = array(typecode)
+    if into.typecode != typecode or into.itemsize != itemsize:
+        raise ValueError("cache entry was written with a different array format")
+    into.fromfile(cacheFile, length)
+    return into
+
+class GcodeCache(object):
+
+    maxSize = 1024*1024*1024    #the most bytes the entries may take up together
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def entryPath(self, filename, shift):
+        '''
+
+        Returns the path of the cache entry for filename moved by shift.
+
+        '''
+        status = os.stat(filename)
+        key = "%s|%d|%r|%r|%r" % (os.path.abspath(filename), status.st_size, status.st_mtime, float(shift[0]), float(shift[1]))
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + ENTRYEXTENSION)
+
+    def load(self, filename, shift):
+        '''
+
+        Returns the (program, geometry) saved for filename moved by shift, or None if there is no
+        up to date entry for it.
+
+        '''
+        try:
+            path = self.entryPath(filename, shift)
+            if not os.path.exists(path):
+                return None
+
+            cacheFile = open(path, 'rb')
+            try:
+                magic, byteorder, contentHash, lineCount, lineFormat, units = HEADER.unpack(cacheFile.read(HEADER.size))
+                if magic != MAGIC or byteorder != sys.byteorder[0] or contentHash != hashFile(filename):
+                    return None
+
+                if lineFormat == MAPPEDLINES:
+                    lines = MappedGcodeFile(filename, _readArray(cacheFile))
+                else:
+                    lines = _readArray(cacheFile).tostring().split('\n')
+                if len(lines) != lineCount:
+                    return None
+
+                columns = {}
+                for name in COLUMNNAMES:
+                    columns[name] = _readArray(cacheFile)
+                savedStates = _readArray(cacheFile)
+                checkpoints = []
+                for start in xrange(0, len(savedStates), CHECKPOINTFIELDS):
+                    command, scale, relative, feed, posX, posY, posZ = savedStates[start:start + CHECKPOINTFIELDS]
+                    checkpoints.append((int(command), scale, bool(relative), feed, posX, posY, posZ))
+                program = GcodeProgram(lines, shift, columns = columns, checkpoints = checkpoints)
+                program.units = UNITNAMES[units]
+
+                geometry = ToolpathGeometry()
+                for level in geometry.levels:
+                    for name in BUFFERNAMES:
+                        _readArray(cacheFile, level[name])
+            finally:
+                cacheFile.close()
+
+            markUsed(path)
+            return program, geometry
+        except (IOError, OSError, EOFError, ValueError, struct.error, KeyError) as e:
+            print "gcode cache entry could not be read:"
+            print e
+            return None
+
+    def store(self, filename, program, geometry):
+        '''
+
+        Saves program and the geometry built from it as the entry for filename, then deletes the
+        least recently used entries if the cache has grown too large.
+
+        '''
+        def write(cacheFile):
+            if isinstance(program.lines, MappedGcodeFile):
+                lineFormat = MAPPEDLINES
+            else:
+                lineFormat = TEXTLINES
+            cacheFile.write(HEADER.pack(MAGIC, sys.byteorder[0], hashFile(filename), len(program), lineFormat, UNITCODES[program.units]))
+
+            if lineFormat == MAPPEDLINES:
+                _writeArray(cacheFile, program.lines.offsets)
+            else:
+                _writeArray(cacheFile, array('c', '\n'.join(program.lines)))
+
+            for name in COLUMNNAMES:
+                _writeArray(cacheFile, getattr(program, name))
+
+            savedStates = array('d')
+            for state in program.checkpoints:
+                savedStates.extend(state)
+            _writeArray(cacheFile, savedStates)
+
+            for level in geometry.levels:
+                for name in BUFFERNAMES:
+                    _writeArray(cacheFile, level[name])
+
+        try:
+            writeEntry(self.entryPath(filename, program.shift), write)
+            self.evict()
+        except (IOError, OSError) as e:
+            print "gcode cache entry could not be written:"
+            print e
+
+    def evict(self):
+        '''
+
+        Deletes the least recently used entries until the entries take up no more than maxSize bytes.
+
+        '''
+        evictLeastRecentlyUsed(self.directory, ENTRYEXTENSION, self.maxSize)
@@ -0,0 +1,142 @@
+'''
+
+This module provides the GcodeLoader which reads, parses, and builds the vertex buffers for a gcode
+file in a background thread so that opening a large file does not freeze the user interface.
+
+The loader passes its results back to the main thread through its queue as tuples:
+
+    ("chunk", buffers, fraction)    the new level 0 segments for each buffer name, and the fraction
+                                    of the file which has been processed so far
+    ("done", program, geometry, estimate)
+                                    the finished GcodeProgram, ToolpathGeometry and ProgressEstimate
+    ("error", message, unreadable)  the file could not be loaded, where unreadable is True if the file
+                                    itself could not be read, as when it has been moved or deleted, and
+                                    False for any other failure
+
+If the loader is given a GcodeCache, a file which has been loaded before is read from the cache
+instead and sent back as a single "done", and newly loaded files are saved to the cache.
+
+A loader which has been cancelled stops at the next chunk and puts nothing more in its queue, and
+closes the file of the program it opened.
+
+'''
+
+from DataStructures.mappedGcodeFile          import openGcodeFile
+from DataStructures.gcodeProgram             import GcodeProgram
+from DataStructures.toolpathGeometry         import ToolpathGeometry, BUFFERNAMES
+from DataStructures.progressEstimate         import ProgressEstimate, DEFAULTRAPIDRATE
+
+import Queue
+import threading
+
+class GcodeLoader(object):
+
+    linesPerChunk = 5000    #the number of lines parsed and sent to the canvas at a time
+
+    def __init__(self, filename = None, shift = (0.0, 0.0), program = None, cache = None, rapidRate = DEFAULTRAPIDRATE):
+        '''
+
+        Loads filename moved by shift, or if program is given builds the geometry for an already
+        parsed program. rapidRate is the speed of G00 moves used to estimate the time the program takes.
+
+        '''
+        self.filename  = filename
+        self.shift     = shift
+        self.program   = program
+        self.cache     = cache
+        self.rapidRate = rapidRate
+
+        self.queue     = Queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread    = None
+
+    def start(self):
+        '''
+
+        Starts loading in a new thread.
+
+        '''
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+        '''
+
+        Asks the loading thread to stop. Safe to call from any thread.
+
+        '''
+        self.cancelled.set()
+
+    def _abandon(self, program):
+        '''
+
+        Closes program if this loader opened it, once it is not going to be passed back.
+
+        '''
+        if program is not None and program is not self.program:
+            program.close()
+
+    def run(self):
+        program = self.program
+        try:
+            if program is None and self.cache is not None:
+                cached = self.cache.load(self.filename, self.shift)
+                if cached is not None:
+                    program  = cached[0]
+                    estimate = ProgressEstimate(program, self.rapidRate)
+                    if self.cancelled.is_set():
+                        self._abandon(program)
+                    else:
+                        self.queue.put(("done",) + cached + (estimate,))
+                    return
+
+            if program is None:
+                program = GcodeProgram(openGcodeFile(self.filename), self.shift, parse = False)
+
+            geometry   = ToolpathGeometry()
+            lastLine   = len(program)
+            lineNumber = 0
+
+            while lineNumber < lastLine:
+                if self.cancelled.is_set():
+                    self._abandon(program)
+                    return
+
+                nextLine = min(lineNumber + self.linesPerChunk, lastLine)
+
+                marks = {}
+                for name in BUFFERNAMES:
+                    marks[name] = len(geometry.buffers[name])
+
+                program.parseLines(nextLine)
+                geometry.addLines(program, lineNumber, nextLine)
+                lineNumber = nextLine
+
+                #send copies of the new segments so the canvas never reads a buffer this thread is extending
+                buffers = {}
+                for name in BUFFERNAMES:
+                    buffers[name] = geometry.buffers[name][marks[name]:]
+
+                self.queue.put(("chunk", buffers, float(lineNumber)/lastLine))
+
+            geometry.finish()
+            estimate = ProgressEstimate(program, self.rapidRate)
+
+            passedBack = not self.cancelled.is_set()
+            if passedBack:
+                self.queue.put(("done", program, geometry, estimate))
+
+            if self.program is None and self.cache is not None:
+                self.cache.store(self.filename, program, geometry)
+
+            if not passedBack:
+                self._abandon(program)
+        except (IOError, OSError) as e:
+            self._abandon(program)
+            if not self.cancelled.is_set():
+                self.queue.put(("error", str(e), True))
+        except Exception as e:
+            self._abandon(program)
+            if not self.cancelled.is_set():
+                self.queue.put(("error", "%s: %s" % (type(e).__name__, e), False))
@@ -0,0 +1,365 @@
+'''
+
+This module provides the GcodeProgram object which holds the lines of the open gcode file along with
+a compact, pre-parsed copy of the values on each line.
+
+Every line is parsed exactly once when the program is built. The results are stored in typed arrays
+(one entry per line) rather than in Python objects so that the rendering, index seeking, and progress
+estimation code can read numbers directly without parsing the text again.
+
+A GcodeProgram behaves like a list of strings: len(program) is the number of lines and program[i] is
+the text of line i as it should be sent to the machine.
+
+'''
+
+from array                                   import array
+from collections                             import namedtuple
+
+import re
+
+#Motion commands
+RAPID            = 0
+LINE             = 1
+CLOCKWISEARC     = 2
+COUNTERCLOCKARC  = 3
+
+#Bits of the mask column. A bit is set if the word was present on the line.
+HASX      = 1
+HASY      = 2
+HASZ      = 4
+HASI      = 8
+HASJ      = 16
+HASF      = 32
+ISINCHES  = 64      #the line was interpreted in inches (G20)
+ISMOVE    = 128     #the line moves the machine
+
+AXISWORDS = HASX | HASY | HASZ
+
+INCHES      = 25.4
+MILLIMETERS = 1.0
+
+#The names of the columns, in the order they are stored
+COLUMNNAMES = ['command', 'mask', 'x', 'y', 'z', 'i', 'j', 'f', 'posX', 'posY', 'posZ']
+
+#The number of lines read from the line list at a time while parsing
+PARSEBLOCKLINES = 10000
+
+#The modal state is saved every CHECKPOINTLINES lines while parsing so the state at any line can be
+#found by parsing no more than this many lines again
+CHECKPOINTLINES  = 1000
+CHECKPOINTFIELDS = 7        #the number of values in each saved state
+
+#The state of the machine between two lines. Units are "MM" or "INCHES", feedRate is in mm per minute
+#(0 before the first F word) and the position is in mm.
+ModalState = namedtuple('ModalState', ['motion', 'units', 'relative', 'feedRate', 'x', 'y', 'z'])
+
+#A letter followed by a number. Letters which are not followed by a number are ignored.
+WORDPATTERN = re.compile(r'([GXYZIJF])([+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))')
+
+def shiftLine(gcodeLine, shift):
+    '''
+
+    Returns gcodeLine with the X and Y values moved by the amount in shift.
+
+    '''
+    originalLine = gcodeLine
+
+    try:
+        gcodeLine = gcodeLine.upper() + " "
+
+        x = gcodeLine.find('X')
+        if x != -1:
+            space = gcodeLine.find(' ', x)
+            number = float(gcodeLine[x+1:space]) + shift[0]
+            gcodeLine = gcodeLine[0:x+1] + str(number) + gcodeLine[space:]
+
+        y = gcodeLine.find('Y')
+        if y != -1:
+            space = gcodeLine.find(' ', y)
+            number = float(gcodeLine[y+1:space]) + shift[1]
+            gcodeLine = gcodeLine[0:y+1] + str(number) + gcodeLine[space:]
+
+        return gcodeLine
+    except ValueError:
+        print "line could not be moved:"
+        print originalLine
+        return originalLine
+
+class GcodeProgram(object):
+    '''
+
+    The lines of a gcode program together with the parsed value columns.
+
+    Columns (one entry per line):
+        command             the motion command (RAPID, LINE, CLOCKWISEARC, COUNTERCLOCKARC) in effect
+        mask                which words were present, see the HAS* bits above
+        x, y, z, i, j, f    the value of each word as written in the file, 0 if absent
+        posX, posY, posZ    the absolute position in mm after the line has run
+
+    '''
+
+    def __init__(self, lines, shift = (0.0, 0.0), parse = True, columns = None, checkpoints = None):
+        '''
+
+        Parse every line of the program. The lines can be any object which supports len(), indexing
+        and slicing, such as a list or a MappedGcodeFile. shift is the amount the program has been
+        moved by the user.
+
+        If parse is False the columns are allocated but not filled, and parseLines should be used to
+        parse the program a piece at a time. columns can be a dictionary of already parsed columns,
+        such as the ones saved by GcodeCache, in which case the lines are not parsed again, together with
+        the checkpoints saved with them.
+
+        '''
+        self.lines    = lines
+        self.shift    = (float(shift[0]), float(shift[1]))
+        self.isShifted = self.shift[0] != 0 or self.shift[1] != 0
+
+        #the units of the last G20 or G21 in the file, None if the file does not specify units
+        self.units    = None
+
+        #the number of lines which have been parsed so far
+        self.parsedLines = 0
+
+        #the modal state after the last parsed line: motion command, scale, relative mode, feed rate, and position
+        self._modalState = (RAPID, MILLIMETERS, False, 0.0, 0.0, 0.0, 0.0)
+
+        #the modal state before every CHECKPOINTLINES'th line, in the same form as _modalState
+        self.checkpoints = []
+
+        if columns is not None:
+            for name in COLUMNNAMES:
+                setattr(self, name, columns[name])
+            self.parsedLines = len(lines)
+            if checkpoints is not None:
+                self.checkpoints = checkpoints
+            return
+
+        self._allocateColumns()
+
+        if parse:
+            self.parseLines(len(lines))
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, index):
+        '''
+
+        Returns the text of a line as it should be sent to the machine.
+
+        '''
+        if self.isShifted:
+            return shiftLine(self.lines[index], self.shift)
+        return self.lines[index]
+
+    def __iter__(self):
+        for index in xrange(len(self.lines)):
+            yield self[index]
+
+    def linesHaveChanged(self):
+        '''
+
+        Returns True if the lines are read from a file, as with a MappedGcodeFile, which has changed
+        since the program was opened.
+
+        '''
+        hasChanged = getattr(self.lines, 'hasChanged', None)
+        return hasChanged is not None and hasChanged()
+
+    def close(self):
+        '''
+
+        Releases the file the lines are read from, if there is one. The lines can not be read after.
+
+        '''
+        close = getattr(self.lines, 'close', None)
+        if close is not None:
+            close()
+
+    def _allocateColumns(self):
+        '''
+
+        The columns are allocated at full length up front and filled by index, which is much faster
+        than appending to eleven arrays for every line.
+
+        '''
+        count = len(self.lines)
+
+        zeros = array('d', [0.0]) * count
+        self.command  = array('B', [RAPID]) * count
+        self.mask     = array('B', [0]) * count
+        self.x        = array('d', zeros)
+        self.y        = array('d', zeros)
+        self.z        = array('d', zeros)
+        self.i        = array('d', zeros)
+        self.j        = array('d', zeros)
+        self.f        = array('d', zeros)
+        self.posX     = array('d', zeros)
+        self.posY     = array('d', zeros)
+        self.posZ     = array('d', zeros)
+
+    def parseLines(self, end):
+        '''
+
+        Fill the columns by parsing each line from the first unparsed line up to end. Each line is
+        parsed only once.
+
+        '''
+        lines = self.lines
+        start = self.parsedLines
+        end   = min(end, len(lines))
+
+        commandColumn, maskColumn = self.command, self.mask
+        xColumn, yColumn, zColumn = self.x, self.y, self.z
+        iColumn, jColumn, fColumn = self.i, self.j, self.f
+        posXColumn, posYColumn, posZColumn = self.posX, self.posY, self.posZ
+
+        shiftX, shiftY = self.shift
+
+        command, scale, relative, feed, posX, posY, posZ = self._modalState
+
+        checkpoints    = self.checkpoints
+        nextCheckpoint = -(-start // CHECKPOINTLINES) * CHECKPOINTLINES
+
+        findWords    = WORDPATTERN.findall
+
+        for blockStart in xrange(start, end, PARSEBLOCKLINES):
+            #reading a slice of lines is much faster than reading them one at a time from a MappedGcodeFile
+            block = lines[blockStart:min(blockStart + PARSEBLOCKLINES, end)]
+
+            for index, line in enumerate(block, blockStart):
+                if index == nextCheckpoint:
+                    checkpoints.append((command, scale, relative, feed, posX, posY, posZ))
+                    nextCheckpoint = nextCheckpoint + CHECKPOINTLINES
+
+                mask       = 0
+                motion     = None
+                otherGcode = False
+                x = y = z = None
+
+                for letter, value in findWords(line.upper()):
+                    if letter == 'G':
+                        code = float(value)
+                        if code in (0, 1, 2, 3):
+                            motion = int(code)
+                        elif code == 20:
+                            scale = INCHES
+                            self.units = "INCHES"
+                        elif code == 21:
+                            scale = MILLIMETERS
+                            self.units = "MM"
+                        elif code == 90:
+                            relative = False
+                        elif code == 91:
+                            relative = True
+                        else:
+                            otherGcode = True
+                    elif letter == 'X':
+                        if not mask & HASX:
+                            x = float(value) + shiftX
+                            xColumn[index] = x
+                            mask = mask | HASX
+                    elif letter == 'Y':
+                        if not mask & HASY:
+                            y = float(value) + shiftY
+                            yColumn[index] = y
+                            mask = mask | HASY
+                    elif letter == 'Z':
+                        if not mask & HASZ:
+                            z = float(value)
+                            zColumn[index] = z
+                            mask = mask | HASZ
+                    elif letter == 'I':
+                        if not mask & HASI:
+                            iColumn[index] = float(value)
+                            mask = mask | HASI
+                    elif letter == 'J':
+                        if not mask & HASJ:
+                            jColumn[index] = float(value)
+                            mask = mask | HASJ
+                    elif not mask & HASF:
+                        fColumn[index] = float(value)
+                        mask = mask | HASF
+                        feed = fColumn[index]*scale
+
+                if motion is not None:
+                    command = motion
+
+                if scale == INCHES:
+                    mask = mask | ISINCHES
+
+                #a line moves the machine if it has an axis word and is not a command like G10 or G92
+                #which uses axis words for something else
+                if mask & AXISWORDS and (motion is not None or not otherGcode):
+                    mask = mask | ISMOVE
+                    if relative:
+                        if x is not None: posX = posX + x*scale
+                        if y is not None: posY = posY + y*scale
+                        if z is not None: posZ = posZ + z*scale
+                    else:
+                        if x is not None: posX = x*scale
+                        if y is not None: posY = y*scale
+                        if z is not None: posZ = z*scale
+
+                commandColumn[index] = command
+                maskColumn[index]    = mask
+                posXColumn[index]    = posX
+                posYColumn[index]    = posY
+                posZColumn[index]    = posZ
+
+        self._modalState = (command, scale, relative, feed, posX, posY, posZ)
+        self.parsedLines = end
+
+    def positionAt(self, index):
+        '''
+
+        Returns the (x, y, z) position in mm after line index has run.
+
+        '''
+        return (self.posX[index], self.posY[index], self.posZ[index])
+
+    def modalStateAt(self, index):
+        '''
+
+        Returns the ModalState of the machine before line index runs, found by parsing again the lines
+        from the checkpoint before it.
+
+        '''
+        index = min(max(index, 0), self.parsedLines)
+
+        checkpoint = min(index // CHECKPOINTLINES, len(self.checkpoints) - 1)
+        if checkpoint >= 0:
+            start = checkpoint*CHECKPOINTLINES
+            state = self.checkpoints[checkpoint]
+        else:
+            start = 0
+            state = (RAPID, MILLIMETERS, False, 0.0, 0.0, 0.0, 0.0)
+
+        #a program made from just the lines since the checkpoint, starting in the saved state
+        replay = GcodeProgram(self.lines[start:index], self.shift, parse = False)
+        replay._modalState = state
+        replay.parseLines(index - start)
+
+        command, scale, relative, feed, posX, posY, posZ = replay._modalState
+        return ModalState(command, "INCHES" if scale == INCHES else "MM", relative, feed, posX, posY, posZ)
+
+    def startPositionOf(self, index):
+        '''
+
+        Returns the (x, y, z) position in mm before line index runs.
+
+        '''
+        if index <= 0:
+            return (0.0, 0.0, 0.0)
+        return self.positionAt(index - 1)
+
+    def arcCenterOf(self, index):
+        '''
+
+        Returns the (x, y) center in mm of the arc on line index.
+
+        '''
+        scale = INCHES if self.mask[index] & ISINCHES else MILLIMETERS
+        startX, startY, startZ = self.startPositionOf(index)
+        return (startX + self.i[index]*scale, startY + self.j[index]*scale)
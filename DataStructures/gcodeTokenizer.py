@@ -0,0 +1,106 @@
+'''
+
+This module turns the raw text of a gcode file into the list of normalized lines which is
+stored in data.gcode and streamed to the machine.
+
+The output matches the original chain of re.sub and str.replace calls in GcodeCanvas.reloadGcode
+exactly, but the whole file is processed as one buffer so no intermediate copies of the line list
+are created.
+
+'''
+
+import re
+
+#Matches a mach3 style (...) comment or a standard ; initiated comment starting at the current
+#position. A ; comment is removed together with the newline which ends it. Parenthesized comments
+#inside a ; comment are skipped over so that the result is the same as removing all (...) comments
+#first, and an open parenthesis which is never closed is treated as plain text.
+COMMENTPATTERN = re.compile(r'\([^)]*\)|;(?:[^\n(]|\([^)]*\)|\((?![^)]*\)))*\n')
+
+#Matches the whitespace at the start of a line
+LEADINGWHITESPACE = re.compile(r'\n[ \t\r\f\v]+')
+
+#Words which should not have a space between the letter and the value
+WORDLETTERS = ['X', 'Y', 'Z', 'I', 'J', 'F']
+
+def commentSpans(text):
+    '''
+
+    Yields the (start, end) position of each comment in text, in order.
+
+    Rather than letting the regular expression engine try to match at every character, str.find
+    is used to jump directly to the next '(' or ';' which is much faster on large files where most
+    lines have no comment. text can be a string or a memory mapped file.
+
+    '''
+    nextParenthesis = text.find('(')
+    nextSemicolon   = text.find(';')
+
+    while nextParenthesis != -1 or nextSemicolon != -1:
+        if nextSemicolon == -1 or (nextParenthesis != -1 and nextParenthesis < nextSemicolon):
+            position = nextParenthesis
+        else:
+            position = nextSemicolon
+
+        comment = COMMENTPATTERN.match(text, position)
+        if comment:
+            resume = comment.end()
+            yield position, resume
+        else:
+            resume = position + 1
+
+        if nextParenthesis != -1 and nextParenthesis < resume:
+            nextParenthesis = text.find('(', resume)
+        if nextSemicolon != -1 and nextSemicolon < resume:
+            nextSemicolon = text.find(';', resume)
+
+def stripComments(text):
+    '''
+
+    Removes all comments from the text of a gcode file.
+
+    '''
+    pieces = []
+    start  = 0
+    for commentStart, commentEnd in commentSpans(text):
+        pieces.append(text[start:commentStart])
+        start = commentEnd
+
+    if start == 0:
+        return text
+
+    pieces.append(text[start:])
+    return ''.join(pieces)
+
+def normalizeGcode(rawText):
+    '''
+
+    Takes the text of a gcode file and returns it as a list of lines with comments removed, leading
+    whitespace removed, a single trailing space added to every line which is not empty, and no space
+    between an X, Y, Z, I, J or F word and its value.
+
+    '''
+    text = stripComments(rawText)
+
+    #add the trailing space to every line, then strip the leading whitespace. A line which is only
+    #whitespace is stripped down to nothing, trailing space included.
+    text = '\n' + text.replace('\n', ' \n') + ' '
+    text = LEADINGWHITESPACE.sub('\n', text)[1:]
+
+    for letter in WORDLETTERS:
+        text = text.replace(letter + ' ', letter)
+
+    return text.split('\n')
+
+def readGcodeFile(filename):
+    '''
+
+    Reads a gcode file from the hard drive and returns its normalized lines.
+
+    '''
+    gcodeFile = open(filename, 'r')
+    try:
+        rawText = gcodeFile.read()
+    finally:
+        gcodeFile.close()
+    return normalizeGcode(rawText)
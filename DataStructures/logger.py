@@ -10,7 +10,8 @@ from DataStructures.makesmithInitFuncs       import MakesmithInitFuncs
 
 class Logger(MakesmithInitFuncs):
     
-    errorValues = []
+    errorSum    = 0.0
+    errorCount  = 0
     recordingPositionalErrors = False 
     
     def writeToLog(self, message):
@@ -28,7 +29,8 @@ class Logger(MakesmithInitFuncs):
         
         '''
         if self.recordingPositionalErrors:
-            self.errorValues.append(error)
+            self.errorSum   = self.errorSum + error
+            self.errorCount = self.errorCount + 1
         
         #if we've gotten to the end of the file
         if self.data.gcodeIndex == len(self.data.gcode) and self.recordingPositionalErrors:
@@ -42,7 +44,8 @@ class Logger(MakesmithInitFuncs):
         
         '''
         self.recordingPositionalErrors = True
-        self.errorValues = []
+        self.errorSum   = 0.0
+        self.errorCount = 0
     
     def endRecordingAvgError(self):
         '''
@@ -60,7 +63,7 @@ class Logger(MakesmithInitFuncs):
         
         '''
         
-        avg = sum(self.errorValues)/len(self.errorValues)
+        avg = self.errorSum/max(self.errorCount, 1)
         self.data.message_queue.put("Message: The average feedback system error was: " + "%.2f" % avg + "mm")
         
         
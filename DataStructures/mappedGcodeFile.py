@@ -0,0 +1,189 @@
+'''
+
+This module provides MappedGcodeFile which gives access to the normalized lines of a gcode file
+without reading the whole file into memory.
+
+The file is memory mapped and indexed once by recording where each line starts in an array of
+unsigned 64 bit integers.
+A line is only sliced out of the file and normalized when it is accessed, so a very large program
+costs eight bytes per line for the index instead of a Python string per line. The lines are exactly
+the ones readGcodeFile would return.
+
+The index is only right for the file as it was when it was mapped, and reading a map of a file which
+has since been cut short crashes the program, so hasChanged should be checked before the lines are
+used after a while, and close called once they are no longer needed.
+
+'''
+
+from DataStructures.gcodeTokenizer           import commentSpans, normalizeGcode, readGcodeFile, WORDLETTERS
+from array                                   import array
+
+import mmap
+import os
+
+#The array typecode for the line offsets. Python 2 has no 'Q', so use 'L' where it is 64 bits and
+#otherwise 'd', which holds every offset up to 2**53 exactly.
+try:
+    OFFSETTYPE = 'Q'
+    array(OFFSETTYPE)
+except ValueError:
+    OFFSETTYPE = 'L' if array('L').itemsize >= 8 else 'd'
+
+#Files at least this large in bytes are memory mapped by openGcodeFile, smaller files are read into a list
+MAPPEDFILESIZE = 32*1024*1024
+
+class MappedGcodeFile(object):
+    '''
+
+    A read only list of the normalized lines of a gcode file. len(gcodeFile) is the number of lines
+    and gcodeFile[i] is the text of line i.
+
+    '''
+
+    def __init__(self, filename, offsets = None):
+        '''
+
+        Maps filename and indexes its lines. offsets can be the index saved from an earlier
+        MappedGcodeFile of the same file, in which case the file is not indexed again.
+
+        '''
+        self.filename = filename
+
+        self.file  = open(filename, 'rb')
+        status     = os.fstat(self.file.fileno())
+        self.size  = status.st_size
+        self.mtime = status.st_mtime
+        if self.size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            #an empty file can not be mapped, but an empty string can be searched and sliced the same way
+            self.map = ''
+
+        if offsets is not None:
+            self.offsets = offsets
+        else:
+            self._indexLines()
+
+    def _indexLines(self):
+        '''
+
+        Builds self.offsets, the position in the file where each line starts.
+
+        Lines end at each newline character which is not part of a comment. Comments are removed
+        together with any newlines inside them, which joins the lines on either side just as
+        normalizeGcode does.
+
+        '''
+        self.offsets = array(OFFSETTYPE, [0])
+
+        position = 0
+        for commentStart, commentEnd in commentSpans(self.map):
+            self._indexNewlines(position, commentStart)
+            position = commentEnd
+        self._indexNewlines(position, self.size)
+
+    def _indexNewlines(self, start, end):
+        '''
+
+        Adds the start of a line after each newline between start and end to self.offsets.
+
+        '''
+        find    = self.map.find
+        append  = self.offsets.append
+
+        newline = find('\n', start, end)
+        while newline != -1:
+            append(newline + 1)
+            newline = find('\n', newline + 1, end)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        '''
+
+        Returns the normalized text of a line, or a list of lines for a slice. Reading many lines with
+        a slice is much faster than reading them one at a time.
+
+        '''
+        count = len(self.offsets)
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(count)
+            if step != 1:
+                return [self[number] for number in xrange(start, stop, step)]
+            if start >= stop:
+                return []
+            text = self.map[int(self.offsets[start]):self._lineEnd(stop - 1)]
+            return normalizeGcode(text)[:stop - start]
+
+        if index < 0:
+            index = index + count
+        if index < 0 or index >= count:
+            raise IndexError("line index out of range")
+
+        text = self.map[int(self.offsets[index]):self._lineEnd(index)]
+
+        if '(' in text or ';' in text:
+            #the line is normalized together with the newline which ends it so that a ; comment at the
+            #end of the line is recognized
+            return normalizeGcode(text)[0]
+
+        #without comments normalizing a line is the same as stripping it and adding a trailing space
+        line = text.rstrip('\n').lstrip(' \t\r\f\v')
+        if not line:
+            return ''
+        line = line + ' '
+        for letter in WORDLETTERS:
+            line = line.replace(letter + ' ', letter)
+        return line
+
+    def _lineEnd(self, index):
+        '''
+
+        Returns the position in the file just after the newline which ends a line.
+
+        '''
+        if index + 1 < len(self.offsets):
+            return int(self.offsets[index + 1])
+        return self.size
+
+    def __iter__(self):
+        for index in xrange(len(self.offsets)):
+            yield self[index]
+
+    def hasChanged(self):
+        '''
+
+        Returns True if the file on disk is no longer the one which was mapped and indexed, because
+        its size or modification time are different or it is gone.
+
+        '''
+        try:
+            status = os.stat(self.filename)
+        except OSError:
+            return True
+        return status.st_size != self.size or status.st_mtime != self.mtime
+
+    def close(self):
+        '''
+
+        Releases the memory map and the file. Does nothing if they have already been released.
+
+        '''
+        if self.file.closed:
+            return
+        if self.size > 0:
+            self.map.close()
+        self.file.close()
+
+def openGcodeFile(filename):
+    '''
+
+    Returns the normalized lines of a gcode file. Large files are memory mapped and read a line at
+    a time, small ones are read into a list all at once which is faster.
+
+    '''
+    if os.path.getsize(filename) >= MAPPEDFILESIZE:
+        return MappedGcodeFile(filename)
+    return readGcodeFile(filename)
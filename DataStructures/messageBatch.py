@@ -0,0 +1,67 @@
+'''
+
+This module provides collectMessages which empties the messages waiting in message_queue into a
+MessageBatch so the user interface can act on all of them at once.
+
+The firmware sends position and error reports many times a second, which the serial port thread
+turns into PositionReport and PositionErrorReport records. Only the newest position can be seen on
+screen, so a batch keeps only the newest PositionReport. Error reports are all kept
+because the logger averages them, but only the newest is shown. Lines for the console are joined so
+they can be added to the console in one step.
+
+A batch ends early at a Message: from the firmware so that the popup for it is opened before anything
+which came after it is handled. At most maxMessages are taken from the queue in one batch so that a
+long backlog is spread over several frames instead of stalling one.
+
+'''
+
+from DataStructures.statusReports            import PositionReport, PositionErrorReport
+
+import Queue
+
+MAXMESSAGES = 500   #the most messages taken from the queue in one batch
+
+class MessageBatch(object):
+
+    def __init__(self):
+        self.messages      = []     #every message in the batch in the order it arrived
+        self.position      = None   #the newest PositionReport
+        self.errors        = []     #every PositionErrorReport
+        self.consoleText   = ""     #the lines for the console joined together
+        self.notification  = None   #a Message: from the firmware, which always ends the batch
+
+    def __len__(self):
+        return len(self.messages)
+
+def collectMessages(queue, maxMessages = MAXMESSAGES):
+    '''
+
+    Takes up to maxMessages messages from queue without blocking and returns them as a MessageBatch.
+
+    '''
+    batch        = MessageBatch()
+    consoleLines = []
+
+    while len(batch.messages) < maxMessages:
+        try:
+            message = queue.get_nowait()
+        except Queue.Empty:
+            break
+
+        batch.messages.append(message)
+
+        if isinstance(message, PositionReport):
+            batch.position = message
+        elif isinstance(message, PositionErrorReport):
+            batch.errors.append(message)
+        elif message[0:1] in ("<", "["):
+            #other reports from the firmware are not shown
+            pass
+        elif message[0:8] == "Message:":
+            batch.notification = message
+            break
+        else:
+            consoleLines.append(message)
+
+    batch.consoleText = "".join(consoleLines)
+    return batch
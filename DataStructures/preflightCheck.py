@@ -0,0 +1,221 @@
+'''
+
+This module provides the preflight check which finds the moves of a gcode program the machine can not
+make before the program is run.
+
+Every move is checked along its whole path, not only at its end: straight moves are split into
+points SAMPLESPACING apart and arcs are followed around their center. The chain lengths, tensions
+and sled angle at all of the points are computed at once with the vectorized Kinematics, a chunk of
+at most CHECKCHUNKPOINTS points at a time. A move is unreachable if the chains can not hold the sled
+at any of its points, which includes points where no balanced angle of the sled can be found, and
+has low tension if either chain would pull with less than minimumTension times the weight of the
+sled somewhere along it, where the sled is likely to drift from the path.
+
+PreflightCheck runs the check in a background thread and passes the result back through its queue
+as ("done", report) or ("error", message), in the same way as GcodeLoader.
+
+'''
+
+from DataStructures.gcodeProgram             import ISMOVE, HASX, HASY, ISINCHES, CLOCKWISEARC, COUNTERCLOCKARC, INCHES, MILLIMETERS
+
+import numpy
+import Queue
+import threading
+
+MINIMUMTENSION   = .15       #the least tension in multiples of the sled's weight which is not low
+SAMPLESPACING    = 10.0      #the longest distance in mm between the points checked along a move
+CHECKCHUNKPOINTS = 1 << 20   #the most points passed to the kinematics at once
+
+class PreflightReport(object):
+
+    def __init__(self, program):
+        self.program            = program
+        self.checkedMoves       = 0
+        self.checkedPoints      = 0
+        self.unreachable        = numpy.zeros(0, dtype = numpy.int64)  #the indices of the unreachable moves
+        self.lowTension         = numpy.zeros(0, dtype = numpy.int64)  #the indices of the reachable moves with low tension
+        self.minimumTension     = numpy.nan
+        self.largestAngle       = 0.0                                  #the largest tilt of the sled in degrees
+        self.unreachablePoints  = numpy.zeros(0, dtype = numpy.float32)  #x, y pairs of the start and end of each flagged move
+        self.lowTensionPoints   = numpy.zeros(0, dtype = numpy.float32)
+
+    def hasProblems(self):
+        return len(self.unreachable) > 0
+
+    def summary(self):
+        '''
+
+        Returns a description of the problems found for the user.
+
+        '''
+        if not len(self.unreachable) and not len(self.lowTension):
+            return "Every move can be reached."
+
+        text = ""
+        if len(self.unreachable):
+            text = text + "%d moves can not be reached, the first on line %d. " % (len(self.unreachable), self.unreachable[0] + 1)
+        if len(self.lowTension):
+            text = text + "%d moves have low chain tension, the first on line %d." % (len(self.lowTension), self.lowTension[0] + 1)
+        return text.strip()
+
+def _segmentPoints(startX, startY, endX, endY, moves):
+    '''
+
+    Returns the x, y pairs of the start and end of each of moves in one array for drawing as lines.
+
+    '''
+    points = numpy.empty(4*len(moves), dtype = numpy.float32)
+    points[0::4] = startX[moves]
+    points[1::4] = startY[moves]
+    points[2::4] = endX[moves]
+    points[3::4] = endY[moves]
+    return points
+
+def _arcs(program, count, startX, startY, posX, posY, moves):
+    '''
+
+    Returns for each of moves True if it is an arc, with the center, start angle and signed sweep of
+    the arcs, found in the same way as GcodeProgram.arcCenterOf and arcSweep.
+
+    '''
+    command = numpy.frombuffer(program.command, dtype = numpy.uint8, count = count)[moves]
+    isArc   = (command == CLOCKWISEARC) | (command == COUNTERCLOCKARC)
+
+    mask  = numpy.frombuffer(program.mask, dtype = numpy.uint8, count = count)[moves]
+    scale = numpy.where(mask & ISINCHES != 0, INCHES, MILLIMETERS)
+    centerX = startX[moves] + numpy.frombuffer(program.i, dtype = numpy.float64, count = count)[moves]*scale
+    centerY = startY[moves] + numpy.frombuffer(program.j, dtype = numpy.float64, count = count)[moves]*scale
+
+    startAngle = numpy.arctan2(startY[moves] - centerY, startX[moves] - centerX)
+    endAngle   = numpy.arctan2(posY[moves] - centerY, posX[moves] - centerX)
+    clockwise  = command == CLOCKWISEARC
+
+    sweep = numpy.where(clockwise, startAngle - endAngle, endAngle - startAngle) % (2*numpy.pi)
+    sweep = numpy.where(sweep == 0, 2*numpy.pi, sweep)
+    sweep = numpy.where(clockwise, -sweep, sweep)
+
+    return isArc, centerX, centerY, startAngle, sweep
+
+def _samples(startX, startY, endX, endY, isArc, centerX, centerY, startAngle, sweep, counts):
+    '''
+
+    Returns the x and y of counts[n] points spread evenly along each move n, the last of which is its
+    end, together with the position of each point in the list of moves.
+
+    '''
+    owner    = numpy.repeat(numpy.arange(len(counts)), counts)
+    firsts   = numpy.cumsum(counts) - counts
+    fraction = (numpy.arange(len(owner)) - firsts[owner] + 1.0)/counts[owner]
+
+    x = startX[owner] + (endX[owner] - startX[owner])*fraction
+    y = startY[owner] + (endY[owner] - startY[owner])*fraction
+
+    onArc = numpy.flatnonzero(isArc[owner])
+    if len(onArc):
+        arc    = owner[onArc]
+        radius = numpy.hypot(startX[arc] - centerX[arc], startY[arc] - centerY[arc])
+        angle  = startAngle[arc] + sweep[arc]*fraction[onArc]
+        x[onArc] = centerX[arc] + radius*numpy.cos(angle)
+        y[onArc] = centerY[arc] + radius*numpy.sin(angle)
+
+    return x, y, owner
+
+def checkProgram(program, kinematics, minimumTension = MINIMUMTENSION, sampleSpacing = SAMPLESPACING):
+    '''
+
+    Checks every move in program at points no more than sampleSpacing apart and returns a
+    PreflightReport.
+
+    '''
+    report = PreflightReport(program)
+
+    count = program.parsedLines
+    if count == 0:
+        return report
+
+    posX = numpy.frombuffer(program.posX, dtype = numpy.float64, count = count)
+    posY = numpy.frombuffer(program.posY, dtype = numpy.float64, count = count)
+    mask = numpy.frombuffer(program.mask, dtype = numpy.uint8, count = count)
+
+    #only lines which move in x or y can change the chains
+    moves = numpy.flatnonzero((mask & ISMOVE != 0) & (mask & (HASX | HASY) != 0))
+    report.checkedMoves = len(moves)
+    if not len(moves):
+        return report
+
+    #each move starts where the line before it ended
+    startX = numpy.concatenate(([0.0], posX[:-1]))
+    startY = numpy.concatenate(([0.0], posY[:-1]))
+
+    isArc, centerX, centerY, startAngle, sweep = _arcs(program, count, startX, startY, posX, posY, moves)
+
+    #the number of points checked along each move
+    length = numpy.hypot(posX[moves] - startX[moves], posY[moves] - startY[moves])
+    arcLength = numpy.abs(sweep)*numpy.hypot(startX[moves] - centerX, startY[moves] - centerY)
+    length = numpy.where(isArc, arcLength, length)
+    counts = numpy.maximum(1, numpy.ceil(length/sampleSpacing)).astype(numpy.int64)
+    report.checkedPoints = int(counts.sum())
+
+    unreachable = numpy.zeros(len(moves), dtype = bool)
+    tension     = numpy.empty(len(moves))
+    angle       = numpy.zeros(len(moves))
+
+    #split the moves into chunks of about CHECKCHUNKPOINTS points so a long program does not need
+    #all of its points in memory at once
+    ends  = numpy.searchsorted(numpy.cumsum(counts), numpy.arange(CHECKCHUNKPOINTS, report.checkedPoints, CHECKCHUNKPOINTS))
+    first = 0
+    for last in list(numpy.maximum(ends, 1)) + [len(moves)]:
+        if last <= first:
+            continue
+        chunk = slice(first, last)
+        chunkMoves = moves[chunk]
+        x, y, owner = _samples(startX[chunkMoves], startY[chunkMoves], posX[chunkMoves], posY[chunkMoves], isArc[chunk],
+                               centerX[chunk], centerY[chunk], startAngle[chunk], sweep[chunk], counts[chunk])
+        state = kinematics.sledState(x, y)
+
+        #the worst point of each move, unreachable points count as no tension
+        firsts   = numpy.cumsum(counts[chunk]) - counts[chunk]
+        failed   = numpy.isnan(state.leftLength)
+        pointTension = numpy.where(failed, -numpy.inf, numpy.minimum(state.leftTension, state.rightTension))
+        pointAngle   = numpy.where(failed, 0.0, numpy.abs(state.angle))
+        unreachable[chunk] = numpy.logical_or.reduceat(failed, firsts)
+        tension[chunk]     = numpy.minimum.reduceat(pointTension, firsts)
+        angle[chunk]       = numpy.maximum.reduceat(pointAngle, firsts)
+        first = last
+
+    lowTension = ~unreachable & (tension < minimumTension)
+
+    report.unreachable = moves[unreachable]
+    report.lowTension  = moves[lowTension]
+    if not numpy.all(unreachable):
+        report.minimumTension = float(tension[~unreachable].min())
+        report.largestAngle   = float(numpy.degrees(angle[~unreachable].max()))
+
+    report.unreachablePoints = _segmentPoints(startX, startY, posX, posY, report.unreachable)
+    report.lowTensionPoints  = _segmentPoints(startX, startY, posX, posY, report.lowTension)
+
+    return report
+
+class PreflightCheck(object):
+
+    def __init__(self, program, kinematics, minimumTension = MINIMUMTENSION):
+        self.program        = program
+        self.kinematics     = kinematics
+        self.minimumTension = minimumTension
+        self.queue          = Queue.Queue()
+
+    def start(self):
+        '''
+
+        Starts the check in a new thread.
+
+        '''
+        thread = threading.Thread(target = self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        try:
+            self.queue.put(("done", checkProgram(self.program, self.kinematics, self.minimumTension)))
+        except Exception as e:
+            self.queue.put(("error", str(e)))
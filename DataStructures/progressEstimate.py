@@ -0,0 +1,138 @@
+'''
+
+This module provides ProgressEstimate which holds the length of the path and the time to cut it up to
+every line of a gcode program, so that how far through a file the machine is and how long is left can
+be looked up for any line without reading the program again.
+
+The length of a line is the distance from where the line before it ended to where it ends, measured
+along the arc for G02 and G03 moves. The time is the length divided by the feed rate of the line, which
+is the last F word before or on it, or rapidRate for G00 moves and for feed moves before any F word.
+Accelerating and slowing down are not included.
+
+The tables are built with NumPy from the parsed columns of the program, so building them takes a small
+part of the time it takes to parse the file, and every lookup is a single array read.
+
+'''
+
+from DataStructures.gcodeProgram             import RAPID, CLOCKWISEARC, COUNTERCLOCKARC, ISMOVE, ISINCHES, HASF, INCHES
+
+import math
+import numpy
+
+DEFAULTRAPIDRATE = 1000.0   #the speed of G00 moves in mm per minute if none is given
+
+class ProgressEstimate(object):
+
+    def __init__(self, program, rapidRate = DEFAULTRAPIDRATE):
+        self.program = program
+
+        count = program.parsedLines
+        def column(name, dtype):
+            return numpy.frombuffer(getattr(program, name), dtype = dtype, count = count)
+
+        command = column('command', numpy.uint8)
+        mask    = column('mask', numpy.uint8)
+        endX    = column('posX', numpy.float64)
+        endY    = column('posY', numpy.float64)
+        endZ    = column('posZ', numpy.float64)
+
+        #each line starts where the line before it ended
+        startX  = numpy.concatenate(([0.0], endX[:-1]))[:count]
+        startY  = numpy.concatenate(([0.0], endY[:-1]))[:count]
+        startZ  = numpy.concatenate(([0.0], endZ[:-1]))[:count]
+
+        scale   = numpy.where(mask & ISINCHES != 0, INCHES, 1.0)
+        moves   = mask & ISMOVE != 0
+
+        lengths = numpy.sqrt((endX - startX)**2 + (endY - startY)**2 + (endZ - startZ)**2)
+
+        arcs = numpy.flatnonzero(moves & ((command == CLOCKWISEARC) | (command == COUNTERCLOCKARC)))
+        if len(arcs):
+            lengths[arcs] = self._arcLengths(startX[arcs], startY[arcs], endX[arcs], endY[arcs], endZ[arcs] - startZ[arcs],
+                                             column('i', numpy.float64)[arcs]*scale[arcs], column('j', numpy.float64)[arcs]*scale[arcs],
+                                             command[arcs] == CLOCKWISEARC, lengths[arcs])
+        lengths[~moves] = 0.0
+
+        #the feed rate in mm per minute carries on from the last line with an F word
+        feedLines = numpy.where(mask & HASF != 0, numpy.arange(count), -1)
+        feedLines = numpy.maximum.accumulate(feedLines) if count else feedLines
+        feeds     = column('f', numpy.float64)*scale
+        feeds     = numpy.where(feedLines >= 0, feeds[numpy.maximum(feedLines, 0)], numpy.nan)
+
+        self.lengths      = lengths
+        self.feeds        = feeds
+        self.isRapid      = command == RAPID
+        self.lengthBefore = numpy.concatenate(([0.0], numpy.cumsum(lengths)))   #the length of the path before each line
+        self.totalLength  = float(self.lengthBefore[-1])
+
+        self.setRapidRate(rapidRate)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _arcLengths(self, startX, startY, endX, endY, rise, offsetX, offsetY, clockwise, straightLengths):
+        '''
+
+        Returns the length of each arc, including any rise in z along it. Arcs without a center are
+        measured in a straight line as the machine will move.
+
+        '''
+        centerX = startX + offsetX
+        centerY = startY + offsetY
+        radius  = numpy.hypot(offsetX, offsetY)
+
+        startAngle = numpy.arctan2(startY - centerY, startX - centerX)
+        endAngle   = numpy.arctan2(endY - centerY, endX - centerX)
+
+        #the same sweep as toolpathGeometry.arcSweep, where an arc which ends where it starts is a full circle
+        sweep = numpy.where(clockwise, startAngle - endAngle, endAngle - startAngle) % (2*math.pi)
+        sweep = numpy.where(sweep == 0, 2*math.pi, sweep)
+
+        return numpy.where(radius > 0, numpy.hypot(radius*sweep, rise), straightLengths)
+
+    def setRapidRate(self, rapidRate):
+        '''
+
+        Rebuilds the time table for G00 moves at rapidRate mm per minute.
+
+        '''
+        self.rapidRate = float(rapidRate)
+
+        rates = numpy.where(self.isRapid | ~(numpy.nan_to_num(self.feeds) > 0), self.rapidRate, self.feeds)
+        times = 60*self.lengths/rates
+
+        self.timeBefore = numpy.concatenate(([0.0], numpy.cumsum(times)))      #the time in seconds before each line
+        self.totalTime  = float(self.timeBefore[-1])
+
+    def _clampIndex(self, index):
+        return min(max(int(index), 0), len(self.lengths))
+
+    def fractionComplete(self, index):
+        '''
+
+        Returns the fraction of the time to cut the program taken by the lines before index.
+
+        '''
+        index = self._clampIndex(index)
+        if self.totalTime > 0:
+            return self.timeBefore[index]/self.totalTime
+        if len(self.lengths):
+            return float(index)/len(self.lengths)
+        return 0.0
+
+    def timeRemaining(self, index):
+        '''
+
+        Returns the time in seconds to cut the lines from index to the end of the program.
+
+        '''
+        return self.totalTime - self.timeBefore[self._clampIndex(index)]
+
+def formatDuration(seconds):
+    '''
+
+    Returns a number of seconds as hours:minutes:seconds.
+
+    '''
+    seconds = int(round(max(seconds, 0)))
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
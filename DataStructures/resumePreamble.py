@@ -0,0 +1,62 @@
+'''
+
+This module builds the commands which put the machine back in the state a gcode program expects
+before it starts running partway through.
+
+The modal state at the line is rebuilt by GcodeProgram.modalStateAt. The preamble lifts the bit to a
+safe height in absolute millimeters, moves over the point where the line before ended, lowers the bit
+back to its depth no faster than PLUNGERATE, and then sets the units, distance mode, motion mode and feed
+rate the program had at that line:
+
+    G21
+    G90
+    G00 Z<safeHeight>
+    G00 X<x> Y<y>
+    G01 Z<z> F<plungeRate>
+    G20                     if the program was in inches
+    G91                     if the program was in relative mode
+    G01 F<feed rate>        or G00 if the program was making rapid moves
+
+Machines without a z-axis skip the z moves. Arcs can not be started without a target, so a program
+which was making arcs is left in G01 and the line being resumed must name its own arc.
+
+'''
+
+from DataStructures.gcodeProgram             import RAPID, INCHES
+
+SAFEHEIGHT = 5.0        #the height in mm the bit is lifted to before moving to the resume point
+PLUNGERATE = 100.0      #the fastest feed rate in mm per minute the bit is lowered at
+
+def _number(value):
+    return ('%.4f' % value).rstrip('0').rstrip('.')
+
+def resumePreamble(state, zAxis = True, safeHeight = SAFEHEIGHT):
+    '''
+
+    Returns the lines to send before resuming a program in ModalState state.
+
+    '''
+    lines = ["G21", "G90"]
+
+    if zAxis:
+        lines.append("G00 Z" + _number(max(safeHeight, state.z)))
+    lines.append("G00 X" + _number(state.x) + " Y" + _number(state.y))
+    if zAxis:
+        plungeRate = min(state.feedRate, PLUNGERATE) if state.feedRate > 0 else PLUNGERATE
+        lines.append("G01 Z" + _number(state.z) + " F" + _number(plungeRate))
+
+    scale = 1.0
+    if state.units == "INCHES":
+        lines.append("G20")
+        scale = INCHES
+    if state.relative:
+        lines.append("G91")
+
+    if state.motion == RAPID:
+        lines.append("G00")
+    elif state.feedRate > 0:
+        lines.append("G01 F" + _number(state.feedRate/scale))
+    else:
+        lines.append("G01")
+
+    return lines
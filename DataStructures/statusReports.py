@@ -0,0 +1,43 @@
+'''
+
+This module turns the position and error reports sent by the firmware into small records so the
+serial port thread can parse them as they arrive and the user interface never has to.
+
+    <Idle,MPos:x,y,z,WPos:...>      becomes PositionReport(x, y, z)
+    [PosError:left,right]           becomes PositionErrorReport(left, right)
+
+'''
+
+from collections                             import namedtuple
+
+import re
+
+PositionReport      = namedtuple('PositionReport', ['x', 'y', 'z'])
+PositionErrorReport = namedtuple('PositionErrorReport', ['left', 'right'])
+
+#The three machine coordinates after MPos:, and the error values after PosError:. The firmware prints
+#nan when it can not resolve the kinematics, which float() reads.
+POSITIONPATTERN = re.compile(r'MPos:\s*([^,\s]+)\s*,\s*([^,\s]+)\s*,\s*([^,\s>]+)')
+ERRORPATTERN    = re.compile(r'\[PosError:\s*([^,\s\]]+)(?:\s*,\s*([^,\s\]]+))?')
+
+def parseStatusReport(message):
+    '''
+
+    Returns the PositionReport or PositionErrorReport sent as message, or None if message is not a
+    position or error report. Raises ValueError if it is one but can not be read.
+
+    '''
+    if message[0:1] == "<":
+        match = POSITIONPATTERN.search(message)
+        if match is None:
+            raise ValueError("malformed position report")
+        return PositionReport(float(match.group(1)), float(match.group(2)), float(match.group(3)))
+
+    if message[0:10] == "[PosError:":
+        match = ERRORPATTERN.match(message)
+        if match is None:
+            raise ValueError("malformed error report")
+        right = match.group(2)
+        return PositionErrorReport(float(match.group(1)), float(right) if right is not None else None)
+
+    return None
@@ -0,0 +1,209 @@
+'''
+
+This module provides TelemetryRecorder which saves every position and error report from the machine
+to a file, and TelemetryPlayer which plays a saved run back at the speed it was recorded.
+
+A telemetry file is MAGIC and the byte order of the computer which wrote it, followed by samples of
+SAMPLESIZE doubles each:
+
+    time            seconds since the epoch when the report arrived
+    kind            POSITIONSAMPLE, ERRORSAMPLE or LINKSAMPLE
+    gcodeIndex      the index of the next line of the program to be sent
+    lineInFlight    the index of the oldest line of the program the machine has not finished, or -1
+    a, b, c         x, y, z of a position, the left and right error and nan of an error, or the
+                    bytes sent and received since the port was opened and the baud rate of a link sample
+
+Link samples are recorded about once a second while reports arrive. linkUtilization turns them into the
+share of the serial line's capacity used in each direction.
+
+The recorder only appends the sample to an array on the message path and writes the array to the
+file once it holds flushSamples samples, so a run can be recorded for hours at little cost.
+
+'''
+
+from DataStructures.statusReports            import PositionReport, PositionErrorReport
+from array                                   import array
+
+import os
+import sys
+import time
+
+MAGIC          = 'GCTL0002'
+OLDMAGICS      = ('GCTL0001',)  #files without link samples, which can still be read
+HEADERSIZE     = len(MAGIC) + 1
+SAMPLESIZE     = 7
+FILEEXTENSION  = '.gctl'
+
+#Sample kinds
+POSITIONSAMPLE = 1
+ERRORSAMPLE    = 2
+LINKSAMPLE     = 3
+
+BITSPERBYTE    = 10             #a start bit, eight data bits and a stop bit
+
+NAN            = float('nan')
+
+class TelemetryRecorder(object):
+
+    flushSamples = 1024     #the number of samples held in memory before they are written to the file
+
+    def __init__(self, filename):
+        '''
+
+        Opens filename to add samples to, starting it if it does not exist yet.
+
+        '''
+        self.filename = filename
+        self.samples  = array('d')
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.file = open(filename, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC + sys.byteorder[0])
+
+    def record(self, report, gcodeIndex, lineInFlight, timestamp):
+        '''
+
+        Adds a PositionReport or PositionErrorReport to the recording.
+
+        '''
+        if isinstance(report, PositionReport):
+            self.samples.extend((timestamp, POSITIONSAMPLE, gcodeIndex, lineInFlight, report.x, report.y, report.z))
+        else:
+            right = report.right if report.right is not None else NAN
+            self.samples.extend((timestamp, ERRORSAMPLE, gcodeIndex, lineInFlight, report.left, right, NAN))
+
+        if len(self.samples) >= self.flushSamples*SAMPLESIZE:
+            self.flush()
+
+    def recordLink(self, bytesSent, bytesReceived, baudRate, gcodeIndex, lineInFlight, timestamp):
+        '''
+
+        Adds the number of bytes sent and received since the port was opened to the recording.
+
+        '''
+        self.samples.extend((timestamp, LINKSAMPLE, gcodeIndex, lineInFlight, bytesSent, bytesReceived, baudRate))
+
+        if len(self.samples) >= self.flushSamples*SAMPLESIZE:
+            self.flush()
+
+    def flush(self):
+        '''
+
+        Writes the samples held in memory to the file.
+
+        '''
+        self.samples.tofile(self.file)
+        self.file.flush()
+        del self.samples[:]
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def newTelemetryFilename(directory):
+    '''
+
+    Returns a name for a new telemetry file in directory made from the current date and time.
+
+    '''
+    return os.path.join(directory, time.strftime('telemetry-%Y%m%d-%H%M%S') + FILEEXTENSION)
+
+def readTelemetry(filename):
+    '''
+
+    Returns the samples saved in a telemetry file as one array of doubles, SAMPLESIZE per sample.
+    Raises ValueError if the file is not a telemetry file written on a computer of the same byte order.
+
+    '''
+    telemetryFile = open(filename, 'rb')
+    try:
+        header = telemetryFile.read(HEADERSIZE)
+        if header[:-1] not in (MAGIC,) + OLDMAGICS or header[-1:] != sys.byteorder[0]:
+            raise ValueError(filename + " is not a telemetry file from this computer")
+
+        samples = array('d')
+        sampleCount = (os.fstat(telemetryFile.fileno()).st_size - HEADERSIZE)//(SAMPLESIZE*samples.itemsize)
+        #a sample cut short when the program stopped is left out
+        samples.fromfile(telemetryFile, sampleCount*SAMPLESIZE)
+        return samples
+    finally:
+        telemetryFile.close()
+
+def linkUtilization(samples):
+    '''
+
+    Returns (time, sent, received) for each link sample after the first of a connection, where sent and
+    received are the fractions of the line's capacity used in each direction since the sample before.
+
+    '''
+    utilization = []
+    previous    = None
+    for offset in xrange(0, len(samples) - SAMPLESIZE + 1, SAMPLESIZE):
+        if samples[offset + 1] != LINKSAMPLE:
+            continue
+        timestamp, bytesSent, bytesReceived, baudRate = samples[offset], samples[offset + 4], samples[offset + 5], samples[offset + 6]
+        #the counts start again from zero when the port is opened again
+        if previous is not None and bytesSent >= previous[1] and bytesReceived >= previous[2] and timestamp > previous[0]:
+            capacity = baudRate*(timestamp - previous[0])/BITSPERBYTE
+            utilization.append((timestamp, (bytesSent - previous[1])/capacity, (bytesReceived - previous[2])/capacity))
+        previous = (timestamp, bytesSent, bytesReceived)
+    return utilization
+
+class TelemetryPlayer(object):
+    '''
+
+    Plays the samples of a telemetry file back as PositionReport and PositionErrorReport records with
+    the same spacing in time as they were recorded, sped up by speed.
+
+    '''
+
+    def __init__(self, filename, speed = 1.0):
+        self.samples   = readTelemetry(filename)
+        self.speed     = speed
+        self.next      = 0          #the index of the first sample not played yet
+        self.startTime = None
+
+    def __len__(self):
+        return len(self.samples)//SAMPLESIZE
+
+    def start(self, now):
+        self.next      = 0
+        self.startTime = now
+
+    def finished(self):
+        return self.next >= len(self)
+
+    def due(self, now):
+        '''
+
+        Returns a list of (report, gcodeIndex, lineInFlight) for the samples which should have been
+        played by now.
+
+        '''
+        due = []
+        if not len(self):
+            return due
+
+        recordedTime = self.samples[0] + (now - self.startTime)*self.speed
+        samples      = self.samples
+
+        while self.next < len(self):
+            offset = self.next*SAMPLESIZE
+            if samples[offset] > recordedTime:
+                break
+            if samples[offset + 1] == LINKSAMPLE:
+                self.next = self.next + 1
+                continue
+            if samples[offset + 1] == POSITIONSAMPLE:
+                report = PositionReport(samples[offset + 4], samples[offset + 5], samples[offset + 6])
+            else:
+                right  = samples[offset + 5]
+                report = PositionErrorReport(samples[offset + 4], None if right != right else right)
+            due.append((report, int(samples[offset + 2]), int(samples[offset + 3])))
+            self.next = self.next + 1
+
+        return due
@@ -0,0 +1,429 @@
+'''
+
+This module turns a parsed GcodeProgram into the vertex buffers used to draw it on the gcode canvas.
+
+Instead of one Kivy instruction per move, all of the moves of the same type are collected into one
+flat buffer of line segments. Each buffer is an array of x,y pairs where every two vertices form
+one segment, so the canvas can draw any number of moves with a handful of Mesh instructions.
+
+Simplified copies of the toolpath are built at the same time at several tolerances so that when the
+canvas is zoomed out a large file can be drawn with far fewer vertices. The cutting moves and the
+rapids are simplified, and z-axis markers are thinned out or left out where they would be too small
+to see.
+
+'''
+
+from DataStructures.gcodeProgram             import RAPID, CLOCKWISEARC, COUNTERCLOCKARC, ISMOVE
+from array                                   import array
+
+import math
+
+#Buffer names
+FEED    = 'feed'        #G01 moves
+RAPIDS  = 'rapid'       #G00 moves
+ARCS    = 'arc'         #G02 and G03 moves, broken into short straight segments
+RAISES  = 'raise'       #circles marking where the z-axis moves up
+PLUNGES = 'plunge'      #circles marking where the z-axis moves down
+
+BUFFERNAMES = [FEED, RAPIDS, ARCS, RAISES, PLUNGES]
+
+ARCTOLERANCE    = 0.05  #the furthest an arc segment may stray from the true arc in mm
+ZTOLERANCE      = 0.05  #the smallest z move which is marked on the canvas in mm
+MARKERSEGMENTS  = 12    #the number of sides used to draw the z-axis markers
+RAISERADIUS     = 1     #the radius of the marker drawn where the z-axis moves up in mm
+PLUNGERADIUS    = 2     #the radius of the marker drawn where the z-axis moves down in mm
+
+#The simplification tolerance in mm of each level of detail. Level 0 is the full toolpath.
+LEVELTOLERANCES = [0, 0.1, 0.4, 1.6, 6.4]
+SIMPLIFYERROR   = 2     #the furthest a simplified line may be from the original, in multiples of the tolerance
+MAXPIXELERROR   = 0.5   #the largest error in pixels allowed when choosing a level of detail
+MAXCHAINPOINTS  = 512   #the most points simplified together as one polyline
+MINMARKERPIXELS = 3     #the fewest pixels across a z-axis marker is drawn at in a simplified level
+
+def _markerOutline(radius, sides = MARKERSEGMENTS):
+    '''
+
+    Returns the vertices of a circle of the given radius around (0,0) with the given number of sides
+    as a list of segments.
+
+    '''
+    outline = []
+    for side in range(sides):
+        angleOne = 2*math.pi*side/sides
+        angleTwo = 2*math.pi*(side + 1)/sides
+        outline.extend((radius*math.cos(angleOne), radius*math.sin(angleOne), radius*math.cos(angleTwo), radius*math.sin(angleTwo)))
+    return outline
+
+RAISEOUTLINE  = _markerOutline(RAISERADIUS)
+PLUNGEOUTLINE = _markerOutline(PLUNGERADIUS)
+
+def arcSweep(startX, startY, endX, endY, centerX, centerY, clockwise):
+    '''
+
+    Returns the start angle and the signed angle in radians swept by an arc. An arc which ends where it
+    starts is a full circle.
+
+    '''
+    startAngle = math.atan2(startY - centerY, startX - centerX)
+    endAngle   = math.atan2(endY - centerY, endX - centerX)
+
+    if clockwise:
+        sweep = startAngle - endAngle
+    else:
+        sweep = endAngle - startAngle
+
+    sweep = sweep % (2*math.pi)
+    if sweep == 0:
+        sweep = 2*math.pi
+
+    if clockwise:
+        sweep = -sweep
+
+    return startAngle, sweep
+
+def arcSegmentCount(radius, sweep, tolerance = ARCTOLERANCE):
+    '''
+
+    Returns the number of straight segments needed to draw an arc within tolerance.
+
+    '''
+    if radius <= tolerance:
+        return 1
+    maxStep = 2*math.acos(1 - tolerance/radius)
+    return max(1, int(math.ceil(abs(sweep)/maxStep)))
+
+def simplifyPolyline(points, tolerance):
+    '''
+
+    Returns a simplified copy of a polyline given as a flat list of x,y values. No point of the
+    original line is further than SIMPLIFYERROR times tolerance from the simplified one.
+
+    Points closer than tolerance to the last kept point are dropped first, which is cheap and removes
+    most of the points of densely sampled paths, then the Douglas-Peucker algorithm is run on what is
+    left. Each pass can move the line by up to tolerance, so together they can move it by twice that.
+
+    '''
+    count = len(points)//2
+    if count <= 2:
+        return list(points)
+
+    squaredTolerance = tolerance*tolerance
+
+    #radial distance pass
+    xs = [points[0]]
+    ys = [points[1]]
+    lastX = points[0]
+    lastY = points[1]
+    for index in xrange(2, 2*count - 2, 2):
+        x = points[index]
+        y = points[index + 1]
+        if (x - lastX)*(x - lastX) + (y - lastY)*(y - lastY) > squaredTolerance:
+            xs.append(x)
+            ys.append(y)
+            lastX = x
+            lastY = y
+    xs.append(points[2*count - 2])
+    ys.append(points[2*count - 1])
+
+    #Douglas-Peucker pass
+    count = len(xs)
+    keep  = [False]*count
+    keep[0] = keep[count - 1] = True
+    stack = [(0, count - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        firstX = xs[first]
+        firstY = ys[first]
+        deltaX = xs[last] - firstX
+        deltaY = ys[last] - firstY
+        squaredLength = deltaX*deltaX + deltaY*deltaY
+
+        furthest = first
+        furthestDistance = squaredTolerance
+        for index in xrange(first + 1, last):
+            x = xs[index] - firstX
+            y = ys[index] - firstY
+            if squaredLength == 0:
+                distance = x*x + y*y
+            else:
+                #squared distance from the point to the segment
+                along = (x*deltaX + y*deltaY)/squaredLength
+                if along < 0:
+                    along = 0
+                elif along > 1:
+                    along = 1
+                x = x - along*deltaX
+                y = y - along*deltaY
+                distance = x*x + y*y
+            if distance > furthestDistance:
+                furthest = index
+                furthestDistance = distance
+
+        if furthest != first:
+            keep[furthest] = True
+            stack.append((first, furthest))
+            stack.append((furthest, last))
+
+    simplified = []
+    for index in xrange(count):
+        if keep[index]:
+            simplified.append(xs[index])
+            simplified.append(ys[index])
+    return simplified
+
+class ToolpathGeometry(object):
+    '''
+
+    The vertex buffers for a program. buffers maps each name in BUFFERNAMES to an array('f') of
+    x,y pairs where each pair of vertices is one segment. All positions are in mm.
+
+    levels holds a set of buffers for each tolerance in LEVELTOLERANCES. levels[0] is buffers itself.
+    In the other levels the connected runs of feed and arc moves are simplified to within
+    SIMPLIFYERROR times the tolerance and stored together in the FEED buffer, and the connected runs
+    of rapids which move in x or y are simplified in the same way into the RAPIDS buffer. A z-axis
+    marker is drawn with as few sides as the tolerance allows, and is left out if it would overlap
+    the last marker of the same kind drawn in the level. Markers of a kind are not drawn at all in
+    levels where they would be less than MINMARKERPIXELS pixels across, too small to tell from a dot,
+    taking a pixel as its size at the smallest scale the level is drawn at.
+
+    '''
+
+    def __init__(self):
+        self.buffers = {}
+        for name in BUFFERNAMES:
+            self.buffers[name] = array('f')
+
+        self.levels = [self.buffers]
+        for tolerance in LEVELTOLERANCES[1:]:
+            level = {}
+            for name in BUFFERNAMES:
+                level[name] = array('f')
+            self.levels.append(level)
+
+        #for each simplified level, the outline of each kind of marker and the distance within which
+        #another marker of the kind is left out, or None if they are too small to draw
+        self.markerOutlines = []
+        for tolerance in LEVELTOLERANCES[1:]:
+            pixel    = SIMPLIFYERROR*tolerance/MAXPIXELERROR
+            outlines = {}
+            for name, radius in ((RAISES, RAISERADIUS), (PLUNGES, PLUNGERADIUS)):
+                if 2*radius < MINMARKERPIXELS*pixel:
+                    outlines[name] = None
+                else:
+                    outlines[name] = (_markerOutline(radius, max(4, arcSegmentCount(radius, 2*math.pi, tolerance))), 2*radius)
+            self.markerOutlines.append(outlines)
+
+        #the connected runs of cutting moves and of rapids currently being followed, as flat lists of
+        #x,y values, and the last marker of each kind kept in each simplified level
+        self.chain       = []
+        self.rapidChain  = []
+        self.lastMarkers = [{} for tolerance in LEVELTOLERANCES[1:]]
+
+    def segmentCount(self, name = None, level = 0):
+        '''
+
+        Returns the number of segments in one buffer, or in all of them if no name is given.
+
+        '''
+        buffers = self.levels[level]
+        if name is not None:
+            return len(buffers[name])//4
+        return sum(len(buffer) for buffer in buffers.values())//4
+
+    def levelForScale(self, scale):
+        '''
+
+        Returns the coarsest level which is still accurate to within MAXPIXELERROR pixels when the
+        canvas is drawn at scale pixels per mm.
+
+        '''
+        allowedError = MAXPIXELERROR/scale
+        level = 0
+        for number, tolerance in enumerate(LEVELTOLERANCES):
+            if SIMPLIFYERROR*tolerance <= allowedError:
+                level = number
+        return level
+
+    def addLines(self, program, start = 0, end = None):
+        '''
+
+        Adds the moves on lines start up to end of program to the buffers.
+
+        '''
+        if end is None:
+            end = len(program)
+
+        feed      = self.buffers[FEED]
+        rapids    = self.buffers[RAPIDS]
+        arcs      = self.buffers[ARCS]
+        raises    = self.buffers[RAISES]
+        plunges   = self.buffers[PLUNGES]
+
+        command   = program.command
+        mask      = program.mask
+        posX      = program.posX
+        posY      = program.posY
+        posZ      = program.posZ
+
+        if start > 0:
+            x, y, z = program.positionAt(start - 1)
+        else:
+            x = y = z = 0.0
+
+        chain      = self.chain
+        rapidChain = self.rapidChain
+
+        for index in xrange(start, end):
+            if not mask[index] & ISMOVE:
+                continue
+
+            targetX = posX[index]
+            targetY = posY[index]
+            targetZ = posZ[index]
+            move    = command[index]
+
+            if move == RAPID:
+                rapids.extend((x, y, targetX, targetY))
+                if targetX != x or targetY != y:
+                    self._addChain(chain, FEED)
+                    chain = []
+                    if not rapidChain:
+                        rapidChain = [x, y]
+                    rapidChain.append(targetX)
+                    rapidChain.append(targetY)
+                    if len(rapidChain) >= 2*MAXCHAINPOINTS:
+                        self._addChain(rapidChain, RAPIDS)
+                        rapidChain = rapidChain[-2:]
+            else:
+                isArc = move == CLOCKWISEARC or move == COUNTERCLOCKARC
+                if rapidChain and (isArc or targetX != x or targetY != y):
+                    self._addChain(rapidChain, RAPIDS)
+                    rapidChain = []
+                if not chain:
+                    chain = [x, y]
+                if isArc:
+                    centerX, centerY = program.arcCenterOf(index)
+                    self._addArc(arcs, chain, x, y, targetX, targetY, centerX, centerY, move == CLOCKWISEARC)
+                else:
+                    feed.extend((x, y, targetX, targetY))
+                    if targetX != x or targetY != y:
+                        chain.append(targetX)
+                        chain.append(targetY)
+                if len(chain) >= 2*MAXCHAINPOINTS:
+                    self._addChain(chain, FEED)
+                    chain = chain[-2:]
+
+            if targetZ - z >= ZTOLERANCE:
+                self._addMarker(raises, RAISEOUTLINE, x, y)
+                self._addLevelMarkers(RAISES, x, y)
+            elif z - targetZ >= ZTOLERANCE:
+                self._addMarker(plunges, PLUNGEOUTLINE, x, y)
+                self._addLevelMarkers(PLUNGES, x, y)
+
+            x = targetX
+            y = targetY
+            z = targetZ
+
+        self.chain      = chain
+        self.rapidChain = rapidChain
+
+    def finish(self):
+        '''
+
+        Adds the last runs of cutting moves and rapids to the simplified levels. Call once all of the
+        lines have been added.
+
+        '''
+        self._addChain(self.chain, FEED)
+        self._addChain(self.rapidChain, RAPIDS)
+        self.chain      = []
+        self.rapidChain = []
+
+    def _addChain(self, chain, name):
+        '''
+
+        Simplifies a connected run of moves for each level and adds it to the named buffer of each
+        level. Every level is simplified from the original run, so the error of one level is not
+        added to the error of the next.
+
+        Runs are passed in pieces of at most MAXCHAINPOINTS points. Douglas-Peucker can take time
+        proportional to the square of the number of points on paths which retrace themselves, as
+        repeated depth passes do, and short pieces keep that bounded.
+
+        '''
+        if len(chain) < 4:
+            return
+
+        for level, tolerance in zip(self.levels[1:], LEVELTOLERANCES[1:]):
+            points = simplifyPolyline(chain, tolerance)
+            buffer = level[name]
+            for index in xrange(0, len(points) - 2, 2):
+                buffer.extend(points[index:index + 4])
+
+    def _addArc(self, buffer, chain, startX, startY, endX, endY, centerX, centerY, clockwise):
+        '''
+
+        Adds an arc to buffer as a series of straight segments, and its points to chain.
+
+        '''
+        radius = math.sqrt((startX - centerX)**2 + (startY - centerY)**2)
+        startAngle, sweep = arcSweep(startX, startY, endX, endY, centerX, centerY, clockwise)
+
+        segments = arcSegmentCount(radius, sweep)
+        step = sweep/segments
+
+        previousX = startX
+        previousY = startY
+        for segment in xrange(1, segments):
+            angle = startAngle + step*segment
+            nextX = centerX + radius*math.cos(angle)
+            nextY = centerY + radius*math.sin(angle)
+            buffer.extend((previousX, previousY, nextX, nextY))
+            chain.append(nextX)
+            chain.append(nextY)
+            previousX = nextX
+            previousY = nextY
+        buffer.extend((previousX, previousY, endX, endY))
+        chain.append(endX)
+        chain.append(endY)
+
+    def _addLevelMarkers(self, name, x, y):
+        '''
+
+        Adds a z-axis marker of the named kind centered on x,y to each simplified level which draws
+        it and where it would not overlap the last marker of that kind.
+
+        '''
+        for level, outlines, lastMarkers in zip(self.levels[1:], self.markerOutlines, self.lastMarkers):
+            if outlines[name] is None:
+                #the levels after this one are coarser still
+                return
+            outline, spacing = outlines[name]
+            last = lastMarkers.get(name)
+            if last is not None and (x - last[0])**2 + (y - last[1])**2 < spacing*spacing:
+                continue
+            lastMarkers[name] = (x, y)
+            self._addMarker(level[name], outline, x, y)
+
+    def _addMarker(self, buffer, outline, x, y):
+        '''
+
+        Adds a z-axis marker centered on x,y to buffer.
+
+        '''
+        buffer.extend([value + (x if number % 2 == 0 else y) for number, value in enumerate(outline)])
+
+def buildToolpathGeometry(program):
+    '''
+
+    Returns the ToolpathGeometry for a whole program.
+
+    '''
+    geometry = ToolpathGeometry()
+    geometry.addLines(program)
+    geometry.finish()
+    return geometry
@@ -0,0 +1,102 @@
+'''
+
+This module provides TransmitBuffer which holds the lines of the program being sent to the machine
+already encoded, so that the serial port thread can write them without building a string per line.
+
+The lines are encoded a block of TRANSMITBLOCKLINES at a time into one bytearray, with an array of the
+offset in the bytearray where each line starts. Every line ends with the line ending the firmware
+expects. A run of lines is written by slicing a memoryview of the bytearray, so several lines can be
+sent with a single write and nothing is copied on the way to the port. Only one block is held at a
+time so that a memory mapped program is never read into memory as a whole.
+
+'''
+
+from DataStructures.gcodeProgram             import shiftLine
+from array                                   import array
+
+#The number of lines encoded at a time
+TRANSMITBLOCKLINES = 4096
+
+class TransmitBuffer(object):
+
+    def __init__(self, program, lineEnding, blockLines = TRANSMITBLOCKLINES):
+        '''
+
+        program is the GcodeProgram to send and lineEnding the text added to the end of every line.
+
+        '''
+        self.program    = program
+        self.lineEnding = lineEnding
+        self.blockLines = blockLines
+
+        #the lines from start up to end are encoded in buffer, line start + n begins at offsets[n]
+        self.start      = 0
+        self.end        = 0
+        self.buffer     = bytearray()
+        self.offsets    = array('L', [0])
+        self.view       = memoryview(self.buffer)
+
+    def __len__(self):
+        return len(self.program)
+
+    def _encodeBlock(self, start):
+        '''
+
+        Encodes the lines from start up to the end of the block which starts there.
+
+        '''
+        program = self.program
+        end     = min(start + self.blockLines, len(program))
+
+        lines = program.lines[start:end]
+        if program.isShifted:
+            lines = [shiftLine(line, program.shift) for line in lines]
+
+        ending  = self.lineEnding
+        encoded = [(line.encode('utf-8') if isinstance(line, unicode) else line) + ending for line in lines]
+
+        offsets  = array('L', [0])
+        position = 0
+        for line in encoded:
+            position = position + len(line)
+            offsets.append(position)
+
+        self.start   = start
+        self.end     = end
+        self.buffer  = bytearray().join(encoded)
+        self.offsets = offsets
+        self.view    = memoryview(self.buffer)
+
+    def _block(self, index):
+        if index < self.start or index >= self.end:
+            self._encodeBlock(index)
+
+    def lineLength(self, index):
+        '''
+
+        Returns the number of bytes line index takes to send.
+
+        '''
+        self._block(index)
+        offset = index - self.start
+        return self.offsets[offset + 1] - self.offsets[offset]
+
+    def blockEnd(self, index):
+        '''
+
+        Returns the index of the first line after line index which is not in the same block, so the
+        lines from index up to it can be read with one call to lines.
+
+        '''
+        self._block(index)
+        return self.end
+
+    def lines(self, start, end):
+        '''
+
+        Returns a memoryview of the encoded lines from start up to end, which must be in the same block.
+
+        '''
+        if start < self.start or start >= self.end:
+            self._encodeBlock(start)
+        return self.view[self.offsets[start - self.start]:self.offsets[end - self.start]]
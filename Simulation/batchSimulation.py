@@ -0,0 +1,205 @@
+'''
+
+This module runs the sled model of the simulation without a window, over every position of a grid
+covering the work area or every move of a gcode file at once.
+
+The model is the one SimulationSled draws. The chains run from the motors to the target position.
+The sled's mounting points sit on the chains at the distance which keeps them sledWidth apart, and
+the tool is sledHeight below the middle of the mounting points, square to the line between them. For
+each position it gives:
+
+    slant           the angle of the line between the mounting points in degrees
+    correction      the x and y of the tool minus the target position
+    error           the distance from the target position to the tool
+
+Positions are in millimeters from the bottom left corner of the work area, as in the simulation.
+
+Run from the top level GroundControl directory:
+
+    python -m Simulation.batchSimulation grid [--step mm] [--output file]
+    python -m Simulation.batchSimulation gcode file.nc [--output file]
+
+The output is a NumPy .npz file of arrays named as the columns below, or a CSV file with the columns
+
+    x, y, slant, correctionX, correctionY, error
+
+if its name ends in .csv. Without --output a summary is printed.
+
+'''
+
+from collections                             import namedtuple
+
+import argparse
+import numpy
+import time
+
+SimulationResult = namedtuple('SimulationResult', ['x', 'y', 'slant', 'correctionX', 'correctionY', 'error'])
+
+#The Maslow Settings the model is built from
+SLEDMODELSETTINGS = ('bedWidth', 'bedHeight', 'motorSpacingX', 'motorOffsetY', 'sledWidth', 'sledHeight')
+
+class SledModel(object):
+
+    blockSize = 262144      #the number of positions simulated at once, which bounds the memory used by large grids
+
+    #the defaults are the dimensions used by SimulationCanvas and SimulationSled
+    def __init__(self, bedWidth = 2438.4, bedHeight = 1219.2, motorTranslate = 258.8, motorLift = 220.0,
+                 sledWidth = 300.0, sledHeight = 130.0):
+        self.bedWidth       = float(bedWidth)
+        self.bedHeight      = float(bedHeight)
+        self.motorTranslate = float(motorTranslate)
+        self.motorLift      = float(motorLift)
+        self.sledWidth      = float(sledWidth)
+        self.sledHeight     = float(sledHeight)
+
+        self.motorY         = self.bedHeight + self.motorLift
+        self.leftMotorX     = -self.motorTranslate
+        self.rightMotorX    = self.bedWidth + self.motorTranslate
+
+    def _simulateBlock(self, x, y):
+        '''
+
+        Returns the slant in radians and the x and y of the tool for the chains ending at x, y.
+
+        '''
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            #the slope of each chain, as SimulationLine measures it
+            leftSlope  = (self.motorY - y)/(self.leftMotorX - x)
+            rightSlope = (self.motorY - y)/(self.rightMotorX - x)
+
+            #the angle between the chains at the target, as SimulationAngle measures it
+            between = numpy.abs(numpy.arctan2(leftSlope - rightSlope, 1 + leftSlope*rightSlope))
+            angle   = numpy.pi - between
+
+            #the distance up each chain to the mounting points which keeps them sledWidth apart
+            distanceUpChain = self.sledWidth/(2*numpy.sin(angle/2))
+
+            leftStep  = distanceUpChain/numpy.sqrt(leftSlope**2 + 1)
+            rightStep = distanceUpChain/numpy.sqrt(rightSlope**2 + 1)
+            rightMountX = x + rightStep
+            rightMountY = y + rightSlope*rightStep
+            leftMountX  = x - leftStep
+            leftMountY  = y - leftSlope*leftStep
+
+            slant = numpy.arctan((rightMountY - leftMountY)/(rightMountX - leftMountX))
+
+            #the tool is sledHeight below the middle of the mounting points, square to the line between them
+            toolX = (leftMountX + rightMountX)/2 + self.sledHeight*numpy.sin(slant)
+            toolY = (leftMountY + rightMountY)/2 - self.sledHeight*numpy.cos(slant)
+
+        return slant, toolX, toolY
+
+    def simulate(self, x, y):
+        '''
+
+        Returns the SimulationResult for the chains ending at each of the positions x, y.
+
+        '''
+        x = numpy.ravel(numpy.asarray(x, dtype = numpy.float64))
+        y = numpy.ravel(numpy.asarray(y, dtype = numpy.float64))
+
+        slant       = numpy.empty(len(x))
+        correctionX = numpy.empty(len(x))
+        correctionY = numpy.empty(len(x))
+
+        for start in range(0, len(x), self.blockSize):
+            end = start + self.blockSize
+            blockSlant, toolX, toolY = self._simulateBlock(x[start:end], y[start:end])
+            slant[start:end]       = numpy.degrees(blockSlant)
+            correctionX[start:end] = toolX - x[start:end]
+            correctionY[start:end] = toolY - y[start:end]
+
+        return SimulationResult(x, y, slant, correctionX, correctionY, numpy.hypot(correctionX, correctionY))
+
+    def grid(self, step = 1.0):
+        '''
+
+        Returns the x and y of every position step millimeters apart across the work area as arrays
+        of rows from the bottom of the work area up.
+
+        '''
+        xs = numpy.arange(0.0, self.bedWidth + step/2, step)
+        ys = numpy.arange(0.0, self.bedHeight + step/2, step)
+        return numpy.meshgrid(xs, ys)
+
+def sledModelFromConfig(config):
+    '''
+
+    Returns the SledModel for the machine described by the Maslow Settings in config.
+
+    '''
+    def setting(key):
+        return float(config.get('Maslow Settings', key))
+
+    bedWidth = setting('bedWidth')
+    return SledModel(bedWidth, setting('bedHeight'), (setting('motorSpacingX') - bedWidth)/2, setting('motorOffsetY'),
+                     setting('sledWidth'), setting('sledHeight'))
+
+def gcodePositions(filename, model):
+    '''
+
+    Returns the x and y at the end of every move in a gcode file, moved from Ground Control's
+    coordinates, which are centered on the work area, to the simulation's.
+
+    '''
+    from DataStructures.gcodeProgram         import GcodeProgram, ISMOVE
+    from DataStructures.mappedGcodeFile      import openGcodeFile
+
+    program = GcodeProgram(openGcodeFile(filename))
+    count   = len(program)
+
+    posX  = numpy.frombuffer(program.posX, dtype = numpy.float64, count = count)
+    posY  = numpy.frombuffer(program.posY, dtype = numpy.float64, count = count)
+    mask  = numpy.frombuffer(program.mask, dtype = numpy.uint8, count = count)
+    moves = (mask & ISMOVE) != 0
+
+    return posX[moves] + model.bedWidth/2, posY[moves] + model.bedHeight/2
+
+def saveResult(result, filename):
+    '''
+
+    Saves a SimulationResult as CSV if filename ends in .csv, otherwise as a NumPy .npz file.
+
+    '''
+    if filename.lower().endswith('.csv'):
+        columns = numpy.column_stack(result)
+        numpy.savetxt(filename, columns, fmt = '%.6f', delimiter = ',', header = ','.join(result._fields), comments = '')
+    else:
+        numpy.savez(filename, **result._asdict())
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run the simulation's sled model without a window")
+    parser.add_argument('source', choices = ['grid', 'gcode'], help = "simulate a grid over the work area or the moves of a gcode file")
+    parser.add_argument('file', nargs = '?', help = "the gcode file to simulate")
+    parser.add_argument('--step', type = float, default = 1.0, help = "the spacing of the grid in mm")
+    parser.add_argument('--output', help = "save the results to this .npz or .csv file")
+    for name, default in (('bedWidth', 2438.4), ('bedHeight', 1219.2), ('motorTranslate', 258.8), ('motorLift', 220.0),
+                          ('sledWidth', 300.0), ('sledHeight', 130.0)):
+        parser.add_argument('--' + name, type = float, default = default)
+    options = parser.parse_args()
+
+    model = SledModel(options.bedWidth, options.bedHeight, options.motorTranslate, options.motorLift,
+                      options.sledWidth, options.sledHeight)
+
+    if options.source == 'gcode':
+        if options.file is None:
+            parser.error("a gcode file is needed")
+        x, y = gcodePositions(options.file, model)
+    else:
+        x, y = model.grid(options.step)
+
+    start  = time.time()
+    result = model.simulate(x, y)
+    simulateTime = time.time() - start
+
+    print("%d positions simulated in %.1f ms" % (len(result.x), simulateTime*1000))
+    if len(result.x):
+        print("slant   %8.3f to %8.3f degrees" % (numpy.nanmin(result.slant), numpy.nanmax(result.slant)))
+        print("error   %8.3f to %8.3f mm, mean %.3f mm" % (numpy.nanmin(result.error), numpy.nanmax(result.error), numpy.nanmean(result.error)))
+
+    if options.output:
+        saveResult(result, options.output)
+        print("saved to " + options.output)
+
+if __name__ == '__main__':
+    main()
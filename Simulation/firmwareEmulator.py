@@ -0,0 +1,261 @@
+'''
+
+This module provides a stand in for the Maslow firmware which runs on a pseudo-terminal, so Ground
+Control can be connected to it and the serial pipeline measured without a machine (Linux and macOS only).
+
+The emulator answers every line with ok once it has been processed, sends position reports and
+position error reports at a fixed rate, answers B05 with a firmware version, accepts B03 settings,
+and sends a Message: for each tool change. Moves update the reported position but take lineDelay
+seconds each regardless of their length.
+
+If a baud rate is given the emulator only hears and answers Ground Control while the port is set to
+that rate, and each line takes as long to arrive as it would on a real serial line at that rate.
+
+To use it with Ground Control, run
+
+    python -m Simulation.firmwareEmulator [lineDelay] [reportInterval] [baudRate]
+
+from the top level GroundControl directory and select the port it prints in Actions > Connect.
+
+'''
+
+from DataStructures.gcodeProgram             import WORDPATTERN
+
+import os
+import Queue
+import re
+import sys
+import termios
+import threading
+import time
+import tty
+
+#A tool change and the number of the tool
+TOOLCHANGE = re.compile(r'M0*6(?![0-9])')
+TOOLNUMBER = re.compile(r'T([0-9]+)')
+
+#The baud rate of each termios speed
+TERMIOSRATES = dict((getattr(termios, 'B' + str(rate)), rate) for rate in (9600, 19200, 38400, 57600, 115200))
+
+BITSPERBYTE  = 10       #a start bit, eight data bits and a stop bit
+
+class FirmwareEmulator(object):
+
+    version         = "0.65 (emulated)"
+
+    def __init__(self, lineDelay = 0.0, reportInterval = .25, latency = 0.0, bufferSize = None, baudRate = None):
+        '''
+
+        lineDelay is the time in seconds taken to process each line, reportInterval the time between
+        position reports, latency the time between a line being processed and its ok being sent,
+        bufferSize the size in bytes of the receive buffer, which is only used to count overflows, and
+        baudRate the rate of the emulated serial line, None for no limit.
+
+        '''
+        self.lineDelay      = lineDelay
+        self.reportInterval = reportInterval
+        self.latency        = latency
+        self.bufferSize     = bufferSize
+        self.baudRate       = baudRate
+
+        self.masterFd, self.slaveFd = os.openpty()
+        tty.setraw(self.slaveFd)
+        self.portName       = os.ttyname(self.slaveFd)
+
+        self.running        = False
+        self.writeLock      = threading.Lock()
+        self.lines          = Queue.Queue()         #received lines waiting to be processed
+        self.replies        = Queue.Queue()         #the time each ok is due to be sent
+
+        self.position       = [0.0, 0.0, 0.0]       #reported in the units of the gcode, as the firmware does
+        self.relative       = False
+        self.positionError  = 0.0
+        self.settings       = ""                    #the last B03 settings line
+
+        self.bytesInBuffer  = 0
+        self.bufferLock     = threading.Lock()      #bytesInBuffer is changed by both the receiving and processing threads
+        self.overflows      = 0                     #the number of lines which arrived while the buffer was full
+        self.receivedLines  = []
+        self.lineLatencies  = []                    #the time from each line arriving to its ok being sent
+
+    def start(self):
+        '''
+
+        Starts answering the port in background threads.
+
+        '''
+        self.running = True
+        for target in (self._receive, self._process, self._sendReplies, self._report):
+            thread = threading.Thread(target = target)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        '''
+
+        Stops the emulator and closes the port, which Ground Control will see as the connection being lost.
+
+        '''
+        self.running = False
+        self.lines.put(None)
+        self.replies.put(None)
+        with self.writeLock:
+            os.close(self.masterFd)
+            os.close(self.slaveFd)
+
+    def greet(self):
+        '''
+
+        Sends what the firmware sends when it starts up.
+
+        '''
+        self._send("ready\r\nok\r\n")
+
+    def _send(self, message):
+        with self.writeLock:
+            if not self.running or not self._rateMatches():
+                return
+            try:
+                os.write(self.masterFd, message)
+            except OSError:
+                self.running = False
+
+    def _rateMatches(self):
+        '''
+
+        Returns True if the port is set to the emulated baud rate, or no rate is emulated.
+
+        '''
+        if self.baudRate is None:
+            return True
+        try:
+            return TERMIOSRATES.get(termios.tcgetattr(self.slaveFd)[5]) == self.baudRate
+        except termios.error:
+            return False
+
+    def _receive(self):
+        pending = ""
+        while self.running:
+            try:
+                received = os.read(self.masterFd, 4096)
+            except OSError:
+                return
+            if not self._rateMatches():
+                continue            #bytes sent at the wrong rate are noise to the firmware
+            if self.baudRate is not None:
+                time.sleep(len(received)*BITSPERBYTE/float(self.baudRate))
+            pending = pending + received
+            now = time.time()
+            while "\n" in pending:
+                line, pending = pending.split("\n", 1)
+                length = len(line) + 1
+                if self.bufferSize is not None and self.bytesInBuffer + length > self.bufferSize:
+                    self.overflows = self.overflows + 1
+                with self.bufferLock:
+                    self.bytesInBuffer = self.bytesInBuffer + length
+                self.receivedLines.append(line)
+                self.lines.put((line, now, length))
+
+    def _process(self):
+        while self.running:
+            item = self.lines.get()
+            if item is None:
+                return
+            line, arrived, length = item
+
+            if self.lineDelay:
+                time.sleep(self.lineDelay)
+            self._execute(line.strip().upper())
+            with self.bufferLock:
+                self.bytesInBuffer = self.bytesInBuffer - length
+
+            self.replies.put((time.time() + self.latency, arrived))
+
+    def _sendReplies(self):
+        while self.running:
+            item = self.replies.get()
+            if item is None:
+                return
+            due, arrived = item
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._send("ok\r\n")
+            self.lineLatencies.append(time.time() - arrived)
+
+    def _report(self):
+        while self.running:
+            time.sleep(self.reportInterval)
+            x, y, z = self.position
+            self._send("<Idle,MPos:%.2f,%.2f,%.2f,WPos:0.000,0.000,0.000>\r\n" % (x, y, z))
+            self._send("[PosError:%.3f,%.3f]\r\n" % (self.positionError, self.positionError))
+
+    def _execute(self, line):
+        '''
+
+        Carries out one line of gcode or one B-code.
+
+        '''
+        if line.startswith("B05"):
+            self._send("Firmware Version " + self.version + "\r\n")
+            return
+        if line.startswith("B03"):
+            self.settings = line
+            return
+        if line.startswith("B"):
+            return
+
+        words = WORDPATTERN.findall(line)
+        codes = [float(value) for letter, value in words if letter == "G"]
+
+        for code in codes:
+            if code == 90:
+                self.relative = False
+            elif code == 91:
+                self.relative = True
+
+        if TOOLCHANGE.search(line):
+            tool = TOOLNUMBER.search(line)
+            self._send("Message: Please insert tool " + (tool.group(1) if tool else "") + "\r\n")
+
+        if 10 in codes:
+            #G10 sets the current position to the values given
+            for letter, value in words:
+                if letter in "XYZ":
+                    self.position["XYZ".index(letter)] = float(value)
+            return
+
+        for letter, value in words:
+            if letter in "XYZ":
+                axis = "XYZ".index(letter)
+                if self.relative:
+                    self.position[axis] = self.position[axis] + float(value)
+                else:
+                    self.position[axis] = float(value)
+
+def main():
+    lineDelay = 0.0
+    reportInterval = .25
+    baudRate = None
+    if len(sys.argv) > 1:
+        lineDelay = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        reportInterval = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        baudRate = int(sys.argv[3])
+
+    emulator = FirmwareEmulator(lineDelay, reportInterval, baudRate = baudRate)
+    emulator.start()
+    print("Firmware emulator listening on " + emulator.portName)
+
+    try:
+        while True:
+            time.sleep(1)
+            if not emulator.receivedLines:
+                #keep offering ok until Ground Control connects and sends its first line
+                emulator.greet()
+    except KeyboardInterrupt:
+        emulator.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+'''
+
+This module provides Kinematics which converts between positions of the cutting bit and the lengths
+of the two chains of the machine. Every function takes NumPy arrays of any shape and works on all of
+the points at once, so a whole toolpath can be converted in a single call. Plain numbers work too.
+
+Positions are in millimeters in Ground Control's coordinates, with the origin at the center of the
+work area and y up. The motors are at (-motorSpacingX/2, bedHeight/2 + motorOffsetY) and
+(motorSpacingX/2, bedHeight/2 + motorOffsetY). Chain lengths are measured in a straight line from
+the center of each motor's sprocket to the point where the chain mounts on the sled.
+
+The sled is a rigid body hanging from the two chains. Upright and with the bit at its origin, the
+chains mount at (-sledWidth/2, sledHeight) and (sledWidth/2, sledHeight) and its center of gravity is
+at (0, -sledCG). Away from the center of the work area the sled turns about the bit until the pull of
+the chains balances its weight. The angle is found with a few Newton iterations, and is the only
+unknown in both directions because the position of the bit for a given angle and pair of chain
+lengths is where two circles meet. Positions where the chains can not hold the sled, or where no
+balanced angle within a quarter turn either way can be found, give nan.
+
+'''
+
+from collections                             import namedtuple
+
+import numpy
+
+#The state of the sled hanging at a position. The tensions are in multiples of the sled's weight and
+#the angle is in radians counterclockwise.
+SledState = namedtuple('SledState', ['leftLength', 'rightLength', 'leftTension', 'rightTension', 'angle'])
+
+#The Maslow Settings Kinematics is built from
+KINEMATICSSETTINGS = ('motorSpacingX', 'motorOffsetY', 'bedWidth', 'bedHeight', 'sledWidth', 'sledHeight', 'sledCG')
+
+class Kinematics(object):
+
+    angleIterations    = 12     #the most Newton iterations used to find the angle of the sled at a position
+    maxAngleStep       = .25    #the largest change in radians of the angle in one Newton iteration
+    angleTolerance     = 1e-9   #the last Newton step in radians must be smaller than this for the angle to be found
+    forwardIterations  = 5      #secant iterations used to find the angle of the sled for a pair of chain lengths
+
+    def __init__(self, motorSpacingX = 3035.0, motorOffsetY = 463.0, bedWidth = 2438.4, bedHeight = 1219.2,
+                 sledWidth = 310.0, sledHeight = 139.0, sledCG = 79.0):
+        self.motorSpacingX = float(motorSpacingX)
+        self.motorOffsetY  = float(motorOffsetY)
+        self.bedWidth      = float(bedWidth)
+        self.bedHeight     = float(bedHeight)
+        self.sledWidth     = float(sledWidth)
+        self.sledHeight    = float(sledHeight)
+        self.sledCG        = float(sledCG)
+
+        self.motorX        = self.motorSpacingX/2          #the right motor, the left is at -motorX
+        self.motorY        = self.bedHeight/2 + self.motorOffsetY
+
+    def _mounts(self, angle):
+        '''
+
+        Returns the positions of the left and right chain mounts and the center of gravity relative to
+        the bit when the sled is turned by angle.
+
+        '''
+        cos = numpy.cos(angle)
+        sin = numpy.sin(angle)
+
+        halfWidth = self.sledWidth/2
+        height    = self.sledHeight
+
+        leftX    = -halfWidth*cos - height*sin
+        leftY    = -halfWidth*sin + height*cos
+        rightX   = halfWidth*cos - height*sin
+        rightY   = halfWidth*sin + height*cos
+        gravityX = self.sledCG*sin
+        gravityY = -self.sledCG*cos
+
+        return leftX, leftY, rightX, rightY, gravityX, gravityY
+
+    def _balance(self, x, y, angle):
+        '''
+
+        Returns a value which is zero when the sled hanging with its bit at x, y and turned by angle is
+        balanced, together with its rate of change with angle.
+
+        The sled is balanced when the torques of the chains about its center of gravity cancel. With the
+        tensions which carry the weight of the sled put in, and multiplied through by the chain lengths and
+        the determinant of the tensions, the balance is
+
+            dLeft.x*(rRight x dRight) - dRight.x*(rLeft x dLeft)
+
+        where d is the vector along each chain from its mount to its motor and r the vector from the
+        center of gravity to the mount.
+
+        '''
+        leftX, leftY, rightX, rightY, gravityX, gravityY = self._mounts(angle)
+
+        #from the bit to each motor, which does not change as the sled turns
+        motorLeftX  = -self.motorX - x
+        motorRightX = self.motorX - x
+        motorY      = self.motorY - y
+
+        dLeftX  = motorLeftX - leftX
+        dLeftY  = motorY - leftY
+        dRightX = motorRightX - rightX
+        dRightY = motorY - rightY
+
+        rLeftX  = leftX - gravityX
+        rLeftY  = leftY - gravityY
+        rRightX = rightX - gravityX
+        rRightY = rightY - gravityY
+
+        leftCross  = rLeftX*dLeftY - rLeftY*dLeftX
+        rightCross = rRightX*dRightY - rRightY*dRightX
+        balance = dLeftX*rightCross - dRightX*leftCross
+
+        #turning the sled turns r and the mounts by a right angle
+        leftCrossSlope  = -(rLeftX*motorLeftX + rLeftY*motorY)
+        rightCrossSlope = -(rRightX*motorRightX + rRightY*motorY)
+        slope = leftY*rightCross + dLeftX*rightCrossSlope - rightY*leftCross - dRightX*leftCrossSlope
+
+        return balance, slope
+
+    def _chains(self, x, y, angle, balanced = True):
+        '''
+
+        Returns the SledState of the sled hanging with its bit at x, y turned by angle. The lengths are
+        nan where balanced is False.
+
+        '''
+        leftX, leftY, rightX, rightY, gravityX, gravityY = self._mounts(angle)
+
+        dLeftX  = -self.motorX - x - leftX
+        dLeftY  = self.motorY - y - leftY
+        dRightX = self.motorX - x - rightX
+        dRightY = self.motorY - y - rightY
+
+        leftLength  = numpy.hypot(dLeftX, dLeftY)
+        rightLength = numpy.hypot(dRightX, dRightY)
+
+        #the tensions along each chain for which the chains carry the weight of the sled
+        leftDX       = dLeftX/leftLength
+        rightDX      = dRightX/rightLength
+        determinant  = leftDX*dRightY/rightLength - rightDX*dLeftY/leftLength
+        leftTension  = -rightDX/determinant
+        rightTension = leftDX/determinant
+
+        #the chains can only pull
+        slack = ~((leftTension >= 0) & (rightTension >= 0) & balanced)
+        if numpy.any(slack):
+            leftLength  = numpy.where(slack, numpy.nan, leftLength)
+            rightLength = numpy.where(slack, numpy.nan, rightLength)
+
+        return SledState(leftLength, rightLength, leftTension, rightTension, angle)
+
+    def sledState(self, x, y):
+        '''
+
+        Returns the SledState of the sled with its bit at x, y.
+
+        '''
+        x = numpy.asarray(x, dtype = numpy.float64)
+        y = numpy.asarray(y, dtype = numpy.float64)
+
+        #far from the work area Newton's method can jump to the wrong side of the sled, so each step is
+        #limited and the angle kept within a quarter turn of upright
+        limit = numpy.pi/2
+        angle = numpy.zeros(numpy.broadcast(x, y).shape)
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            for iteration in range(self.angleIterations):
+                balance, slope = self._balance(x, y, angle)
+                step     = balance/slope
+                #the angle is only found where the step is tiny, which also rules out a slope of zero
+                balanced = numpy.abs(step) < self.angleTolerance
+                angle    = numpy.clip(angle - numpy.clip(step, -self.maxAngleStep, self.maxAngleStep), -limit, limit)
+                if numpy.all(balanced):
+                    break
+
+            balanced = balanced & (numpy.abs(angle) < limit)
+
+            return self._chains(x, y, angle, balanced)
+
+    def inverse(self, x, y):
+        '''
+
+        Returns the lengths of the left and right chains which put the bit at x, y.
+
+        '''
+        state = self.sledState(x, y)
+        return state.leftLength, state.rightLength
+
+    def _place(self, leftLength, rightLength, angle):
+        '''
+
+        Returns the position of the bit when the chains are leftLength and rightLength long and the sled
+        is turned by angle.
+
+        The right mount is a fixed step from the left one, so the left mount is where the circle about
+        the left motor meets the circle about the right motor moved back by that step.
+
+        '''
+        leftX, leftY, rightX, rightY, gravityX, gravityY = self._mounts(angle)
+
+        #from the left motor to the moved right motor
+        betweenX = 2*self.motorX - (rightX - leftX)
+        betweenY = -(rightY - leftY)
+        distance = numpy.hypot(betweenX, betweenY)
+        betweenX = betweenX/distance
+        betweenY = betweenY/distance
+
+        along  = (leftLength**2 - rightLength**2 + distance**2)/(2*distance)
+        across = numpy.sqrt(leftLength**2 - along**2)
+
+        #the lower of the two points where the circles meet
+        mountX = -self.motorX + along*betweenX + across*betweenY
+        mountY = self.motorY + along*betweenY - across*betweenX
+
+        return mountX - leftX, mountY - leftY
+
+    def forward(self, leftLength, rightLength):
+        '''
+
+        Returns the x and y of the bit when the chains are leftLength and rightLength long.
+
+        '''
+        leftLength  = numpy.asarray(leftLength, dtype = numpy.float64)
+        rightLength = numpy.asarray(rightLength, dtype = numpy.float64)
+
+        #find the angle at which the sled placed by the chains is balanced with the secant method
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            lastAngle   = numpy.zeros(numpy.broadcast(leftLength, rightLength).shape)
+            x, y        = self._place(leftLength, rightLength, lastAngle)
+            lastBalance = self._balance(x, y, lastAngle)[0]
+            angle       = lastAngle + .001
+
+            for iteration in range(self.forwardIterations):
+                x, y    = self._place(leftLength, rightLength, angle)
+                balance = self._balance(x, y, angle)[0]
+                change  = balance - lastBalance
+                step    = numpy.where(change != 0, balance*(angle - lastAngle)/change, 0.0)
+                lastAngle, lastBalance = angle, balance
+                angle   = angle - step
+
+            return self._place(leftLength, rightLength, angle)
+
+def kinematicsFromConfig(config):
+    '''
+
+    Returns the Kinematics for the machine described by the Maslow Settings in config.
+
+    '''
+    def setting(key):
+        return float(config.get('Maslow Settings', key))
+
+    return Kinematics(*[setting(key) for key in KINEMATICSSETTINGS])
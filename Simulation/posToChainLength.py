@@ -3,6 +3,7 @@ from kivy.properties                         import NumericProperty, ObjectPrope
 from kivy.graphics                           import Color, Ellipse, Line
 from kivy.graphics.transformation            import Matrix
 from kivy.core.window                        import Window
+from kinematics                              import Kinematics
 
 import re
 import math
@@ -23,6 +24,13 @@ class PosToChainLength(FloatLayout):
     
     def initialize(self, posObject, motorSpacing, motorHeight, motorTranslate, motorLift):
         
+        self.motorSpacing   = motorSpacing
+        self.motorHeight    = motorHeight
+        self.motorTranslate = motorTranslate
+        self.motorLift      = motorLift
+        
+        self.kinematics = Kinematics(motorSpacing, motorLift, motorSpacing - 2*motorTranslate, motorHeight - motorLift, self.sledWidth, self.sledHeight)
+        
         self.posObject = posObject
         self.posObject.bind(sledToolPos = self.update)
     
@@ -30,5 +38,14 @@ class PosToChainLength(FloatLayout):
         self.posToLengths(self.posObject.sledToolPos[0], self.posObject.sledToolPos[1])
     
     def posToLengths(self, xVal, yVal):
-        pass
-        
\ No newline at end of file
+        
+        #the simulation puts the origin at the bottom left corner of the work area instead of the center
+        x = xVal - self.kinematics.bedWidth/2
+        y = yVal - self.kinematics.bedHeight/2
+        
+        lengthA, lengthB = self.kinematics.inverse(x, y)
+        
+        self.lenAString = "%.2f" % lengthA
+        self.lenBString = "%.2f" % lengthB
+        
+        return float(lengthA), float(lengthB)
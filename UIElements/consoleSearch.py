@@ -0,0 +1,40 @@
+from kivy.uix.floatlayout    import    FloatLayout
+from kivy.properties         import    ObjectProperty
+from kivy.properties         import    StringProperty
+
+
+class ConsoleSearch(FloatLayout):
+    '''
+    
+    A Pop-up Dialog To Search The Console History
+    
+    Shows every line of the history which contains the text typed in, with its line number. Only
+    the last maxShown matches are shown so that a search which matches most of a long history does
+    not build a huge label.
+    
+    '''
+    search     = ObjectProperty(None)
+    text_input = ObjectProperty(None)
+    cancel     = ObjectProperty(None)
+    results    = StringProperty("")
+    
+    maxShown   = 1000
+    
+    def showMatches(self, text):
+        '''
+        
+        Searches the history for text and shows the lines which contain it.
+        
+        '''
+        if text == "":
+            self.results = ""
+            return
+        
+        matches = self.search(text)
+        lines   = ["%d: %s" % (lineNumber, line) for lineNumber, line in matches[-self.maxShown:]]
+        
+        if len(matches) > self.maxShown:
+            heading = "%d lines contain \"%s\", the last %d are shown" % (len(matches), text, self.maxShown)
+        else:
+            heading = "%d lines contain \"%s\"" % (len(matches), text)
+        self.results = "\n".join([heading] + lines)
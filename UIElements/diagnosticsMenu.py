@@ -1,10 +1,20 @@
 from kivy.uix.floatlayout                        import    FloatLayout
 from DataStructures.makesmithInitFuncs           import    MakesmithInitFuncs
 from UIElements.scrollableTextPopup              import    ScrollableTextPopup
+from UIElements.consoleSearch                    import    ConsoleSearch
 from kivy.uix.popup                              import    Popup
+from DataStructures.gcodeProgram                 import    GcodeProgram
+from DataStructures.telemetryRecorder            import    TelemetryPlayer
+from UIElements.loadDialog                       import    LoadDialog
+from kivy.clock                                  import    Clock
+import os
+import time
 
 class Diagnostics(FloatLayout, MakesmithInitFuncs):
     
+    replaySpeed = 10.0      #how many times faster than it was recorded telemetry is played back
+    player      = None
+    
     def about(self):
         popupText = 'Ground Control v' + str(self.data.version) + ' allows you to control the Maslow machine. ' + \
                     'From within Ground Control, you can move the machine to where you want to begin a cut, calibrate the machine, ' + \
@@ -38,25 +48,25 @@ class Diagnostics(FloatLayout, MakesmithInitFuncs):
         self._popup.dismiss()
     
     def calibrateMotors(self):
-        self.data.gcode_queue.put("B01")
+        self.data.commands.put("B01")
         self.parentWidget.close()
         
     def calibrateChainLengths(self):
-        self.data.gcode_queue.put("B02 ")
+        self.data.commands.put("B02 ")
         self.parentWidget.close()
     
     def manualCalibrateChainLengths(self):
-        self.data.gcode_queue.put("B06 L1900 R1900")
+        self.data.commands.put("B06 L1900 R1900")
         self.data.message_queue.put("Message: The machine chains have been recalibrate to length 1,900mm")
         self.parentWidget.close()
     
     def testMotors(self):
-        self.data.gcode_queue.put("B04 ")
+        self.data.commands.put("B04 ")
         self.parentWidget.close()
     
     def testFeedbackSystem(self):
         print "Testing feedback system"
-        self.data.gcode = ["G20 G90 G40","(profile 1)","T0 M6","G17","M3","G0 X-0.7989 Y-0.7218","G1 X0.3822 Y-0.7218 F25","G3 X0.3986 Y-0.7207 I0 J0.125","G1 X0.5514 Y-0.7006","G3 X0.5829 Y-0.6922 I-0.0163 J0.1239","G1 X0.7254 Y-0.6332","G3 X0.7536 Y-0.6169 I-0.0478 J0.1155","G1 X0.8759 Y-0.523","G3 X0.899 Y-0.4999 I-0.0761 J0.0992","G1 X0.9928 Y-0.3776","G3 X1.0092 Y-0.3494 I-0.0992 J0.0761","G1 X1.0682 Y-0.2069","G3 X1.0766 Y-0.1754 I-0.1155 J0.0478","G1 X1.0967 Y-0.0226","G3 X1.0978 Y-0.0063 I-0.1239 J0.0163","G3 X1.0967 Y0.0101 I-0.125 J0","G1 X1.0766 Y0.1629","G3 X1.0682 Y0.1944 I-0.1239 J-0.0163","G1 X1.0092 Y0.3369","G3 X0.9928 Y0.3651 I-0.1155 J-0.0478","G1 X0.899 Y0.4874","G3 X0.8759 Y0.5105 I-0.0992 J-0.0761","G1 X0.7536 Y0.6043","G3 X0.7254 Y0.6207 I-0.0761 J-0.0992","G1 X0.5829 Y0.6797","G3 X0.5514 Y0.6881 I-0.0478 J-0.1155","G1 X0.3986 Y0.7082","G3 X0.3822 Y0.7093 I-0.0163 J-0.1239","G1 X-0.7989 Y0.7093","G3 X-0.9239 Y0.5843 I0 J-0.125","G1 X-0.9239 Y-0.5968","G3 X-0.7989 Y-0.7218 I0.125 J0"]
+        self.data.gcode = GcodeProgram(["G20 G90 G40","(profile 1)","T0 M6","G17","M3","G0 X-0.7989 Y-0.7218","G1 X0.3822 Y-0.7218 F25","G3 X0.3986 Y-0.7207 I0 J0.125","G1 X0.5514 Y-0.7006","G3 X0.5829 Y-0.6922 I-0.0163 J0.1239","G1 X0.7254 Y-0.6332","G3 X0.7536 Y-0.6169 I-0.0478 J0.1155","G1 X0.8759 Y-0.523","G3 X0.899 Y-0.4999 I-0.0761 J0.0992","G1 X0.9928 Y-0.3776","G3 X1.0092 Y-0.3494 I-0.0992 J0.0761","G1 X1.0682 Y-0.2069","G3 X1.0766 Y-0.1754 I-0.1155 J0.0478","G1 X1.0967 Y-0.0226","G3 X1.0978 Y-0.0063 I-0.1239 J0.0163","G3 X1.0967 Y0.0101 I-0.125 J0","G1 X1.0766 Y0.1629","G3 X1.0682 Y0.1944 I-0.1239 J-0.0163","G1 X1.0092 Y0.3369","G3 X0.9928 Y0.3651 I-0.1155 J-0.0478","G1 X0.899 Y0.4874","G3 X0.8759 Y0.5105 I-0.0992 J-0.0761","G1 X0.7536 Y0.6043","G3 X0.7254 Y0.6207 I-0.0761 J-0.0992","G1 X0.5829 Y0.6797","G3 X0.5514 Y0.6881 I-0.0478 J-0.1155","G1 X0.3986 Y0.7082","G3 X0.3822 Y0.7093 I-0.0163 J-0.1239","G1 X-0.7989 Y0.7093","G3 X-0.9239 Y0.5843 I0 J-0.125","G1 X-0.9239 Y-0.5968","G3 X-0.7989 Y-0.7218 I0.125 J0"])
         self.data.gcodeIndex = 0
         self.data.uploadFlag = True
         self.data.logger.beginRecordingAvgError()
@@ -64,8 +74,122 @@ class Diagnostics(FloatLayout, MakesmithInitFuncs):
         self.parentWidget.close()
     
     def wipeEEPROM(self):
-        self.data.gcode_queue.put("B07 ")
+        self.data.commands.put("B07 ")
+        self.parentWidget.close()
+    
+    def exportConsole(self):
+        '''
+        
+        Saves the whole console history to a text file next to the settings file.
+        
+        '''
+        filename = os.path.join(os.path.dirname(os.path.abspath(self.data.config.filename)), 'console.txt')
+        try:
+            self.data.console.export(filename)
+            self.data.message_queue.put("Console history saved to " + filename + "\n")
+        except IOError as e:
+            self.data.message_queue.put("Console history could not be saved: " + str(e) + "\n")
+        self.parentWidget.close()
+    
+    def searchConsole(self):
+        '''
+        
+        Open a pop-up to search the whole console history.
+        
+        '''
+        content = ConsoleSearch(search = self.data.console.search, cancel = self.dismiss_popup)
+        self._popup = Popup(title="Search console", content=content, size_hint=(0.9, 0.9))
+        self._popup.open()
+    
+    def commandQueueStats(self):
+        '''
+        
+        Writes how many commands of each priority are waiting and how long the sent ones waited to the console,
+        with the number of reports from the machine which could not be read and were dropped.
+        
+        '''
+        lines = ["Command queue:"]
+        for metrics in self.data.commands.metrics():
+            lines.append("%-10s waiting %4d   sent %6d   merged %5d   dropped %5d   wait ms mean %7.1f max %7.1f" % (
+                         metrics.name, metrics.depth, metrics.sent, metrics.merged, metrics.dropped, 1000*metrics.meanWait, 1000*metrics.maxWait))
+        lines.append("Malformed reports dropped: %d" % self.data.malformedReports)
+        self.data.message_queue.put("\n".join(lines) + "\n")
+        self.parentWidget.close()
+    
+    def replayTelemetry(self):
+        '''
+        
+        Open a pop-up to choose a telemetry recording to play back on the canvas.
+        
+        '''
+        content = LoadDialog(load=self.loadTelemetry, cancel=self.dismiss_popup)
+        content.path = os.path.join(os.path.dirname(os.path.abspath(self.data.config.filename)), 'telemetry')
+        if not os.path.isdir(content.path):
+            content.path = os.path.expanduser('~')
+        self._popup = Popup(title="Replay telemetry", content=content, size_hint=(0.9, 0.9))
+        self._popup.open()
+    
+    def loadTelemetry(self, filePath, filename):
+        '''
+        
+        Start playing back the chosen recording. The reports are passed through message_queue as if
+        they came from the machine, and data.replayIndex follows the line which was running so the
+        cut is shown as it happened. The real gcode index is left alone so that a file started
+        afterwards runs from where it was.
+        
+        '''
+        self.dismiss_popup()
         self.parentWidget.close()
+        
+        if not filename:
+            return
+        if self.data.uploadFlag:
+            self.data.message_queue.put("Telemetry can not be replayed while a file is running\n")
+            return
+        
+        try:
+            player = TelemetryPlayer(filename[0], self.replaySpeed)
+        except (IOError, ValueError) as e:
+            self.data.message_queue.put("Telemetry can not be replayed: " + str(e) + "\n")
+            return
+        
+        if self.player is not None:
+            self.stopReplay()
+        self.player = player
+        self.player.start(time.time())
+        Clock.schedule_interval(self.playTelemetry, 0)
+    
+    def playTelemetry(self, *args):
+        '''
+        
+        Pass on the recorded reports which are due. Runs every frame until the recording ends or a
+        file is started.
+        
+        '''
+        if self.data.uploadFlag:
+            self.stopReplay()
+            return False
+        
+        for report, gcodeIndex, lineInFlight in self.player.due(time.time()):
+            self.data.message_queue.put(report)
+            if lineInFlight >= 0:
+                self.data.replayIndex = lineInFlight
+            else:
+                self.data.replayIndex = gcodeIndex
+        
+        if self.player.finished():
+            self.stopReplay()
+            return False
+    
+    def stopReplay(self):
+        '''
+        
+        Stop playing back telemetry and show the real gcode index again.
+        
+        '''
+        Clock.unschedule(self.playTelemetry)
+        self.player = None
+        self.data.replayIndex = -1
     
     def advancedOptionsFunctions(self, text):
         
@@ -74,4 +198,12 @@ class Diagnostics(FloatLayout, MakesmithInitFuncs):
         elif text == "Calibrate Chain Length - Manual":
             self.manualCalibrateChainLengths()
         elif text == "Wipe EEPROM":
-            self.wipeEEPROM()
\ No newline at end of file
+            self.wipeEEPROM()
+        elif text == "Export Console":
+            self.exportConsole()
+        elif text == "Search Console":
+            self.searchConsole()
+        elif text == "Replay Telemetry":
+            self.replayTelemetry()
+        elif text == "Command Queue Stats":
+            self.commandQueueStats()
\ No newline at end of file
@@ -11,7 +11,10 @@ from kivy.properties                           import ObjectProperty, StringProp
 from DataStructures.makesmithInitFuncs         import MakesmithInitFuncs
 from kivy.uix.popup                            import Popup
 from UIElements.touchNumberInput               import TouchNumberInput
-import re
+from UIElements.notificationPopup              import NotificationPopup
+from DataStructures.progressEstimate           import formatDuration
+from DataStructures.resumePreamble             import resumePreamble
+from DataStructures.commandScheduler           import SETTINGS, PROGRAM
 
 class FrontPage(Screen, MakesmithInitFuncs):
     textconsole    = ObjectProperty(None)
@@ -28,6 +31,7 @@ class FrontPage(Screen, MakesmithInitFuncs):
     zReadoutPos = StringProperty("0 mm")
     
     percentComplete = StringProperty("0.0%")
+    timeRemaining   = StringProperty("")
     
     numericalPosX  = 0.0
     numericalPosY  = 0.0
@@ -62,18 +66,21 @@ class FrontPage(Screen, MakesmithInitFuncs):
     def setUpData(self, data):
         self.gcodecanvas.setUpData(data)
         self.screenControls.setUpData(data)
-        self.data.bind(connectionStatus = self.updateConnectionStatus)
+        self.data.bind(connectionState  = self.updateConnectionStatus)
         self.data.bind(units            = self.onUnitsSwitch)
         self.data.bind(gcodeIndex       = self.onIndexMove)
+        self.data.bind(replayIndex      = self.onReplayIndexMove)
         self.data.bind(gcodeFile        = self.onGcodeFileChange)
         self.data.bind(uploadFlag       = self.onUploadFlagChange)
     
-    def updateConnectionStatus(self, callback, connected):
+    def updateConnectionStatus(self, callback, state):
         
-        if connected:
+        if state == "streaming":
             self.connectionStatus = "Connected"
-        else:
+        elif state == "lost":
             self.connectionStatus = "Connection Lost"
+        elif state in ("opening", "handshaking") and self.connectionStatus != "Not Connected":
+            self.connectionStatus = "Reconnecting..."
     
     def switchUnits(self):
         if self.data.units == "INCHES":
@@ -88,13 +95,13 @@ class FrontPage(Screen, MakesmithInitFuncs):
         #the behavior of notifying the machine doesn't really belong here
         #but I'm not really sure where else it does belong
         if newUnits == "INCHES":
-            self.data.gcode_queue.put('G20 ')
+            self.data.commands.put('G20 ', SETTINGS)
             self.moveDistInput.text = str(float(self.moveDistInput.text)/25)
             self.target[0] = self.target[0]*INCHESTOMM
             self.target[1] = self.target[1]*INCHESTOMM
             self.target[2] = self.target[2]*INCHESTOMM
         else:
-            self.data.gcode_queue.put('G21 ')
+            self.data.commands.put('G21 ', SETTINGS)
             self.moveDistInput.text = str(float(self.moveDistInput.text)*25)
             self.target[0] = self.target[0]*MMTOINCHES
             self.target[1] = self.target[1]*MMTOINCHES
@@ -102,7 +109,22 @@ class FrontPage(Screen, MakesmithInitFuncs):
     
     def onIndexMove(self, callback, newIndex):
         self.gcodeLineNumber = str(newIndex)
-        self.percentComplete = '%.1f' %(100* (float(newIndex) / (len(self.data.gcode)-1))) + "%"
+        
+        #the estimate weighs each line by the time it takes, which is looked up rather than computed
+        estimate = self.data.progressEstimate
+        if estimate is not None and estimate.program is self.data.gcode:
+            self.percentComplete = '%.1f' %(100*estimate.fractionComplete(newIndex)) + "%"
+            self.timeRemaining   = formatDuration(estimate.timeRemaining(newIndex)) + " left"
+        elif len(self.data.gcode) > 1:
+            self.percentComplete = '%.1f' %(100* (float(newIndex) / (len(self.data.gcode)-1))) + "%"
+            self.timeRemaining   = ""
+    
+    def onReplayIndexMove(self, callback, replayIndex):
+        #show the replayed line while a replay runs and the real one again once it ends
+        if replayIndex >= 0:
+            self.onIndexMove(callback, replayIndex)
+        else:
+            self.onIndexMove(callback, self.data.gcodeIndex)
     
     def onGcodeFileChange(self, callback, newGcode):
         pass
@@ -130,33 +152,10 @@ class FrontPage(Screen, MakesmithInitFuncs):
         else:
             self.data.gcodeIndex = targetIndex
         
-        gCodeLine = self.data.gcode[self.data.gcodeIndex]
-        
-        xTarget = 0
-        yTarget = 0
+        #the position after the line runs was resolved when the file was loaded
+        xTarget, yTarget, zTarget = self.data.gcode.positionAt(self.data.gcodeIndex)
         
-        try:
-            x = re.search("X(?=.)([+-]?([0-9]*)(\.([0-9]+))?)", gCodeLine)
-            if x:
-                xTarget = float(x.groups()[0])
-            else:
-                if self.data.units == "INCHES":
-                    xTarget = self.gcodecanvas.positionIndicator.pos[0] / 25.4
-                else:
-                    xTarget = self.gcodecanvas.positionIndicator.pos[0]              
-            
-            y = re.search("Y(?=.)([+-]?([0-9]*)(\.([0-9]+))?)", gCodeLine)
-            if y:
-                yTarget = float(y.groups()[0])
-            else:
-                if self.data.units == "INCHES":
-                    yTarget = self.gcodecanvas.positionIndicator.pos[1] / 25.4
-                else:
-                    yTarget = self.gcodecanvas.positionIndicator.pos[1] 
-            
-            self.gcodecanvas.positionIndicator.setPos(xTarget,yTarget,self.data.units, 0)
-        except:
-            print "Unable to update position for new gcode line"
+        self.gcodecanvas.positionIndicator.setPos(xTarget,yTarget,"MM")
     
     def pause(self):
         if  self.holdBtn.text == "HOLD":
@@ -179,7 +178,7 @@ class FrontPage(Screen, MakesmithInitFuncs):
         self.jmpsize()
         xtarget = self.target[0] - float(self.stepsizeval)
         ytarget = self.target[1] + float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 X" + str(xtarget) + " Y" + str(ytarget) + " ")
+        self.data.commands.jog(x = xtarget, y = ytarget)
         self.target[0] = xtarget
         self.target[1] = ytarget
         
@@ -187,64 +186,64 @@ class FrontPage(Screen, MakesmithInitFuncs):
         self.jmpsize()
         xtarget = self.target[0] + float(self.stepsizeval)
         ytarget = self.target[1] + float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 X" + str(xtarget) + " Y" + str(ytarget) + " ")
+        self.data.commands.jog(x = xtarget, y = ytarget)
         self.target[0] = xtarget
         self.target[1] = ytarget
 
     def up(self):
         self.jmpsize()
         target = self.target[1] + float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 Y" + str(target) + " ")
+        self.data.commands.jog(y = target)
         self.target[1] = target
 
     def left(self):
         self.jmpsize()
         target = self.target[0] - float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 X" + str(target) + " ")
+        self.data.commands.jog(x = target)
         self.target[0] = target
         
     def right(self):
         self.jmpsize()
         target = self.target[0] + float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 X" + str(target) + " ")
+        self.data.commands.jog(x = target)
         self.target[0] = target
         
     def downLeft(self):
         self.jmpsize()
         xtarget = self.target[0] - float(self.stepsizeval)
         ytarget = self.target[1] - float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 X" + str(xtarget) + " Y" + str(ytarget) + " ")
+        self.data.commands.jog(x = xtarget, y = ytarget)
         self.target[0] = xtarget
         self.target[1] = ytarget
 
     def down(self):
         self.jmpsize()
         target = self.target[1] - float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 Y" + str(target) + " ")
+        self.data.commands.jog(y = target)
         self.target[1] = target
 
     def downRight(self):
         self.jmpsize()
         xtarget = self.target[0] + float(self.stepsizeval)
         ytarget = self.target[1] - float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 X" + str(xtarget) + " Y" + str(ytarget) + " ")
+        self.data.commands.jog(x = xtarget, y = ytarget)
         self.target[0] = xtarget
         self.target[1] = ytarget
 
     def zUp(self):
         self.jmpsize()
         target = self.target[2] + 0.10*float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 Z" + str(target) + " ")
+        self.data.commands.jog(z = target)
         self.target[2] = self.target[2] + 0.10*float(self.stepsizeval)
 
     def zDown(self):
         self.jmpsize()
         target = self.target[2] - 0.10*float(self.stepsizeval)
-        self.data.gcode_queue.put("G00 Z" + str(target) + " ")
+        self.data.commands.jog(z = target)
         self.target[2] = self.target[2] - 0.10*float(self.stepsizeval)
 
     def zeroZ(self):
-        self.data.gcode_queue.put("G10 Z0 ")
+        self.data.commands.put("G10 Z0 ", SETTINGS)
         self.target[2] = 0
         
     def home(self):
@@ -258,16 +257,16 @@ class FrontPage(Screen, MakesmithInitFuncs):
         #if the machine has a z-axis lift it then go home
         if int(self.data.config.get('Maslow Settings', 'zAxis')):
             if self.units == "INCHES":
-                self.data.gcode_queue.put("G00 Z.25 ")
+                self.data.commands.jog(z = .25)
             else:
-                self.data.gcode_queue.put("G00 Z5.0 ")
+                self.data.commands.jog(z = 5.0)
             
-            self.data.gcode_queue.put("G00 X" + str(self.data.gcodeShift[0]) + " Y" + str(self.data.gcodeShift[1]) + " ")
+            self.data.commands.jog(x = self.data.gcodeShift[0], y = self.data.gcodeShift[1])
             
-            self.data.gcode_queue.put("G00 Z0 ")
+            self.data.commands.jog(z = 0)
         #if the machine does not have a z-axis, just go home
         else:
-            self.data.gcode_queue.put("G00 X" + str(self.data.gcodeShift[0]) + " Y" + str(self.data.gcodeShift[1]) + " ")
+            self.data.commands.jog(x = self.data.gcodeShift[0], y = self.data.gcodeShift[1])
         
         self.target[0] = self.data.gcodeShift[0]
         self.target[1] = self.data.gcodeShift[1]
@@ -283,12 +282,51 @@ class FrontPage(Screen, MakesmithInitFuncs):
     
     def startRun(self):
         
+        #a file changed on disk since it was opened no longer matches its index, so reading it could
+        #send the wrong lines or crash, and it is opened again instead
+        if self.data.gcode.linesHaveChanged():
+            self.data.message_queue.put("Message: The gcode file has changed since it was opened. It has been reloaded, check it and press Run again.")
+            self.gcodecanvas.reloadGcode()
+            return
+        
+        #ask before running a file with moves the machine can not reach
+        report = self.gcodecanvas.preflightReport
+        if report is not None and report.program is self.data.gcode and report.hasProblems():
+            content = NotificationPopup(continueOn = self.confirmRun, hold = self.cancelRun, text = report.summary() + " Press Continue to run the file anyway.")
+            self._popup = Popup(title="Preflight check", content=content, auto_dismiss=False, size_hint=(0.35, 0.35))
+            self._popup.open()
+            return
+        
+        self.beginRun()
+    
+    def confirmRun(self):
+        self._popup.dismiss()
+        self.beginRun()
+    
+    def beginRun(self):
+        '''
+        
+        Starts sending the program from the current line. A program started partway through is
+        preceded by the commands which put the machine in the state the program had at that line.
+        
+        '''
+        
+        if self.data.gcodeIndex > 0:
+            state = self.data.gcode.modalStateAt(self.data.gcodeIndex)
+            zAxis = self.data.config.get('Maslow Settings', 'zAxis') in ('1', 'True')
+            for line in resumePreamble(state, zAxis):
+                self.data.commands.put(line, PROGRAM)
+            self.data.message_queue.put("Resuming at line " + str(self.data.gcodeIndex) + "\n")
+        
         self.data.uploadFlag = 1
         self.sendLine()
     
+    def cancelRun(self):
+        self._popup.dismiss()
+    
     def sendLine(self):
         try:
-            self.data.gcode_queue.put(self.data.gcode[self.data.gcodeIndex])
+            self.data.commands.put(self.data.gcode[self.data.gcodeIndex], PROGRAM)
             self.data.gcodeIndex = self.data.gcodeIndex + 1
         except:
             print "gcode run complete"
@@ -298,9 +336,7 @@ class FrontPage(Screen, MakesmithInitFuncs):
     def stopRun(self):
         self.data.uploadFlag = 0
         self.data.gcodeIndex = 0
-        self.data.quick_queue.put("!") 
-        with self.data.gcode_queue.mutex:
-            self.data.gcode_queue.queue.clear()
+        self.data.commands.emergencyStop("!")
         self.onUploadFlagChange(self.stopRun, 0)
         print("Gode Stopped")
     
@@ -6,17 +6,26 @@ and zooming features. It was not originally written as a stand alone module whic
 '''
 
 from kivy.uix.floatlayout                    import FloatLayout
-from kivy.properties                         import NumericProperty, ObjectProperty
-from kivy.graphics                           import Color, Ellipse, Line
+from kivy.properties                         import NumericProperty, ObjectProperty, StringProperty
+from kivy.graphics                           import Color, Ellipse, Line, Mesh, PushMatrix, PopMatrix, Rectangle, Translate
+from kivy.graphics.texture                   import Texture
 from kivy.clock                              import Clock
 from DataStructures.makesmithInitFuncs       import MakesmithInitFuncs
+from DataStructures.gcodeLoader              import GcodeLoader
+from DataStructures.gcodeCache               import GcodeCache
+from DataStructures.toolpathGeometry         import ToolpathGeometry, FEED, RAPIDS, ARCS, RAISES, PLUNGES
+from DataStructures.preflightCheck           import PreflightCheck
+from DataStructures.errorField               import ErrorFieldBuilder, ErrorFieldCache
+from Simulation.kinematics                   import kinematicsFromConfig
+from Simulation.batchSimulation              import sledModelFromConfig
 from UIElements.positionIndicator            import PositionIndicator
 from UIElements.viewMenu                     import ViewMenu
 from kivy.graphics.transformation            import Matrix
 from kivy.core.window                        import Window
 
-import re
-import math
+import os
+import Queue
+import time
 
 class GcodeCanvas(FloatLayout, MakesmithInitFuncs):
     
@@ -27,25 +36,48 @@ class GcodeCanvas(FloatLayout, MakesmithInitFuncs):
     offsetX = NumericProperty(0)
     offsetY = NumericProperty(0)
     
-    canvasScaleFactor = 1 #scale from mm to pixels
-    INCHES            = 25.4
-    MILLIMETERS       = 1 
+    loadingText   = StringProperty("")  #shown while a file is loading
+    preflightText = StringProperty("")  #the problems found by the preflight check
     
-    xPosition = 0
-    yPosition = 0
-    zPosition = 0
+    geometry = ToolpathGeometry()   #the vertex buffers for the open file
     
-    lineNumber = 0  #the line number currently being processed
+    loader        = None            #the GcodeLoader for the file being loaded, None when nothing is loading
+    loadedProgram = None            #the last program built by a loader, so updateGcode does not rebuild it
+    openProgram   = None            #the program in data.gcode, whose file is closed when it is replaced
+    gcodeCache    = None            #the parsed files saved on disk next to the settings file
     
-    prependString = "G01 "
+    preflight       = None          #the PreflightCheck which is running, if any
+    preflightReport = None          #the PreflightReport for the program on the canvas, if it has been checked
+    
+    errorFieldBuilder = None        #the ErrorFieldBuilder which is running, if any
+    errorField        = None        #the ErrorField of the machine in the current settings, once it is built
+    errorFieldCache   = None        #the fields saved on disk next to the settings file
+    
+    #the color each vertex buffer is drawn in
+    bufferColors = [(RAPIDS, (.5, .5, .5)), (FEED, (1, 1, 1)), (ARCS, (1, 1, 1)), (RAISES, (0, 1, 0)), (PLUNGES, (1, 0, 0))]
+    
+    #the colors moves flagged by the preflight check are drawn over the toolpath in
+    unreachableColor = (1, 0, 1)
+    lowTensionColor  = (1, .6, 0)
+    
+    maxMeshVertices = 65534         #Mesh indices are unsigned shorts
+    
+    levelOfDetail     = 0           #the index of the level in self.geometry.levels being drawn
+    buildTimePerFrame = .02         #the time in seconds spent drawing loaded chunks each frame
     
     def initialize(self):
 
         self.drawWorkspace()
+        
+        settingsDirectory    = os.path.dirname(os.path.abspath(self.data.config.filename))
+        self.gcodeCache      = GcodeCache(os.path.join(settingsDirectory, 'gcodeCache'))
+        self.errorFieldCache = ErrorFieldCache(os.path.join(settingsDirectory, 'errorFields'))
             
         Window.bind(on_resize = self.centerCanvas)
         Window.bind(on_motion = self.zoomCanvas)
 
+        self.openProgram = self.data.gcode
+        self.data.bind(gcode = self.closeReplacedProgram)
         self.data.bind(gcode = self.updateGcode)
         self.data.bind(gcodeShift = self.reloadGcode)
         self.data.bind(gcodeFile = self.reloadGcode)
@@ -54,6 +86,7 @@ class GcodeCanvas(FloatLayout, MakesmithInitFuncs):
         self._keyboard.bind(on_key_down=self._on_keyboard_down)
         
         self.reloadGcode()
+        self.startErrorField()
     
     def _keyboard_closed(self):
         '''
@@ -79,38 +112,57 @@ class GcodeCanvas(FloatLayout, MakesmithInitFuncs):
         if keycode[1] == self.data.config.get('Ground Control Settings', 'zoomOut'):
             mat = Matrix().scale(1+scaleFactor, 1+scaleFactor, 1)
             self.scatterInstance.apply_transform(mat, anchor)
+        
+        self.updateLevelOfDetail()
     
     def reloadGcode(self, *args):
         '''
         
-        This reloads the gcode from the hard drive in case it has been updated. 
+        This reloads the gcode from the hard drive in case it has been updated. The file is loaded
+        in a background thread, any file which is still loading is abandoned.
         
         '''
         
         filename = self.data.gcodeFile
-        try:
-            filterfile = open(filename, 'r')
-            rawfilters = filterfile.read()
-            filtersparsed = re.sub(r'\(([^)]*)\)','',rawfilters) #removes mach3 style gcode comments
-            filtersparsed = re.sub(r';([^\n]*)\n','',filtersparsed) #removes standard ; initiated gcode comments
-            filtersparsed = re.split('\n', filtersparsed) #splits the gcode into elements to be added to the list
-            filtersparsed = [x + ' ' for x in filtersparsed] #adds a space to the end of each line
-            filtersparsed = [x.lstrip() for x in filtersparsed]
-            filtersparsed = [x.replace('X ','X') for x in filtersparsed]
-            filtersparsed = [x.replace('Y ','Y') for x in filtersparsed]
-            filtersparsed = [x.replace('Z ','Z') for x in filtersparsed]
-            filtersparsed = [x.replace('I ','I') for x in filtersparsed]
-            filtersparsed = [x.replace('J ','J') for x in filtersparsed]
-            filtersparsed = [x.replace('F ','F') for x in filtersparsed]
-            
-            self.data.gcode = "[]"
-            self.data.gcode = filtersparsed
-            
-            filterfile.close() #closes the filter save file
-        except:
-            if filename is not "":
-                self.data.message_queue.put("Message: Cannot reopen gcode file. It may have been moved or deleted. To locate it or open a different file use Actions > Open G-code")
-            self.data.gcodeFile = ""
+        
+        self.cancelLoading()
+        
+        if filename == "":
+            return
+        
+        self.startLoading(GcodeLoader(filename = filename, shift = self.data.gcodeShift, cache = self.gcodeCache, rapidRate = self.rapidRate()))
+    
+    def startLoading(self, loader):
+        '''
+        
+        Clears the canvas and starts loader. The chunks it sends back are drawn by callBackMechanism.
+        
+        '''
+        
+        self.geometry    = ToolpathGeometry()
+        self.loader      = loader
+        self.loadingText = "Loading gcode..."
+        
+        self.preflight       = None
+        self.preflightReport = None
+        self.preflightText   = ""
+        
+        self.clearGcode()
+        
+        loader.start()
+        Clock.schedule_once(self.callBackMechanism)
+    
+    def cancelLoading(self):
+        '''
+        
+        Stops the file which is loading, if there is one.
+        
+        '''
+        
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader      = None
+            self.loadingText = ""
         
     def centerCanvas(self, *args):
         '''
@@ -124,6 +176,8 @@ class GcodeCanvas(FloatLayout, MakesmithInitFuncs):
         anchor = (0,0)
         mat = Matrix().scale(.45, .45, 1)
         self.scatterInstance.apply_transform(mat, anchor)
+        
+        self.updateLevelOfDetail()
     
     def zoomCanvas(self, callback, type, motion, *args):
         if motion.is_mouse_scrolling:
@@ -136,6 +190,25 @@ class GcodeCanvas(FloatLayout, MakesmithInitFuncs):
             elif motion.button == 'scrolldown':
                 mat = Matrix().scale(1+scaleFactor, 1+scaleFactor, 1)
                 self.scatterInstance.apply_transform(mat, anchor)
+            
+            self.updateLevelOfDetail()
+    
+    def updateLevelOfDetail(self):
+        '''
+        
+        Pick the level of detail to draw the gcode at from the current zoom and redraw the gcode
+        if it has changed.
+        
+        '''
+        
+        #while loading the chunks are drawn as they arrive and the level is chosen when the file is done
+        if self.loader is not None:
+            return
+        
+        level = self.geometry.levelForScale(self.scatterInstance.scale)
+        if level != self.levelOfDetail:
+            self.levelOfDetail = level
+            self.drawGeometry()
 
     def drawWorkspace(self, *args):
 
@@ -156,273 +229,321 @@ class GcodeCanvas(FloatLayout, MakesmithInitFuncs):
             Line(points = (-width/2,0,width/2,0), dash_offset = 5, group='workspace')
             Line(points = (0, -height/2,0,height/2), dash_offset = 5, group='workspace')
 
-    def calcAngle(self, X, Y, centerX, centerY):
+    def clearGcode(self):
         '''
         
-        calcAngle returns the angle from the positive x axis to a point given the center of the circle 
-        and the point. Angle returned in degrees.
+        clearGcode deletes the lines and arcs corresponding to gcode commands from the canvas. 
     
         '''
-
-        #Special cases at quadrant boundaries (resolves /div0 errors)
-        if X == centerX:
-            if Y >= centerY: theta = -0.5*math.pi
-            if Y < centerY:  theta = 0.5*math.pi
-        elif Y == centerY:
-            if X > centerX: theta = 0.0*math.pi
-            if X < centerX: theta = 1.0*math.pi
-
-        #Normal cases
-        if X > centerX and Y > centerY: #quadrant one
-            theta = math.atan((centerY - Y)/(X - centerX))
-        if X < centerX and Y > centerY: #quadrant two
-            theta = math.atan((Y - centerY)/(X - centerX))
-            theta = 1.0*math.pi - theta
-        if X < centerX and Y < centerY: #quadrant three
-            theta = math.atan((Y - centerY)/(X - centerX))
-            theta = 1.0*math.pi - theta
-        if X > centerX and Y < centerY: #quadrant four
-            theta = math.atan((centerY - Y)/(X - centerX))
+        self.scatterObject.canvas.clear()#remove_group('gcode')
         
-        return(math.degrees(theta + 0.5*math.pi))   
+        self.drawWorkspace()
     
-    def drawLine(self,gCodeLine,command):
+    def drawGeometry(self):
         '''
         
-        drawLine draws a line using the previous command as the start point and the xy coordinates
-        from the current command as the end point. The line is styled based on the command to allow
-        visually differentiating between normal and rapid moves. If the z-axis depth is changed a
-        circle is placed at the location of the depth change to alert the user. 
-    
-        '''
+        drawGeometry replaces the gcode on the canvas with the current level of detail of
+        self.geometry.
         
-        xTarget = self.xPosition
-        yTarget = self.yPosition
-        zTarget = self.zPosition
+        '''
         
-        x = re.search("X(?=.)([+-]?([0-9]*)(\.([0-9]+))?)", gCodeLine)
-        if x:
-            xTarget = float(x.groups()[0])*self.canvasScaleFactor
+        self.scatterObject.canvas.remove_group('gcode')
         
-        y = re.search("Y(?=.)([+-]?([0-9]*)(\.([0-9]+))?)", gCodeLine)
-        if y:
-            yTarget = float(y.groups()[0])*self.canvasScaleFactor
+        self.drawBuffers(self.geometry.levels[self.levelOfDetail])
         
-        z = re.search("Z(?=.)([+-]?([0-9]*)(\.([0-9]+))?)", gCodeLine)
-        if z:
-            zTarget = float(z.groups()[0])*self.canvasScaleFactor
+        #keep the flagged moves on top of the toolpath
+        self.drawPreflight()
+    
+    def drawBuffers(self, buffers):
+        '''
         
+        drawBuffers adds a set of vertex buffers to the gcode on the canvas. Each buffer is drawn with one Mesh
+        instruction (or a few if it has more vertices than a single Mesh can index) so the number of instructions
+        does not depend on the length of the file.
         
-        #Draw lines for G1 and G0
-        with self.scatterObject.canvas:
-            Color(1, 1, 1)
-            if command == 'G00':
-                Line(points = (self.offsetX + self.xPosition , self.offsetY + self.yPosition , self.offsetX +  xTarget, self.offsetY  + yTarget), width = 1, group = 'gcode', dash_length = 4, dash_offset = 2)
-            elif command == 'G01':
-                Line(points = (self.offsetX + self.xPosition , self.offsetY + self.yPosition , self.offsetX +  xTarget, self.offsetY  + yTarget), width = 1, group = 'gcode')
-       
-        #If the zposition has changed, add indicators
-        tol = 0.05 #Acceptable error in mm
-        if abs(zTarget - self.zPosition) >= tol:
-            with self.scatterObject.canvas:
-                if zTarget - self.zPosition > 0:
-                    Color(0, 1, 0)
-                    radius = 1
-                else:
-                    Color(1, 0, 0)
-                    radius = 2
-                Line(circle=(self.offsetX + self.xPosition , self.offsetY + self.yPosition, radius), width = 2, group = 'gcode')
-        
-        self.xPosition = xTarget
-        self.yPosition = yTarget
-        self.zPosition = zTarget
-    
-    def drawArc(self,gCodeLine,command):
-        '''
-        
-        drawArc draws an arc using the previous command as the start point, the xy coordinates from
-        the current command as the end point, and the ij coordinates from the current command as the
-        circle center. Clockwise or counter-clockwise travel is based on the command. 
-    
-        '''
-        
-        xTarget = self.xPosition
-        yTarget = self.yPosition
-        iTarget = 0
-        jTarget = 0
-        
-        x = re.search("X(?=.)([+-]?([0-9]*)(\.([0-9]+))?)", gCodeLine)
-        if x:
-            xTarget = float(x.groups()[0])*self.canvasScaleFactor
-        y = re.search("Y(?=.)([+-]?([0-9]*)(\.([0-9]+))?)", gCodeLine)
-        if y:
-            yTarget = float(y.groups()[0])*self.canvasScaleFactor
-        i = re.search("I(?=.)([+-]?([0-9]*)(\.([0-9]+))?)", gCodeLine)
-        if i:
-            iTarget = float(i.groups()[0])*self.canvasScaleFactor
-        j = re.search("J(?=.)([+-]?([0-9]*)(\.([0-9]+))?)", gCodeLine)
-        if j:
-            jTarget = float(j.groups()[0])*self.canvasScaleFactor
-        
-        radius = math.sqrt(iTarget**2 + jTarget**2)
-        centerX = self.xPosition + iTarget
-        centerY = self.yPosition + jTarget
-        
-        angle1 = self.calcAngle(self.xPosition, self.yPosition, centerX, centerY)
-        angle2 = self.calcAngle(xTarget, yTarget, centerX, centerY)
-        
-        if command == 'G02':
-            angleStart = angle2
-            angleEnd = angle1
-        elif command == 'G03':
-            angleStart = angle1
-            angleEnd = angle2
-        
-        if angleStart < angleEnd:
-            angleEnd = angleEnd - 360
-        
-        #Draw arc for G02 and G03
-        with self.scatterObject.canvas:
-            Color(1, 1, 1)
-            Line(circle=(self.offsetX + centerX , self.offsetY + centerY, radius, angleStart, angleEnd), group = 'gcode')
-
-        self.xPosition = xTarget
-        self.yPosition = yTarget
-
-    def clearGcode(self):
         '''
         
-        clearGcode deletes the lines and arcs corresponding to gcode commands from the canvas. 
+        with self.scatterObject.canvas:
+            PushMatrix(group = 'gcode')
+            Translate(self.offsetX, self.offsetY, group = 'gcode')
+            for name, color in self.bufferColors:
+                Color(*color, group = 'gcode')
+                for vertices, indices in self.meshChunks(buffers[name]):
+                    Mesh(vertices = vertices, indices = indices, mode = 'lines', group = 'gcode')
+            PopMatrix(group = 'gcode')
     
+    def meshChunks(self, points):
         '''
-        self.scatterObject.canvas.clear()#remove_group('gcode')
         
-        self.drawWorkspace()
-    
-    def moveLine(self, gcodeLine):
+        Splits a buffer of x,y pairs into (vertices, indices) lists in the format Mesh expects, with
+        no more than maxMeshVertices vertices in each.
         
-        originalLine = gcodeLine
+        '''
         
-        try:
-            gcodeLine = gcodeLine.upper() + " "
-            
+        vertexCount = len(points)//2
+        
+        for first in xrange(0, vertexCount, self.maxMeshVertices):
+            last  = min(vertexCount, first + self.maxMeshVertices)
+            count = last - first
             
-            x = gcodeLine.find('X')
-            if x != -1:
-                space = gcodeLine.find(' ', x)
-                number = float(gcodeLine[x+1:space]) + self.data.gcodeShift[0]
-                gcodeLine = gcodeLine[0:x+1] + str(number) + gcodeLine[space:]
+            vertices = [0.0]*(4*count)                              #x, y, u, v for each vertex
+            vertices[0::4] = points[2*first:2*last:2]
+            vertices[1::4] = points[2*first+1:2*last:2]
             
-            y = gcodeLine.find('Y')
-            if y != -1:
-                space = gcodeLine.find(' ', y)
-                number = float(gcodeLine[y+1:space]) + self.data.gcodeShift[1]
-                gcodeLine = gcodeLine[0:y+1] + str(number) + gcodeLine[space:]
+            yield vertices, range(count)
+    
+    def callBackMechanism(self, callback) :
+        '''
+        
+        Draw the chunks sent back by the loader as they arrive, without spending more than
+        buildTimePerFrame each frame, and draw the finished geometry when the file is done.
+        
+        '''
+        
+        loader = self.loader
+        if loader is None:
+            return
+        
+        frameStart = time.time()
+        
+        while time.time() - frameStart < self.buildTimePerFrame:
+            try:
+                message = loader.queue.get_nowait()
+            except Queue.Empty:
+                break
             
-            return gcodeLine
-        except ValueError:
-            print "line could not be moved:"
-            print originalLine
-            return originalLine
+            if message[0] == "chunk":
+                buffers, fraction = message[1], message[2]
+                self.drawBuffers(buffers)
+                self.loadingText = "Loading gcode... " + str(int(100*fraction)) + "%"
+            elif message[0] == "done":
+                program, geometry, estimate = message[1], message[2], message[3]
+                self.loader        = None
+                self.loadingText   = ""
+                self.geometry      = geometry
+                self.levelOfDetail = self.geometry.levelForScale(self.scatterInstance.scale)
+                self.drawGeometry()
+                
+                #switch the units to match the file
+                if program.units is not None:
+                    self.data.units = program.units
+                
+                self.loadedProgram = program
+                self.data.progressEstimate = estimate
+                self.data.gcode    = program
+                
+                self.startPreflight()
+                return
+            else:
+                errorText, unreadable = message[1], message[2]
+                self.loader      = None
+                self.loadingText = ""
+                if not unreadable:
+                    #the file is still there, so keep it open to be reloaded once the problem is fixed
+                    self.data.message_queue.put("Message: The gcode file could not be loaded. " + errorText)
+                    return
+                if self.data.gcodeFile != "":
+                    self.data.message_queue.put("Message: Cannot reopen gcode file. It may have been moved or deleted. To locate it or open a different file use Actions > Open G-code\n\n" + errorText)
+                self.data.gcodeFile = ""
+                return
+        
+        #Repeat until the file is done
+        Clock.schedule_once(self.callBackMechanism)
+    
+    def rapidRate(self):
+        '''
+        
+        Returns the speed of G00 moves in mm per minute used to estimate how long a program takes.
+        
+        '''
+        
+        return float(self.data.config.get('Advanced Settings', 'rapidRate'))
     
-    def updateOneLine(self):
+    def updateRapidRate(self, *args):
         '''
         
-        Draw the next line on the gcode canvas
+        Rebuilds the time estimate of the open program for a new rapid rate.
         
         '''
-        validPrefixList = ['G00','G0 ','G1 ','G01','G2 ','G02','G3 ','G03']
         
-        self.lineNumber = self.lineNumber + 1
+        estimate = self.data.progressEstimate
+        if estimate is not None:
+            estimate.setRapidRate(self.rapidRate())
+    
+    def startPreflight(self, *args):
+        '''
+        
+        Checks in the background that the machine can make every move of the program with the current
+        machine settings. The moves which it can not are drawn over the toolpath by checkPreflight.
+        
+        '''
+        
+        self.preflight = None
+        
+        if self.loader is not None or len(self.data.gcode) == 0:
+            return
+        
+        self.preflight = PreflightCheck(self.data.gcode, kinematicsFromConfig(self.data.config))
+        self.preflight.start()
+        Clock.schedule_once(self.checkPreflight)
+    
+    def checkPreflight(self, *args):
+        '''
+        
+        Waits for the preflight check to finish and shows what it found.
+        
+        '''
+        
+        preflight = self.preflight
+        if preflight is None:
+            return
         
         try:
-            self.data.gcode[self.lineNumber] = self.moveLine(self.data.gcode[self.lineNumber])    #move the line if the gcode has been moved
-            fullString = self.data.gcode[self.lineNumber]
-        except:
-            return #we have reached the end of the file
+            message = preflight.queue.get_nowait()
+        except Queue.Empty:
+            Clock.schedule_once(self.checkPreflight)
+            return
         
-        fullString = fullString + " " #ensures that there is a space at the end of the line
+        self.preflight = None
         
+        if message[0] == "error" or message[1].program is not self.data.gcode:
+            return
         
-        #find 'G' anywhere in string
-        gString = fullString[fullString.find('G'):fullString.find('G') + 3]
+        report = message[1]
+        self.preflightReport = report
+        self.drawPreflight()
         
-        if gString in validPrefixList:
-            self.prependString = gString
+        if len(report.unreachable) or len(report.lowTension):
+            self.preflightText = report.summary()
+            self.data.message_queue.put("Preflight check: " + report.summary() + "\n")
+        else:
+            self.preflightText = ""
+    
+    def drawPreflight(self):
+        '''
         
-        if fullString.find('G') == -1: #this adds the gcode operator if it is omitted by the program
-            fullString = self.prependString + fullString
-            gString = self.prependString
+        Draws the moves flagged by the preflight check over the toolpath.
         
-        if gString == 'G00' or gString == 'G0 ':
-            self.drawLine(fullString, 'G00')
-
-        if gString == 'G01' or gString == 'G1 ':
-            self.drawLine(fullString, 'G01')
-                    
-        if gString == 'G02' or gString == 'G2 ':
-            self.drawArc(fullString, 'G02')
-                           
-        if gString == 'G03' or gString == 'G3 ':
-            self.drawArc(fullString, 'G03')
-        
-        if gString == 'G18':
-            print "G18 not supported"
-        
-        if gString == 'G20':
-            self.canvasScaleFactor = self.INCHES
-            self.data.units = "INCHES"
-            
-        if gString == 'G21':
-            self.canvasScaleFactor = self.MILLIMETERS
-            self.data.units = "MM"
-            
-        if gString == 'G90':
-            self.absoluteFlag = 1
-            
-        if gString == 'G91':
-            self.absoluteFlag = 0
+        '''
         
-    def callBackMechanism(self, callback) :
+        self.scatterObject.canvas.remove_group('preflight')
+        
+        report = self.preflightReport
+        if report is None:
+            return
+        
+        with self.scatterObject.canvas:
+            PushMatrix(group = 'preflight')
+            Translate(self.offsetX, self.offsetY, group = 'preflight')
+            for points, color in ((report.lowTensionPoints, self.lowTensionColor), (report.unreachablePoints, self.unreachableColor)):
+                Color(*color, group = 'preflight')
+                for vertices, indices in self.meshChunks(points):
+                    Mesh(vertices = vertices, indices = indices, mode = 'lines', group = 'preflight')
+            PopMatrix(group = 'preflight')
+    
+    def startErrorField(self, *args):
         '''
         
-        Call the updateOneLine function periodically in a non-blocking way to
-        update the gcode.
+        Loads or builds the error field for the machine in the current settings in the background.
+        checkErrorField draws it under the toolpath when it is ready. Nothing is built while Show Error
+        Heatmap is turned off, drawErrorField starts the build when it is turned on.
         
         '''
         
-        #Draw numberOfTimesToCall lines on the canvas
-        numberOfTimesToCall = 50
+        self.errorField        = None
+        self.errorFieldBuilder = None
+        self.scatterObject.canvas.before.remove_group('errorfield')
         
-        for _ in range(numberOfTimesToCall):
-            self.updateOneLine()
+        if not self.errorFieldShown():
+            return
         
-        #Repeat until end of file
-        if self.lineNumber < min(len(self.data.gcode),20000):
-            Clock.schedule_once(self.callBackMechanism)
+        self.errorFieldBuilder = ErrorFieldBuilder(sledModelFromConfig(self.data.config), self.errorFieldCache)
+        self.errorFieldBuilder.start()
+        Clock.schedule_once(self.checkErrorField)
     
-    def updateGcode(self, *args):
+    def checkErrorField(self, *args):
         '''
         
-        updateGcode parses the gcode commands and calls the appropriate drawing function for the 
-        specified command. 
+        Waits for the error field to be ready and draws it.
+        
+        '''
+        
+        builder = self.errorFieldBuilder
+        if builder is None:
+            return
+        
+        try:
+            message = builder.queue.get_nowait()
+        except Queue.Empty:
+            Clock.schedule_once(self.checkErrorField)
+            return
+        
+        self.errorFieldBuilder = None
+        
+        if message[0] == "error":
+            print "error field could not be built:"
+            print message[1]
+            return
+        
+        self.errorField = message[1]
+        self.drawErrorField()
+    
+    def errorFieldShown(self):
+        return self.data.config.get('Ground Control Settings', 'showErrorField') == '1'
     
+    def drawErrorField(self, *args):
         '''
         
-        #reset variables 
-        self.xPosition = 0
-        self.yPosition = 0
-        self.zPosition = 0
-
-        self.prependString = "G00 "
-        self.lineNumber = 0
+        Draws the error field as a heatmap under everything else on the canvas if Show Error Heatmap is
+        turned on. The field is one texture stretched over the work area, so it costs the same to draw
+        however fine the grid is.
         
-        self.clearGcode()
+        '''
         
-        #Check to see if file is too large to load
-        if len(self.data.gcode) > 20000:
-            errorText = "The current file contains " + str(len(self.data.gcode)) + "lines of gcode.\nrendering all " +  str(len(self.data.gcode)) + " lines simultaneously may crash the\n program, only the first 20000 lines are shown here.\nThe complete program will cut if you choose to do so."
-            print errorText
-        else:
-            self.callBackMechanism(self.updateGcode)
+        self.scatterObject.canvas.before.remove_group('errorfield')
+        
+        field = self.errorField
+        if not self.errorFieldShown():
+            return
+        
+        if field is None:
+            if self.errorFieldBuilder is None:
+                self.startErrorField()
+            return
+        
+        texture = Texture.create(size = (field.columns, field.rows), colorfmt = 'rgba')
+        texture.blit_buffer(field.heatmap(), colorfmt = 'rgba', bufferfmt = 'ubyte')
+        
+        #each texel is centered on its grid point
+        with self.scatterObject.canvas.before:
+            Color(1, 1, 1, group = 'errorfield')
+            Rectangle(texture = texture, pos = (-field.bedWidth/2 - field.step/2, -field.bedHeight/2 - field.step/2),
+                      size = (field.columns*field.step, field.rows*field.step), group = 'errorfield')
+    
+    def closeReplacedProgram(self, *args):
+        '''
+        
+        Closes the file behind the program which was in data.gcode before it was replaced, so that a
+        memory mapped file is not held open, and read after it has been changed, for as long as the
+        program stays open.
+        
+        '''
+        
+        if self.openProgram is not None and self.openProgram is not self.data.gcode:
+            self.openProgram.close()
+        self.openProgram = self.data.gcode
+    
+    def updateGcode(self, *args):
+        '''
+        
+        updateGcode builds the vertex buffers for a gcode program which was set without going through
+        reloadGcode and draws them. 
+    
+        '''
+        
+        #programs from reloadGcode are already drawn
+        if self.data.gcode is self.loadedProgram:
+            return
         
+        self.cancelLoading()
+        self.startLoading(GcodeLoader(program = self.data.gcode, rapidRate = self.rapidRate()))
@@ -12,6 +12,6 @@ class RunMenu(FloatLayout):
         App.get_running_app().stop()
     
     def returnToCenter(self):
-        self.data.gcode_queue.put("G00 Z0 ")
-        self.data.gcode_queue.put("G00 X0 Y0 Z0 ")
+        self.data.commands.jog(z = 0)
+        self.data.commands.jog(x = 0, y = 0, z = 0)
         self.parentWidget.close()
\ No newline at end of file
@@ -35,6 +35,9 @@ from UIElements.manualControls    import   ManualControl
 from DataStructures.data          import   Data
 from Connection.nonVisibleWidgets import   NonVisibleWidgets
 from UIElements.notificationPopup import   NotificationPopup
+from DataStructures.messageBatch  import   collectMessages
+from Simulation.kinematics        import   KINEMATICSSETTINGS
+from Simulation.batchSimulation   import   SLEDMODELSETTINGS
 '''
 
 Main UI Program
@@ -52,6 +55,21 @@ class GroundControlApp(App):
             "section": "Maslow Settings",
             "key": "COMport"
         },
+        {
+            "type": "options",
+            "title": "Baud Rate",
+            "desc": "The speed of the serial connection to the machine. Must match the firmware.",
+            "section": "Maslow Settings",
+            "key": "baudRate",
+            "options": ["9600", "19200", "38400", "57600", "115200"]
+        },
+        {
+            "type": "bool",
+            "title": "Find Baud Rate",
+            "desc": "Find the fastest baud rate the firmware answers at when connecting instead of using the Baud Rate setting",
+            "section": "Maslow Settings",
+            "key": "autoBaud"
+        },
         {
             "type": "string",
             "title": "Distance Between Motors",
@@ -154,6 +172,41 @@ class GroundControlApp(App):
             "desc": "The number of encoder steps per revolution of the z-axis",
             "section": "Advanced Settings",
             "key": "zEncoderSteps"
+        },
+        {
+            "type": "bool",
+            "title": "Fill Firmware Buffer",
+            "desc": "Send lines ahead while the machine is busy for as long as they fit in the firmware's receive buffer instead of waiting for each line to be acknowledged. Takes effect the next time the machine connects.",
+            "section": "Advanced Settings",
+            "key": "characterCounting"
+        },
+        {
+            "type": "string",
+            "title": "Firmware Buffer Size",
+            "desc": "The size in bytes of the firmware's serial receive buffer, used when Fill Firmware Buffer is on",
+            "section": "Advanced Settings",
+            "key": "firmwareBufferSize"
+        },
+        {
+            "type": "string",
+            "title": "Rapid Rate",
+            "desc": "The speed of G00 moves in mm per minute, used to estimate how long a file will take to cut",
+            "section": "Advanced Settings",
+            "key": "rapidRate"
+        },
+        {
+            "type": "string",
+            "title": "Reconnect Delay",
+            "desc": "The time in seconds to wait before opening the serial port again after the connection is lost. Each attempt which fails doubles the wait, up to five seconds.",
+            "section": "Advanced Settings",
+            "key": "reconnectDelay"
+        },
+        {
+            "type": "bool",
+            "title": "Trace Serial Writes",
+            "desc": "Print every line sent to the machine to the terminal Ground Control was started from. Slows down sending.",
+            "section": "Advanced Settings",
+            "key": "traceSerial"
         }
     ]
     '''
@@ -180,10 +233,26 @@ class GroundControlApp(App):
             "desc": "Valid file extensions for Ground Control to open. Comma separated list.",
             "section": "Ground Control Settings",
             "key": "validExtensions"
+        },
+        {
+            "type": "bool",
+            "title": "Record Telemetry",
+            "desc": "Save every position and error report from the machine to a file in the telemetry folder next to the settings file. The recording can be played back with Diagnostics > Advanced > Replay Telemetry. Takes effect the next time the machine connects.",
+            "section": "Ground Control Settings",
+            "key": "recordTelemetry"
+        },
+        {
+            "type": "bool",
+            "title": "Show Error Heatmap",
+            "desc": "Shade the work area by how far the simulation's sled model puts the bit from where it is sent, from blue for no error to red for the largest error.",
+            "section": "Ground Control Settings",
+            "key": "showErrorField"
         }
     ]
     '''
     
+    consoleWindowLines = 50     #the number of the newest lines of console history which are shown
+    
     def build(self):
         Window.maximize()
         
@@ -220,6 +289,7 @@ class GroundControlApp(App):
         '''
         
         Clock.schedule_interval(self.runPeriodically, .01)
+        self.refreshConsole = Clock.create_trigger(self.updateConsoleText)
         
         '''
         Push settings to machine
@@ -234,6 +304,8 @@ class GroundControlApp(App):
         Set the default values for the config sections.
         """
         config.setdefaults('Maslow Settings', {'COMport': '',
+                                               'baudRate': 19200,
+                                               'autoBaud': 0,
                                                'zAxis': False, 
                                                'zDistPerRot':3.17, 
                                                'bedWidth':2438.4, 
@@ -248,11 +320,18 @@ class GroundControlApp(App):
         config.setdefaults('Advanced Settings', {'encoderSteps': 8148.0,
                                                  'gearTeeth': 10, 
                                                  'chainPitch':6.35,
-                                                 'zEncoderSteps':7550.0})
+                                                 'zEncoderSteps':7550.0,
+                                                 'characterCounting':0,
+                                                 'firmwareBufferSize':64,
+                                                 'rapidRate':1000,
+                                                 'reconnectDelay':.05,
+                                                 'traceSerial':0})
         
         config.setdefaults('Ground Control Settings', {'zoomIn': "pageup",
                                                  'validExtensions':".nc, .ngc, .text, .gcode",
-                                                 'zoomOut': "pagedown"})
+                                                 'zoomOut': "pagedown",
+                                                 'recordTelemetry':0,
+                                                 'showErrorField':0})
 
     def build_settings(self, settings):
         """
@@ -267,13 +346,29 @@ class GroundControlApp(App):
         Respond to changes in the configuration.
         """
         
-        if section == "Maslow Settings":
+        if section == "Maslow Settings" and key in ("baudRate", "autoBaud"):
+            self.data.serialPort.reopen()
+        
+        elif section == "Maslow Settings":
             if key == "COMport":
                 self.data.comport = value
             self.push_settings_to_machine()
 
             if (key == "bedHeight" or key == "bedWidth"):
                 self.frontpage.gcodecanvas.drawWorkspace()
+            
+            #the reach of the machine and the error of the sled depend on its dimensions
+            if key in KINEMATICSSETTINGS:
+                self.frontpage.gcodecanvas.startPreflight()
+            if key in SLEDMODELSETTINGS:
+                self.frontpage.gcodecanvas.startErrorField()
+        
+        if section == "Advanced Settings" and key == "rapidRate":
+            self.frontpage.gcodecanvas.updateRapidRate()
+            self.frontpage.onIndexMove(None, self.data.gcodeIndex)
+        
+        if section == "Ground Control Settings" and key == "showErrorField":
+            self.frontpage.gcodecanvas.drawErrorField()
 
     def close_settings(self, settings):
         """
@@ -300,7 +395,7 @@ class GroundControlApp(App):
             + " "
         )
         
-        self.data.gcode_queue.put(cmdString)
+        self.data.commands.put(cmdString)
     
     '''
     
@@ -309,9 +404,18 @@ class GroundControlApp(App):
     '''
     
     def writeToTextConsole(self, message):
+        self.data.console.write(message)
+        self.refreshConsole()
+    
+    def updateConsoleText(self, *args):
+        '''
+        
+        Shows the newest lines of the console history. Called at most once per frame however many
+        messages were written.
+        
+        '''
         try:
-            newText = self.frontpage.consoleText[-3000:] + message
-            self.frontpage.consoleText = newText
+            self.frontpage.consoleText = self.data.console.tail(self.consoleWindowLines)
             self.frontpage.textconsole.gotToBottom()  
         except:
             self.frontpage.consoleText = "text not displayed correctly"
@@ -320,25 +424,29 @@ class GroundControlApp(App):
         '''
         this block should be handled within the appropriate widget
         '''
-        while not self.data.message_queue.empty(): #if there is new data to be read
-            message = self.data.message_queue.get()
-            
+        batch = collectMessages(self.data.message_queue)
+        
+        for message in batch.messages:
             self.data.logger.writeToLog(message)
-            
-            if message[0] == "<":
-                self.setPosOnScreen(message)
-            elif message[0] == "[":
-                if message[1:10] == "PosError:":
-                    self.setErrorOnScreen(message)
-            elif message[0:8] == "Message:":
-                self.previousUploadStatus = self.data.uploadFlag 
-                self.data.uploadFlag = 0
-                content = NotificationPopup(continueOn = self.dismiss_popup_continue, hold=self.dismiss_popup_hold , text = message[9:])
-                self._popup = Popup(title="Notification: ", content=content,
-                            auto_dismiss=False, size_hint=(0.35, 0.35))
-                self._popup.open()
-            else:
-                self.writeToTextConsole(message)
+        
+        if batch.consoleText:
+            self.writeToTextConsole(batch.consoleText)
+        
+        if batch.position is not None:
+            self.setPosOnScreen(batch.position)
+        
+        for report in batch.errors:
+            self.data.logger.writeErrorValueToLog(report.left)
+        if batch.errors:
+            self.frontpage.gcodecanvas.positionIndicator.setError(batch.errors[-1].left)
+        
+        if batch.notification is not None:
+            self.previousUploadStatus = self.data.uploadFlag 
+            self.data.uploadFlag = 0
+            content = NotificationPopup(continueOn = self.dismiss_popup_continue, hold=self.dismiss_popup_hold , text = batch.notification[9:])
+            self._popup = Popup(title="Notification: ", content=content,
+                        auto_dismiss=False, size_hint=(0.35, 0.35))
+            self._popup.open()
     
     def dismiss_popup_continue(self):
         '''
@@ -358,57 +466,27 @@ class GroundControlApp(App):
         self._popup.dismiss()
         self.data.uploadFlag = 0 #stop cutting
     
-    def setPosOnScreen(self, message):
+    def setPosOnScreen(self, report):
         '''
         
         This should be moved into the appropriate widget
         
         '''
         
-        try:
-            startpt = message.find('MPos:') + 5
-            
-            endpt = message.find('WPos:')
-            
-            numz  = message[startpt:endpt]
-            units = "mm" #message[endpt+1:endpt+3]
-            
-            valz = numz.split(",")
-            
-            xval  = float(valz[0])
-            yval  = float(valz[1])
-            zval  = float(valz[2])
-            
-            if math.isnan(xval):
-                self.writeToTextConsole("Unable to resolve x Kinematics.")
-                xval = 0
-            if math.isnan(yval):
-                self.writeToTextConsole("Unable to resolve y Kinematics.")
-                yval = 0
-            if math.isnan(zval):
-                self.writeToTextConsole("Unable to resolve z Kinematics.")
-                zval = 0
-        except:
-            print "bad data"
-            return
+        xval, yval, zval = report
+        
+        if math.isnan(xval):
+            self.writeToTextConsole("Unable to resolve x Kinematics.")
+            xval = 0
+        if math.isnan(yval):
+            self.writeToTextConsole("Unable to resolve y Kinematics.")
+            yval = 0
+        if math.isnan(zval):
+            self.writeToTextConsole("Unable to resolve z Kinematics.")
+            zval = 0
         
         self.frontpage.setPosReadout(xval,yval,zval)
         self.frontpage.gcodecanvas.positionIndicator.setPos(xval,yval,self.data.units)
     
-    def setErrorOnScreen(self, message):
-        
-        try:
-            startpt = message.find(':')+1 
-            endpt = message.find(',', startpt)
-            errorValueAsString = message[startpt:endpt]
-            errorValueAsFloat  = float(errorValueAsString)
-            
-            self.frontpage.gcodecanvas.positionIndicator.setError(errorValueAsFloat)
-            self.data.logger.writeErrorValueToLog(errorValueAsFloat)
-        except:
-            print "unable to read error value"
-        
-        
-    
 if __name__ == '__main__':
     GroundControlApp().run()